@@ -551,7 +551,7 @@ class HydroprintGUI(myqt.DialogWindow):
             self.hydrograph.draw_ylabels()
         elif sender in [self.date_start_widget, self.date_end_widget]:
             self.hydrograph.set_time_scale()
-            self.hydrograph.draw_weather()
+            self.hydrograph.draw_time_series()
             self.hydrograph.draw_figure_title()
         elif sender == self.dateDispFreq_spinBox:
             self.hydrograph.set_time_scale()
@@ -570,7 +570,7 @@ class HydroprintGUI(myqt.DialogWindow):
             self.hydrograph.draw_ylabels()
         elif sender == self.time_scale_label:
             self.hydrograph.set_time_scale()
-            self.hydrograph.draw_weather()
+            self.hydrograph.draw_time_series()
         else:
             print('No action for this widget yet.')
 
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+"""
+Evaluate groundwater recharge with GLUE for all the water level datasets of
+a project without the graphical interface, for example with:
+
+    python -m gwhat.gwrecharge.batch project.gwt --nworkers 8
+"""
+
+# ---- Standard library imports
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# ---- Third party imports
+
+import numpy as np
+
+# ---- Local imports
+
+from gwhat.projet.reader_projet import ProjetReader
+from gwhat.gwrecharge.gwrecharge_calc2 import (
+    RechgEvalWorker, eval_recharge_multiwell)
+from gwhat.hydrograph4 import LatLong2Dist
+
+# The default GLUE parameters, which are the same as the default values of
+# the recharge calibration setup widget.
+DEFAULT_PARAMS = {'Sy': (0.05, 0.2), 'RASmax': (5, 40), 'Cro': (0.1, 0.3),
+                  'TMELT': 0, 'CM': 4, 'deltat': 0}
+
+WLDSET_KEYS = ['Time', 'WL', 'mrc/params', 'mrc/time', 'mrc/recess',
+               'Well', 'Well ID', 'Province', 'Latitude', 'Longitude',
+               'Elevation', 'Municipality']
+WXDSET_KEYS = ['Time', 'Year', 'Month', 'Day', 'Tmax', 'Tmin', 'Tavg',
+               'Ptot', 'Rain', 'PET', 'Station Name', 'Climate Identifier',
+               'Province', 'Latitude', 'Longitude', 'Elevation']
+GLUEDF_KEYS = ['params', 'ranges', 'mrc', 'daily budget', 'water levels',
+               'state']
+
+
+def pair_wldsets_with_wxdsets(projet, wldset_names=None, wxdset_name=None):
+    """
+    Return a list of (wldset name, wxdset name) tuples pairing the water
+    level datasets of the project with a weather dataset. Each water level
+    dataset is paired with the closest weather dataset, unless the name of
+    a weather dataset is provided.
+    """
+    if wldset_names is None:
+        wldset_names = projet.wldsets
+    wxdsets = [projet.get_wxdset(name) for name in projet.wxdsets]
+    if not wxdsets:
+        return []
+
+    pairs = []
+    for wlname in wldset_names:
+        if wxdset_name is not None:
+            pairs.append((wlname, wxdset_name))
+            continue
+        wldset = projet.get_wldset(wlname)
+        closest = min(wxdsets, key=lambda wxdset: LatLong2Dist(
+            wldset['Latitude'], wldset['Longitude'],
+            wxdset['Latitude'], wxdset['Longitude']))
+        pairs.append((wlname, closest.name))
+    return pairs
+
+
+def get_glue_params(wldset, **kwargs):
+    """
+    Return the GLUE parameters for a water level dataset. The parameters
+    that were used to produce the last GLUE results saved for the dataset
+    are used if any, else the default ones. The values passed in kwargs
+    override them.
+    """
+    params = DEFAULT_PARAMS.copy()
+    gluedf = wldset.get_glue_at(-1)
+    if gluedf is not None:
+        for key, rkey in [('Sy', 'Sy'), ('Cro', 'Cro'),
+                          ('RASmax', 'RASmax')]:
+            params[key] = tuple(gluedf['ranges'][rkey])
+        params['TMELT'] = gluedf['params']['tmelt']
+        params['CM'] = gluedf['params']['CM']
+        params['deltat'] = gluedf['params']['deltat']
+    params.update({k: v for k, v in kwargs.items() if v is not None})
+    return params
+
+
+def eval_recharge_for_wldset(wldset, wxdset, params, verbose=False):
+    """
+    Evaluate recharge with GLUE for a water level and a weather dataset,
+    that can be either dicts or datasets read from a project, with the GLUE
+    parameters and RechgEvalWorker settings provided in params.
+
+    Return the GLUEDataFrame and an error message, which is None if
+    recharge was evaluated successfully.
+    """
+    worker = RechgEvalWorker()
+    for key, value in params.items():
+        setattr(worker, key, value)
+
+    error = worker.load_data(wxdset, wldset)
+    if error is not None:
+        return None, error
+
+    if verbose:
+        gluedf = worker.eval_recharge()
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            gluedf = worker.eval_recharge()
+    if gluedf is None:
+        return None, ("All the models produced were deemed "
+                      "non-behavioural.")
+    return gluedf, None
+
+
+def eval_recharge_jointly(wldsets, wxdset, params_list):
+    """
+    Evaluate recharge with GLUE jointly for several water level datasets
+    that share the same weather dataset and GLUE parameters, except for Sy
+    and deltat, so that the surface water budget is computed only once for
+    all of them (see eval_recharge_multiwell).
+
+    Return a list with the GLUEDataFrame and the error message of each
+    water level dataset.
+    """
+    workers = []
+    outputs = []
+    for wldset, params in zip(wldsets, params_list):
+        worker = RechgEvalWorker()
+        for key, value in params.items():
+            setattr(worker, key, value)
+        error = worker.load_data(wxdset, wldset)
+        outputs.append([None, error])
+        if error is None:
+            workers.append(worker)
+
+    if workers:
+        with contextlib.redirect_stdout(io.StringIO()):
+            gluedfs = iter(eval_recharge_multiwell(workers))
+        for output in outputs:
+            if output[1] is None:
+                output[0] = next(gluedfs)
+                if output[0] is None:
+                    output[1] = ("All the models produced were deemed "
+                                 "non-behavioural.")
+    return [tuple(output) for output in outputs]
+
+
+def update_recharge_for_wldset(wldset, wxdset, gluedf):
+    """
+    Update the GLUE results gluedf of a water level dataset with the data
+    that were appended to the water level and weather datasets since these
+    results were computed (see RechgEvalWorker.update_recharge).
+
+    Return the updated GLUEDataFrame and an error message, which is None if
+    the results were updated successfully.
+    """
+    if gluedf is None:
+        return None, "There are no GLUE results with a saved state to update."
+    worker = RechgEvalWorker()
+    worker.deltat = gluedf['params']['deltat']
+    error = worker.load_data(wxdset, wldset)
+    if error is not None:
+        return None, error
+    try:
+        return worker.update_recharge(gluedf), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def _read_glue_to_update(wldset):
+    """
+    Return a dict with the last GLUE results saved for a water level
+    dataset that are required to update them, or None if there are no
+    results or if the state of their behavioural models was not saved.
+    """
+    gluedf = wldset.get_glue_at(-1)
+    if gluedf is None:
+        return None
+    try:
+        data = {key: gluedf[key] for key in GLUEDF_KEYS}
+    except KeyError:
+        return None
+    for key in ['weights', 'quantiles']:
+        if key in gluedf:
+            data[key] = gluedf[key]
+    return data
+
+
+def _update_recharge_task(wldsets, wxdset, gluedfs):
+    """Update GLUE results in a worker process of the pool."""
+    return [update_recharge_for_wldset(wldset, wxdset, gluedf)
+            for wldset, gluedf in zip(wldsets, gluedfs)]
+
+
+def _eval_recharge_task(wldsets, wxdset, params_list):
+    """Evaluate recharge in a worker process of the pool."""
+    if len(wldsets) == 1:
+        return [eval_recharge_for_wldset(wldsets[0], wxdset, params_list[0])]
+    return eval_recharge_jointly(wldsets, wxdset, params_list)
+
+
+def _joint_group_key(wxname, params):
+    """
+    Return a key that is the same for the water level datasets that can be
+    evaluated jointly.
+    """
+    return (wxname, repr(sorted(
+        (key, np.asarray(value).tolist()) for key, value in params.items()
+        if key not in ['Sy', 'deltat'])))
+
+
+def eval_recharge_for_projet(filename, wldset_names=None, wxdset_name=None,
+                             nworkers=None, verbose=False, joint=False,
+                             update=False, **kwargs):
+    """
+    Evaluate groundwater recharge with GLUE for the water level datasets of
+    the project saved in filename, with a pool of nworkers processes
+    that each evaluate one dataset at a time. The results are saved in the
+    project in place of the previous GLUE results of each dataset.
+
+    If joint is True, the datasets that are paired with the same weather
+    dataset and that share the same GLUE parameters, except for Sy and
+    deltat, are evaluated jointly by the same process, so that the surface
+    water budget is computed only once for all of them.
+
+    If update is True, the last GLUE results saved for each dataset are
+    updated with the data that were appended to the datasets since they
+    were computed, instead of computing GLUE again (see
+    update_recharge_for_wldset).
+
+    The GLUE parameters (Sy, RASmax, Cro, TMELT, CM, deltat) and any other
+    RechgEvalWorker setting can be passed as keyword arguments.
+
+    Return a dict with the error message of each dataset, which is None if
+    recharge was evaluated successfully.
+    """
+    projet = ProjetReader(filename)
+    pairs = pair_wldsets_with_wxdsets(projet, wldset_names, wxdset_name)
+
+    # The data are read from the project here and sent to the workers,
+    # since only this process can access the project file.
+    groups = {}
+    wxdsets = {}
+    for wlname, wxname in pairs:
+        wldset = projet.get_wldset(wlname)
+        if wxname not in wxdsets:
+            wxdset = projet.get_wxdset(wxname)
+            wxdsets[wxname] = {key: wxdset[key] for key in WXDSET_KEYS}
+        if update:
+            params = _read_glue_to_update(wldset)
+            group_key = wlname
+        else:
+            params = get_glue_params(wldset, **kwargs)
+            group_key = _joint_group_key(wxname, params) if joint else wlname
+        group = groups.setdefault(group_key, (wxname, [], [], []))
+        group[1].append(wlname)
+        group[2].append({key: wldset[key] for key in WLDSET_KEYS})
+        group[3].append(params)
+
+    errors = {}
+    nworkers = nworkers or os.cpu_count()
+    task = _update_recharge_task if update else _eval_recharge_task
+    with ProcessPoolExecutor(max_workers=nworkers) as executor:
+        futures = {executor.submit(
+            task, wldsets, wxdsets[wxname], params_list):
+            wlnames for wxname, wlnames, wldsets, params_list in
+            groups.values()}
+        for future in as_completed(futures):
+            wlnames = futures[future]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                outputs = [(None, str(e))] * len(wlnames)
+            for wlname, (gluedf, error) in zip(wlnames, outputs):
+                errors[wlname] = error
+                if gluedf is not None:
+                    wldset = projet.get_wldset(wlname)
+                    wldset.clear_glue()
+                    wldset.save_glue(gluedf)
+                if verbose:
+                    print('[%d/%d] %s: %s' % (
+                        len(errors), len(pairs), wlname, error or
+                        '%d behavioural models' % gluedf['count']))
+    projet.close_projet()
+    return errors
+
+
+def main(args=None):
+    """Evaluate recharge for all the wells of a project from the console."""
+    parser = argparse.ArgumentParser(
+        description=("Evaluate groundwater recharge with GLUE for all the "
+                     "water level datasets of a GWHAT project."))
+    parser.add_argument('filename', help="The path of the .gwt project file.")
+    parser.add_argument('--wldsets', nargs='+', default=None,
+                        help="The names of the water level datasets to "
+                             "process (all of them by default).")
+    parser.add_argument('--wxdset', default=None,
+                        help="The name of the weather dataset to use for all "
+                             "wells (the closest one by default).")
+    parser.add_argument('--nworkers', type=int, default=None,
+                        help="The number of processes to use.")
+    parser.add_argument('--joint', action='store_true',
+                        help="Evaluate jointly the wells that share the "
+                             "same weather station and GLUE parameters.")
+    parser.add_argument('--update', action='store_true',
+                        help="Update the last GLUE results of each well with "
+                             "the data appended since they were computed.")
+    parser.add_argument('--sy', type=float, nargs=2, dest='Sy')
+    parser.add_argument('--rasmax', type=float, nargs=2, dest='RASmax')
+    parser.add_argument('--cro', type=float, nargs=2, dest='Cro')
+    parser.add_argument('--tmelt', type=float, dest='TMELT')
+    parser.add_argument('--cm', type=float, dest='CM')
+    parser.add_argument('--deltat', type=float, dest='deltat')
+    parser.add_argument('--resolution', choices=['rough', 'fine'],
+                        dest='glue_pardist_res')
+    args = vars(parser.parse_args(args))
+
+    time_start = time.time()
+    errors = eval_recharge_for_projet(
+        args.pop('filename'), args.pop('wldsets'), args.pop('wxdset'),
+        args.pop('nworkers'), verbose=True, **args)
+    print("Recharge evaluated for %d of %d wells in %0.1f s" % (
+        sum(error is None for error in errors.values()), len(errors),
+        time.time() - time_start))
+    return 0 if all(error is None for error in errors.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
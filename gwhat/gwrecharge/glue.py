@@ -9,7 +9,6 @@
 
 # ---- Standard library imports
 
-from calendar import monthrange
 from collections.abc import Mapping
 from abc import abstractmethod
 from time import strftime
@@ -23,9 +22,22 @@ from xlrd import xldate_as_tuple
 # ---- Local imports
 
 from gwhat.common.utils import save_content_to_file
-from gwhat.utils.math import nan_as_text_tolist
+from gwhat.utils.math import nan_as_text_tolist, find_time_slice
+from gwhat.utils.aggregate import PeriodGroups
+from gwhat.gwrecharge.glue_sketch import WeightedQuantileSketch
 from gwhat import __namever__
 
+# The number of values that are sorted at once to compute the GLUE limits.
+GLUE_BLOCKSIZE = 2**21
+
+# The probabilities at which the daily GLUE values are computed and saved,
+# so that the GLUE values for any other probabilities can be interpolated
+# from them. The grid is finer in the tails, so that the usual limits of
+# 2.5, 5, 10, 90, 95 and 97.5% are all on it.
+GLUE_QUANTILES = np.round(np.concatenate([
+    np.arange(0, 0.05, 0.005), np.arange(0.05, 0.95, 0.025),
+    np.arange(0.95, 1.0001, 0.005)]), 3)
+
 
 class GLUEDataFrameBase(Mapping):
     """
@@ -42,6 +54,88 @@ class GLUEDataFrameBase(Mapping):
         """Load glue data and save it in a store."""
         pass
 
+    def get(self, key, tmin=None, tmax=None):
+        """
+        Return the values at key for the times between tmin and tmax. The
+        arrays of the 'daily budget' and 'water levels' whose first
+        dimension matches their 'time' are sliced, while the other values
+        are returned whole.
+        """
+        values = self[key]
+        if not isinstance(values, dict) or 'time' not in values:
+            return values
+        time = np.asarray(values['time'])
+        indexes = find_time_slice(time, tmin, tmax)
+        return {name: (value[indexes] if
+                       np.shape(value)[:1] == time.shape else value)
+                for name, value in values.items()}
+
+    def glue_at(self, p, variable='recharge', period='daily'):
+        """
+        Return the GLUE values of variable for the probabilities p, for each
+        day, month, year or hydrological year depending on period, in
+        arrays shaped like those of the corresponding budgets. variable is
+        either 'recharge', 'evapo', 'runoff' or 'water levels', whose values
+        are only available daily.
+        """
+        p = list(np.atleast_1d(p).astype(float))
+        if variable == 'water levels':
+            if period != 'daily':
+                raise ValueError("The water levels are only available "
+                                 "for the daily period.")
+            return self._calcul_glue_wl_at(p)
+        if variable not in ['recharge', 'evapo', 'runoff']:
+            raise ValueError("variable must be one of 'recharge', 'evapo', "
+                             "'runoff' or 'water levels'.")
+
+        glue_dly = self._calcul_glue_dly_at(p)
+        if period == 'daily':
+            return glue_dly[variable]
+        elif period == 'monthly':
+            return calcul_mly_budget(glue_dly)[variable]
+        elif period == 'yearly':
+            return calcul_yrly_budget(calcul_mly_budget(glue_dly))[variable]
+        elif period == 'hydro yearly':
+            return calcul_hydro_yrly_budget(glue_dly)[variable]
+        else:
+            raise ValueError("period must be one of 'daily', 'monthly', "
+                             "'yearly' or 'hydro yearly'.")
+
+    def _calcul_glue_dly_at(self, p):
+        """
+        Return the daily budget for the probabilities p, which are
+        interpolated in the saved daily quantiles. For the results that
+        were saved without these, p must be among the GLUE limits of the
+        saved daily budget.
+        """
+        if 'quantiles' in self:
+            glue_dly = dict(self['quantiles']['daily budget'])
+            for var in ['recharge', 'evapo', 'runoff']:
+                glue_dly[var] = interp_glue_limits(
+                    glue_dly['GLUE limits'], glue_dly[var], p)
+        else:
+            glue_dly = dict(self['daily budget'])
+            indexes = find_glue_limits(glue_dly['GLUE limits'], p)
+            for var in ['recharge', 'evapo', 'runoff']:
+                glue_dly[var] = glue_dly[var][:, indexes]
+        glue_dly['GLUE limits'] = p
+        return glue_dly
+
+    def _calcul_glue_wl_at(self, p):
+        """
+        Return the predicted water levels for the probabilities p, which
+        are interpolated in the saved quantiles of the water levels. For
+        the results that were saved without these, p must be among the
+        GLUE limits of the saved water levels.
+        """
+        if 'quantiles' in self:
+            glue_wl = self['quantiles']['water levels']
+            return interp_glue_limits(
+                glue_wl['GLUE limits'], glue_wl['predicted'], p)
+        glue_wl = self['water levels']
+        indexes = find_glue_limits(glue_wl['GLUE limits'], p)
+        return glue_wl['predicted'][:, indexes]
+
     def save_mly_glue_budget_to_file(self, filename):
         """
         Save the montlhy water budget results evaluated with GLUE to a file.
@@ -171,31 +265,56 @@ class GLUEDataFrame(GLUEDataFrameBase):
     """
     A class for calculating GLUE from a set of behavioural models and to store
     the results in a standardized way.
+
+    The GLUE budgets and water levels are only computed on their first
+    access and are then memoised in the store. The realizations of the
+    behavioural models are kept until release_data is called, so that
+    glue_at can compute the GLUE values for any probabilities. After that,
+    glue_at interpolates them in the daily quantiles computed for
+    GLUE_QUANTILES, which are saved with the results.
     """
+    # The products that are computed on first access, with the name of the
+    # product from which each is computed (None for the products that are
+    # computed from the realizations of the behavioural models).
+    PRODUCTS = {'quantiles': None,
+                'daily budget': 'quantiles',
+                'monthly budget': 'daily budget',
+                'yearly budget': 'monthly budget',
+                'hydrol yearly budget': 'daily budget',
+                'water levels': 'quantiles'}
+
     def __init__(self, data, *args, **kwargs):
         super(GLUEDataFrame, self).__init__(*args, **kwargs)
         self.__load_data__(data)
 
     def __getitem__(self, key):
         """Return the value saved in the store at key."""
+        if key not in self.store and key in self.PRODUCTS:
+            self.store[key] = self._calcul_product(key)
         return self.store.__getitem__(key)
 
     def __setitem__(self, key, value):
         raise NotImplementedError
 
+    def __contains__(self, key):
+        return key in self.store or key in self.PRODUCTS
+
     def __iter__(self):
-        return self.store.__iter__()
+        keys = list(self.store.keys())
+        keys.extend(key for key in self.PRODUCTS if key not in self.store)
+        return iter(keys)
 
     def __len__(self):
-        return self.store.__len__()
+        return len(list(self.__iter__()))
 
     def __load_data__(self, data):
         """
-        Take the results of a set of behavioural models, calculate the GLUE
-        results for the typical confidence intervals and save the results in
-        the store.
+        Take the results of a set of behavioural models and save them in
+        the store, so that the GLUE results for the typical confidence
+        intervals can be computed from them when they are first accessed.
         """
         self.store = {}
+        self._data = data
 
         # Store the model distribution info.
         self.store['count'] = data['count']
@@ -210,54 +329,304 @@ class GLUEDataFrame(GLUEDataFrameBase):
         # Store the Master Recession Curve parameters and simulated values.
         self.store['mrc'] = data['mrc']
 
-        # Calcul daily, monthly, and yearly GLUE values of all the computed
-        # components of the water budget.
-        self.store['daily budget'] = calcul_dly_budget(
-            data, [0.05, 0.25, 0.5, 0.75, 0.95])
-        self.store['monthly budget'] = calcul_mly_budget(
-            self.store['daily budget'])
-        self.store['yearly budget'] = calcul_yrly_budget(
-            self.store['monthly budget'])
-        self.store['hydrol yearly budget'] = calcul_hydro_yrly_budget(
-            self.store['daily budget'])
-
-        # Calcul daily GLUE values for the water levels and store the results
-        # along with the oberved values.
-        grp = self.store['water levels'] = {}
-        grp['time'] = data['water levels']['time']
-        grp['observed'] = data['water levels']['observed']
-        grp['GLUE limits'] = [0.05, 0.5, 0.95]
-        grp['predicted'] = calcul_glue(
-            data, grp['GLUE limits'], varname='hydrograph')
+        # Store the state of the behavioural models at the end of the data.
+        if 'state' in data:
+            self.store['state'] = data['state']
+
+        # Store the RMSE that were used to weight the behavioural models
+        # over each period of results that were updated with new data.
+        if 'weights' in data:
+            self.store['weights'] = data['weights']
+
+    def invalidate(self, key=None):
+        """
+        Clear the memoised product at key, or all of them if key is None,
+        along with the products that are computed from it, so that they are
+        computed again on their next access. The products that are computed
+        from the realizations are kept after these were released.
+        """
+        keys = list(self.PRODUCTS) if key is None else [key]
+        while keys:
+            key = keys.pop()
+            if self.PRODUCTS[key] is None and self._data is None:
+                continue
+            self.store.pop(key, None)
+            keys.extend(k for k, v in self.PRODUCTS.items() if v == key)
+
+    def release_data(self, keep_sorted=False):
+        """
+        Compute the products that depend on the realizations of the
+        behavioural models and release the reference to these, so that
+        they can be closed or freed.
+
+        If keep_sorted is True, the realizations of each day are sorted
+        instead in a SortedRealizations that is kept, so that glue_at can
+        still compute the exact GLUE values for any probabilities instead
+        of interpolating them in the daily quantiles.
+        """
+        for key, source in self.PRODUCTS.items():
+            if source is None:
+                self[key]
+        if keep_sorted:
+            data = dict(self._data)
+            weights = calcul_glue_weights(data['RMSE'])
+            for var in ['recharge', 'etr', 'ru', 'hydrograph']:
+                if not isinstance(data[var], (WeightedQuantileSketch,
+                                              GLUELimits,
+                                              SortedRealizations)):
+                    data[var] = SortedRealizations(data[var], weights)
+            self._data = data
+        else:
+            self._data = None
+
+    def _calcul_glue_dly_at(self, p):
+        if self._data is None:
+            return super(GLUEDataFrame, self)._calcul_glue_dly_at(p)
+        return calcul_dly_budget(self._data, p)
+
+    def _calcul_glue_wl_at(self, p):
+        if self._data is None:
+            return super(GLUEDataFrame, self)._calcul_glue_wl_at(p)
+        return calcul_glue(self._data, p, varname='hydrograph')
+
+    def _calcul_product(self, key):
+        """Calcul the GLUE product at key."""
+        if key == 'quantiles':
+            # The realizations of each day are sorted only once to compute
+            # the values for all the probabilities. The GLUE limits that
+            # were already computed for a variable (see GLUELimits) are
+            # used as they are.
+            dly_limits = getattr(
+                self._data['recharge'], 'glue_limits', GLUE_QUANTILES)
+            wl_limits = getattr(
+                self._data['hydrograph'], 'glue_limits', GLUE_QUANTILES)
+            return {'daily budget': calcul_dly_budget(
+                        self._data, np.array(dly_limits)),
+                    'water levels': {
+                        'time': self._data['water levels']['time'],
+                        'observed': self._data['water levels']['observed'],
+                        'GLUE limits': np.array(wl_limits),
+                        'predicted': calcul_glue(
+                            self._data, wl_limits, varname='hydrograph')}}
+        elif key == 'daily budget':
+            glue_dly = dict(self['quantiles']['daily budget'])
+            for var in ['recharge', 'evapo', 'runoff']:
+                glue_dly[var] = interp_glue_limits(
+                    glue_dly['GLUE limits'], glue_dly[var], self.GLUE_LIMITS)
+            glue_dly['GLUE limits'] = list(self.GLUE_LIMITS)
+            return glue_dly
+        elif key == 'monthly budget':
+            return calcul_mly_budget(self['daily budget'])
+        elif key == 'yearly budget':
+            return calcul_yrly_budget(self['monthly budget'])
+        elif key == 'hydrol yearly budget':
+            return calcul_hydro_yrly_budget(self['daily budget'])
+        elif key == 'water levels':
+            grp = dict(self['quantiles']['water levels'])
+            grp['GLUE limits'] = [0.05, 0.5, 0.95]
+            grp['predicted'] = interp_glue_limits(
+                self['quantiles']['water levels']['GLUE limits'],
+                grp['predicted'], grp['GLUE limits'])
+            return grp
+
+
+class GLUELimits(object):
+    """
+    The daily GLUE limits of a variable that were already computed, for
+    example when GLUE results are updated with new data
+    (see RechgEvalWorker.update_recharge).
+    """
+
+    def __init__(self, glue_limits, values):
+        self.glue_limits = list(glue_limits)
+        self.values = np.asarray(values)
+
+    def quantiles(self, p):
+        """Return the GLUE limits for the probabilities p."""
+        return self.values[:, find_glue_limits(self.glue_limits, p)]
+
+
+def find_glue_limits(glue_limits, p):
+    """
+    Return the indexes of the probabilities p in glue_limits, or raise a
+    ValueError if any of them is not in glue_limits.
+    """
+    indexes = []
+    for pk in np.atleast_1d(p):
+        index = np.where(np.isclose(glue_limits, pk))[0]
+        if len(index) == 0:
+            raise ValueError("The GLUE limits are only available for %s."
+                             % list(glue_limits))
+        indexes.append(index[0])
+    return indexes
+
+
+def interp_glue_limits(glue_limits, values, p):
+    """
+    Return the values for the probabilities p, taken along the last axis of
+    values for those that are among glue_limits and interpolated linearly
+    between the two nearest GLUE limits for the others. Raise a ValueError
+    if any of p is outside the range of glue_limits.
+    """
+    glue_limits = np.asarray(glue_limits, dtype=float)
+    values = np.asarray(values)
+    interp = []
+    for pk in np.atleast_1d(p):
+        index = np.where(np.isclose(glue_limits, pk))[0]
+        if len(index) > 0:
+            interp.append(values[..., index[0]])
+            continue
+        k = np.searchsorted(glue_limits, pk)
+        if k == 0 or k == len(glue_limits):
+            raise ValueError(
+                "The GLUE values are only available for probabilities "
+                "between %s and %s." % (glue_limits[0], glue_limits[-1]))
+        w = (pk - glue_limits[k - 1]) / (glue_limits[k] - glue_limits[k - 1])
+        interp.append((1 - w) * values[..., k - 1] + w * values[..., k])
+    return np.stack(interp, axis=-1)
+
+
+class SortedRealizations(object):
+    """
+    The realizations of a variable for a set of behavioural models, with the
+    realizations of each day sorted along with the cumulative sum of
+    their weights, so that the weighted quantiles of each day can be
+    computed for any probabilities without sorting them again.
+    """
+
+    def __init__(self, x, weights):
+        nreal, ntime = np.shape(x)
+        self.values = np.empty((ntime, nreal), dtype=np.asarray(x).dtype)
+        self.cdf = np.empty((ntime, nreal))
+        blocksize = max(GLUE_BLOCKSIZE // max(nreal, 1), 1)
+        for start in range(0, ntime, blocksize):
+            stop = start + blocksize
+            self.values[start:stop], self.cdf[start:stop] = (
+                sort_weighted_values(np.asarray(x[:, start:stop]), weights))
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes allocated for the sorted values."""
+        return self.values.nbytes + self.cdf.nbytes
+
+    def quantiles(self, p):
+        """
+        Return an array of shape (number of days, len(p)) with the weighted
+        quantiles of each day for the probabilities p.
+        """
+        ntime, nreal = self.values.shape
+        q = np.zeros((ntime, len(p)))
+        blocksize = max(GLUE_BLOCKSIZE // max(nreal, 1), 1)
+        for start in range(0, ntime, blocksize):
+            stop = start + blocksize
+            q[start:stop] = interp_weighted_quantiles(
+                self.values[start:stop], self.cdf[start:stop], p)
+        return q
 
 
 def calcul_glue(data, glue_limits, varname='recharge'):
     """
     Calcul recharge for the provided GLUE uncertainty limits from a set of
-    behavioural models.
+    behavioural models. The realizations of varname are either saved in a
+    2D array, sorted in a SortedRealizations or summarized in a
+    WeightedQuantileSketch, or their GLUE limits were already computed and
+    are provided in a GLUELimits.
     """
     if varname not in ['recharge', 'etr', 'ru', 'hydrograph']:
         raise ValueError("varname value must be",
                          ['recharge', 'etr', 'ru', 'hydrograph'])
-    x = np.array(data[varname])
-    _, ntime = np.shape(x)
+    if isinstance(data[varname], (WeightedQuantileSketch, GLUELimits,
+                                  SortedRealizations)):
+        return data[varname].quantiles(glue_limits)
+    x = data[varname]
+    nreal, ntime = np.shape(x)
 
-    rmse = 1/np.array(data['RMSE'])
-    # Rescale the RMSE so the sum of all values equal 1.
-    rmse = rmse/np.sum(rmse)
+    rmse = calcul_glue_weights(data['RMSE'])
 
+    # The days are processed by blocks, so that the sorted realizations
+    # of a block hold in about GLUE_BLOCKSIZE values.
     glue = np.zeros((ntime, len(glue_limits)))
-    for i in range(ntime):
-        # Sort predicted values.
-        isort = np.argsort(x[:, i])
-        # Compute the Cumulative Density Function.
-        cdf = np.cumsum(rmse[isort])
-        # Get GLUE values for the p confidence intervals.
-        glue[i, :] = np.interp(glue_limits, cdf, x[isort, i])
-
+    blocksize = max(GLUE_BLOCKSIZE // max(nreal, 1), 1)
+    for start in range(0, ntime, blocksize):
+        glue[start:start + blocksize] = calcul_weighted_quantiles(
+            np.asarray(x[:, start:start + blocksize]), rmse, glue_limits)
     return glue
 
 
+def calcul_glue_weights(RMSE):
+    """
+    Return the weights of the behavioural models, which are the inverse of
+    their RMSE rescaled so that their sum equals 1.
+    """
+    rmse = 1/np.array(RMSE)
+    return rmse/np.sum(rmse)
+
+
+def calcul_weighted_quantiles(x, weights, p):
+    """
+    Return an array of shape (x.shape[1], len(p)) with the weighted
+    quantiles of each column of x for the probabilities p, where the
+    values of the i-th row of x are weighted by weights[i].
+
+    The quantiles are interpolated linearly in the cumulative sum of the
+    weights of the sorted values of each column, like np.interp does, but
+    for all columns and probabilities at once.
+    """
+    return interp_weighted_quantiles(*sort_weighted_values(x, weights), p)
+
+
+def sort_weighted_values(x, weights):
+    """
+    Sort the values of each column of x, where the values of the i-th row of
+    x are weighted by weights[i], and return an array with the sorted values
+    of each column in its rows, along with the cumulative sums of
+    their weights.
+    """
+    # The values of each column are sorted in a row of a contiguous array.
+    x = np.ascontiguousarray(x.T)
+    isort = np.argsort(x, axis=1)
+    cdf = np.cumsum(weights[isort], axis=1)
+    return np.take_along_axis(x, isort, axis=1), cdf
+
+
+def interp_weighted_quantiles(xsort, cdf, p):
+    """
+    Return an array of shape (len(xsort), len(p)) with the quantiles for
+    the probabilities p of the sorted values of each row of xsort,
+    interpolated in their cumulative weights cdf.
+    """
+    p = np.asarray(p, dtype=float)
+    nrow, n = xsort.shape
+
+    # Find the index of the last sorted value whose cumulative weight is
+    # smaller than or equal to each probability. The cumulative weights of
+    # each row are sorted, so this is done with a bisection for all the
+    # rows and probabilities at once.
+    rows = np.arange(nrow)[:, None]
+    lo = np.zeros((nrow, len(p)), dtype=int)
+    hi = np.full((nrow, len(p)), n)
+    active = lo < hi
+    while np.any(active):
+        mid = (lo + hi) // 2
+        below = cdf[rows, np.minimum(mid, n - 1)] <= p
+        lo = np.where(active & below, mid + 1, lo)
+        hi = np.where(active & ~below, mid, hi)
+        active = lo < hi
+    j = lo - 1
+
+    j0 = np.clip(j, 0, n - 1)
+    j1 = np.clip(j + 1, 0, n - 1)
+    x0 = xsort[rows, j0].astype(float)
+    x1 = xsort[rows, j1].astype(float)
+    c0, c1 = cdf[rows, j0], cdf[rows, j1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (x1 - x0) / (c1 - c0)
+        q = np.where(p == c0, x0, slope * (p - c0) + x0)
+    q = np.where(j < 0, x0, q)
+    q = np.where(j >= n - 1, x1, q)
+    return q
+
+
 def calcul_dly_budget(data, glue_limits):
     """
     Calcul GLUE daily water budget for the provided GLUE uncertainty limits.
@@ -315,31 +684,19 @@ def calcul_mly_budget(glue_dly):
     calculated with the GLUE method from a set of behavioural models for a
     given set of p confidence intervals.
     """
-    years = glue_dly['years']
-    months = glue_dly['months']
-
-    year_range = np.unique(years)
-    month_range = range(1, 13)
+    groups = PeriodGroups(glue_dly['years'], glue_dly['months'], 'monthly')
+    year_range = np.unique(glue_dly['years'])
+    nyear, nlim = len(year_range), len(glue_dly['GLUE limits'])
 
-    # Initialize a dict where the results will be saved.
+    # Compute monthly values from daily time series. The values of the
+    # months that are not complete are kept as nan.
     glue_mly = {'years': year_range,
                 'GLUE limits': glue_dly['GLUE limits']}
     for var in ['recharge', 'evapo', 'runoff']:
-        glue_mly[var] = np.zeros(
-            (len(year_range), 12, len(glue_dly['GLUE limits']))) * np.nan
-    glue_mly['precip'] = np.zeros((len(year_range), 12)) * np.nan
-
-    # Compute monthly values from daily time series.
-    for i, year in enumerate(year_range):
-        for j, month in enumerate(month_range):
-            indexes = np.where((years == year) & (months == month))[0]
-            if len(indexes) < monthrange(year, month)[1]:
-                # This month is not complete, so we keep its value a nan.
-                continue
-            for var in ['recharge', 'evapo', 'runoff']:
-                glue_mly[var][i, j, :] = np.sum(
-                    glue_dly[var][indexes, :], axis=0)
-            glue_mly['precip'][i, j] = np.sum(glue_dly['precip'][indexes])
+        glue_mly[var] = groups.sum(
+            glue_dly[var], complete=True).reshape(nyear, 12, nlim)
+    glue_mly['precip'] = groups.sum(
+        glue_dly['precip'], complete=True).reshape(nyear, 12)
 
     return glue_mly
 
@@ -367,40 +724,16 @@ def calcul_hydro_yrly_budget(glue_dly):
     An hydrological year is defined from October 1 to September 30 of the
     next year.
     """
-    years = glue_dly['years']
-    months = glue_dly['months']
-    glue_rechg_dly = glue_dly['recharge']
-    glue_evapo_dly = glue_dly['evapo']
-    glue_runof_dly = glue_dly['runoff']
-    precip_dly = glue_dly['precip']
-
-    # Define the range of the years for which yearly values of the water
-    # budget components will be computed.
-
-    year_range = np.arange(np.min(years), np.max(years)).astype('int')
-
-    # Convert daily to hydrological year. An hydrological year is defined from
-    # October 1 to September 30 of the next year.
-
-    nyear, nlim = len(year_range), len(glue_dly['GLUE limits'])
-    glue_rechg_yly = np.zeros((nyear, nlim))
-    glue_evapo_yly = np.zeros((nyear, nlim))
-    glue_runof_yly = np.zeros((nyear, nlim))
-    precip_yly = np.zeros(nyear)
-    for i in range(nyear):
-        yr0 = year_range[i]
-        yr1 = yr0 + 1
-
-        indexes = np.where((years == yr0) & (months == 10))[0]
-        indx0 = 0 if len(indexes) == 0 else indexes[0]
-
-        indexes = np.where((years == yr1) & (months == 9))[0]
-        indx1 = len(years-1) if len(indexes) == 0 else indexes[-1]
-
-        glue_rechg_yly[i, :] = np.sum(glue_rechg_dly[indx0:indx1+1, :], axis=0)
-        glue_evapo_yly[i, :] = np.sum(glue_evapo_dly[indx0:indx1+1, :], axis=0)
-        glue_runof_yly[i, :] = np.sum(glue_runof_dly[indx0:indx1+1, :], axis=0)
-        precip_yly[i] = np.sum(precip_dly[indx0:indx1+1])
+    # Yearly values of the water budget components are computed for the
+    # hydrological years starting in each year of the data, except the last.
+    groups = PeriodGroups(
+        glue_dly['years'], glue_dly['months'], 'hydro yearly')
+    year_range = groups.years
+
+    glue_rechg_yly = groups.sum(glue_dly['recharge'])
+    glue_evapo_yly = groups.sum(glue_dly['evapo'])
+    glue_runof_yly = groups.sum(glue_dly['runoff'])
+    precip_yly = groups.sum(glue_dly['precip'])
 
     return {'years': year_range,
             'recharge': glue_rechg_yly,
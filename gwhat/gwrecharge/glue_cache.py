@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+# ---- Standard library imports
+
+import hashlib
+import os
+import os.path as osp
+
+# ---- Third party imports
+
+import h5py
+import numpy as np
+
+# The version of the cache format. It is part of the cache key, so that
+# the results cached with an older version of the models are not reused.
+CACHE_VERSION = '1'
+SERIES = ['hydrograph', 'recharge', 'etr', 'ru']
+
+
+def make_cache_key(*inputs):
+    """
+    Return a hash of the provided model inputs, that can be either numerical
+    scalars or arrays.
+    """
+    sha = hashlib.sha1(CACHE_VERSION.encode('utf8'))
+    for x in inputs:
+        x = np.ascontiguousarray(x, dtype='float64')
+        sha.update(str(x.shape).encode('utf8'))
+        sha.update(x.tobytes())
+    return sha.hexdigest()
+
+
+class RealizationCache(object):
+    """
+    A persistent cache of the results of the models evaluated with GLUE,
+    indexed by their (Cru, RASmax) parameter values.
+
+    The results of the models evaluated with a given set of inputs are saved
+    in a HDF5 file in dirname that is named after the hash of these inputs
+    (see make_cache_key). The optimal value of Sy and the RMSE are cached
+    for every model, while the time series are only cached for the
+    behavioural models.
+
+    When the cache is closed, the least recently used files are deleted
+    from dirname until their total size is smaller than max_size (in bytes).
+    """
+
+    def __init__(self, dirname, key, max_size=1e9):
+        if not osp.exists(dirname):
+            os.makedirs(dirname)
+        self.dirname = dirname
+        self.max_size = max_size
+        self.filename = osp.join(dirname, key + '.h5')
+
+        self._db = h5py.File(self.filename, mode='a')
+        if 'params' not in self._db:
+            self._db.create_dataset('params', shape=(0, 2), dtype='float64',
+                                    maxshape=(None, 2), chunks=(1024, 2))
+            for name in ['Sy', 'RMSE']:
+                self._db.create_dataset(name, shape=(0,), dtype='float64',
+                                        maxshape=(None,), chunks=(1024,))
+            self._db.create_dataset('row', shape=(0,), dtype='int64',
+                                    maxshape=(None,), chunks=(1024,))
+        self._index = {self._make_index_key(cru, rasmax): i for
+                       i, (cru, rasmax) in enumerate(self._db['params'][:])}
+
+        # Mark the file as the most recently used one.
+        os.utime(self.filename, None)
+
+    def __contains__(self, params):
+        return self._make_index_key(*params) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def _make_index_key(cru, rasmax):
+        return (round(float(cru), 6), round(float(rasmax), 6))
+
+    def get(self, cru, rasmax):
+        """
+        Return a dict with the cached values of Sy and RMSE for the model
+        (Cru, RASmax) and its time series if they were cached, or
+        None if the model is not in the cache.
+        """
+        i = self._index.get(self._make_index_key(cru, rasmax))
+        if i is None:
+            return None
+        result = {'Cru': cru, 'RASmax': rasmax,
+                  'Sy': self._db['Sy'][i], 'RMSE': self._db['RMSE'][i]}
+        row = self._db['row'][i]
+        if row >= 0:
+            for name in SERIES:
+                result[name] = self._db['series/' + name][row]
+        return result
+
+    def put(self, result):
+        """
+        Add the result of a model to the cache. The time series are cached
+        if they are included in result.
+        """
+        key = self._make_index_key(result['Cru'], result['RASmax'])
+        i = self._index.get(key)
+        if i is None:
+            i = len(self._index)
+            for name in ['params', 'Sy', 'RMSE', 'row']:
+                self._db[name].resize(i + 1, axis=0)
+            self._db['params'][i] = key
+            self._db['row'][i] = -1
+            self._index[key] = i
+        self._db['Sy'][i] = result['Sy']
+        self._db['RMSE'][i] = result['RMSE']
+
+        if all(name in result for name in SERIES) and self._db['row'][i] < 0:
+            grp = self._db.require_group('series')
+            row = grp[SERIES[0]].shape[0] if SERIES[0] in grp else 0
+            for name in SERIES:
+                x = np.asarray(result[name], dtype='float32')
+                if name not in grp:
+                    grp.create_dataset(
+                        name, shape=(0, len(x)), dtype='float32',
+                        maxshape=(None, len(x)), chunks=(1, len(x)),
+                        compression='gzip', compression_opts=1)
+                grp[name].resize(row + 1, axis=0)
+                grp[name][row] = x
+            self._db['row'][i] = row
+
+    def close(self):
+        """Close the cache file and evict the least recently used files."""
+        if self._db is None:
+            return
+        self._db.close()
+        self._db = None
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used cache files in dirname until their
+        total size is smaller than max_size. The file of this cache is never
+        deleted, even if it is larger than max_size by itself.
+        """
+        files = [osp.join(self.dirname, f) for f in os.listdir(self.dirname)
+                 if f.endswith('.h5')]
+        files = sorted(files, key=osp.getmtime)
+        total_size = sum(osp.getsize(f) for f in files)
+        for f in files:
+            if total_size <= self.max_size:
+                break
+            if osp.abspath(f) == osp.abspath(self.filename):
+                continue
+            total_size -= osp.getsize(f)
+            os.remove(f)
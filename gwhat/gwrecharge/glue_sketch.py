@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+"""
+Streaming weighted quantile sketches that are used to compute the GLUE
+limits without keeping the time series of all the behavioural models
+in memory.
+"""
+
+# ---- Standard library imports
+
+from collections.abc import Mapping
+
+# ---- Third party imports
+
+import numpy as np
+
+
+class WeightedQuantileSketch(object):
+    """
+    A sketch of the weighted distribution of the values of a daily time
+    series across a set of realizations, from which the weighted quantiles of
+    each day can be estimated.
+
+    The sketch holds at most size weighted centroids per day. The
+    realizations are buffered and merged with the centroids by batches of
+    size realizations. As long as no more than size realizations were added,
+    the quantiles are exactly the ones computed by calcul_glue. Afterwards,
+    the centroids of each day are compressed in size bins of equal
+    cumulative weight, so that the error on the probability of a quantile is
+    of the order of 1/size.
+    """
+
+    def __init__(self, size=100):
+        self.size = int(size)
+        self.count = 0
+
+        self._means = None
+        self._weights = None
+        self._sqweights = None
+
+        self._buffer = None
+        self._buffer_weights = np.empty(self.size)
+        self._nbuffer = 0
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes allocated by the sketch."""
+        arrays = [self._means, self._weights, self._sqweights, self._buffer]
+        return sum(arr.nbytes for arr in arrays if arr is not None)
+
+    def update(self, x, weight=1):
+        """Add the daily time series x of a realization to the sketch."""
+        x = np.asarray(x, dtype=float)
+        if self._buffer is None:
+            self._buffer = np.empty((self.size, len(x)))
+        self._buffer[self._nbuffer] = x
+        self._buffer_weights[self._nbuffer] = weight
+        self._nbuffer += 1
+        self.count += 1
+        if self._nbuffer == self.size:
+            self._merge()
+
+    def quantiles(self, p):
+        """
+        Return an array of shape (number of days, len(p)) with the weighted
+        quantiles of each day for the probabilities p, using the same
+        cumulative distribution as calcul_glue.
+        """
+        self._merge()
+        if self._means is None:
+            raise ValueError("The sketch is empty.")
+        means, weights = self._means, self._weights
+
+        # The cumulative probability of a centroid is the weighted mean of
+        # the cumulative probabilities of the values that it contains, which
+        # is its cumulative weight for a centroid holding a single value.
+        total = np.sum(weights, axis=1, keepdims=True)
+        cumw = np.cumsum(weights, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cdf = cumw - weights / 2 + self._sqweights / (2 * weights)
+        cdf = np.where(weights > 0, cdf, cumw) / total
+        cdf = np.maximum.accumulate(cdf, axis=1)
+
+        ntime, n = means.shape
+        rows = np.arange(ntime)
+        q = np.empty((ntime, len(p)))
+        for k, pk in enumerate(p):
+            j = np.sum(cdf < pk, axis=1)
+            j0 = np.clip(j - 1, 0, n - 1)
+            j1 = np.clip(j, 0, n - 1)
+            x0, x1 = means[rows, j0], means[rows, j1]
+            c0, c1 = cdf[rows, j0], cdf[rows, j1]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                t = np.where(c1 > c0, (pk - c0) / (c1 - c0), 0)
+            q[:, k] = x0 + np.clip(t, 0, 1) * (x1 - x0)
+        return q
+
+    def close(self):
+        """Release the arrays of the sketch."""
+        self._means = self._weights = self._sqweights = self._buffer = None
+        self._nbuffer = 0
+
+    def _merge(self):
+        """Merge the buffered realizations with the centroids."""
+        if self._nbuffer == 0:
+            return
+        values = self._buffer[:self._nbuffer].T
+        weights = np.broadcast_to(
+            self._buffer_weights[:self._nbuffer], values.shape)
+        sqweights = weights**2
+        if self._means is not None:
+            values = np.hstack([self._means, values])
+            weights = np.hstack([self._weights, weights])
+            sqweights = np.hstack([self._sqweights, sqweights])
+        self._nbuffer = 0
+
+        isort = np.argsort(values, axis=1, kind='stable')
+        values = np.take_along_axis(values, isort, axis=1)
+        weights = np.take_along_axis(weights, isort, axis=1)
+        sqweights = np.take_along_axis(sqweights, isort, axis=1)
+        if values.shape[1] > self.size:
+            values, weights, sqweights = self._compress(
+                values, weights, sqweights)
+        self._means, self._weights, self._sqweights = (
+            values, weights, sqweights)
+
+    def _compress(self, values, weights, sqweights):
+        """
+        Compress the sorted centroids of each day in size bins of equal
+        cumulative weight.
+        """
+        ntime, n = values.shape
+        cumw = np.cumsum(weights, axis=1)
+        total = cumw[:, -1:]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            bins = np.floor((cumw - weights / 2) / total * self.size)
+        bins = np.clip(np.nan_to_num(bins), 0, self.size - 1).astype(int)
+        bins += np.arange(ntime)[:, None] * self.size
+
+        nbins = ntime * self.size
+        new_weights = np.bincount(
+            bins.ravel(), weights.ravel(), nbins).reshape(ntime, self.size)
+        new_sqweights = np.bincount(
+            bins.ravel(), sqweights.ravel(), nbins).reshape(ntime, self.size)
+        wsum = np.bincount(bins.ravel(), (weights * values).ravel(),
+                           nbins).reshape(ntime, self.size)
+
+        # The empty bins are given the value of the last non-empty bin
+        # preceding them, so that the centroids stay sorted.
+        nonempty = new_weights > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            new_values = np.where(nonempty, wsum / new_weights, np.nan)
+        last = np.where(nonempty, np.arange(self.size), 0)
+        last = np.maximum.accumulate(last, axis=1)
+        new_values = np.take_along_axis(new_values, last, axis=1)
+        new_values = np.where(np.isnan(new_values), values[:, :1], new_values)
+        return new_values, new_weights, new_sqweights
+
+
+class GLUESketchStore(Mapping):
+    """
+    A store that updates a WeightedQuantileSketch for each variable as
+    the realizations of the behavioural models are produced, instead of
+    saving their time series like RealizationStore. The realizations are
+    weighted by the inverse of their RMSE, like in calcul_glue.
+    """
+
+    def __init__(self, varnames, size=100):
+        super(GLUESketchStore, self).__init__()
+        self.varnames = list(varnames)
+        self._sketches = {var: WeightedQuantileSketch(size)
+                          for var in self.varnames}
+        self._count = 0
+
+    def __getitem__(self, varname):
+        """Return the sketch of varname."""
+        return self._sketches[varname]
+
+    def __iter__(self):
+        return iter(self.varnames)
+
+    def __len__(self):
+        return len(self.varnames)
+
+    @property
+    def count(self):
+        """Return the number of realizations added to the store."""
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes allocated by the store."""
+        return sum(sketch.nbytes for sketch in self._sketches.values())
+
+    def append(self, RMSE, **realization):
+        """
+        Add the time series of one realization with the provided RMSE to the
+        store. A keyword argument must be provided for each variable of
+        the store.
+        """
+        if set(realization.keys()) != set(self.varnames):
+            raise ValueError("A value must be provided for each of these "
+                             "variables: %s" % ', '.join(self.varnames))
+        for var in self.varnames:
+            self._sketches[var].update(realization[var], 1 / RMSE)
+        self._count += 1
+
+    def close(self):
+        """Release the sketches of the store."""
+        for sketch in self._sketches.values():
+            sketch.close()
+        self._count = 0
@@ -11,7 +11,9 @@
 import os
 import os.path as osp
 import datetime
-from itertools import product
+from functools import partial
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
 import time
 
 # ---- Imports: third parties
@@ -23,9 +25,31 @@ from PyQt5.QtCore import pyqtSignal as QSignal
 # ---- Imports: local
 
 from gwhat.utils.math import clip_time_series, calcul_rmse
-from gwhat.gwrecharge.glue import GLUEDataFrame
-from gwhat.gwrecharge.gwrecharge_calculs import (calcul_surf_water_budget,
-                                                 calc_hydrograph_forward)
+from gwhat.gwrecharge.glue import GLUEDataFrame, GLUELimits, calcul_glue
+from gwhat.gwrecharge.realizations import RealizationStore
+from gwhat.gwrecharge.glue_sketch import GLUESketchStore
+from gwhat.gwrecharge.glue_cache import RealizationCache, make_cache_key
+from gwhat.gwrecharge.samplers import (
+    SAMPLERS, GridSampler, RandomSampler, AdaptiveSampler)
+from gwhat.gwrecharge.gwrecharge_calculs import (
+    calcul_surf_water_budget, calcul_snow_melt, calcul_runoff_storage_batch,
+    calc_hydrograph_forward, calc_hydrograph_forward_sens,
+    calc_hydrograph_backward, calc_hydrograph_backward_sens,
+    calc_hydrograph_cranknicolson, calc_hydrograph_cranknicolson_sens,
+    calc_hydrograph_sens_batch)
+
+GLUE_CHUNKSIZE = 250
+HYDROGRAPH_SCHEMES = {
+    'forward': (calc_hydrograph_forward, calc_hydrograph_forward_sens),
+    'backward': (calc_hydrograph_backward, calc_hydrograph_backward_sens),
+    'cranknicolson': (calc_hydrograph_cranknicolson,
+                      calc_hydrograph_cranknicolson_sens)}
+GLUE_OPTIMIZERS = ['scalar', 'batch']
+GLUE_REPORT_KEYS = ['evaluated', 'behavioural', 'rejected Sy',
+                    'rejected RMSE', 'pruned Sy', 'pruned RMSE', 'cached']
+SAMPLER_SETTINGS = ['glue_sampler', 'glue_pardist_res', 'glue_nsamples',
+                    'glue_target_count', 'glue_max_nsamples',
+                    'glue_sampler_seed']
 
 
 class RechgEvalWorker(QObject):
@@ -37,6 +61,7 @@ class RechgEvalWorker(QObject):
         super(RechgEvalWorker, self).__init__()
         self.wxdset = None
         self.ETP, self.PTOT, self.TAVG = [], [], []
+        self.PAVL = []
 
         self.wldset = None
         self.A, self.B = None, None
@@ -47,12 +72,94 @@ class RechgEvalWorker(QObject):
         self.CM = 4
         self.deltat = 0
 
+        # The numerical scheme used to produce the synthetic hydrographs.
+        # It is either 'forward' or 'cranknicolson' to build the hydrograph
+        # forward in time from the first observed water level, or 'backward'
+        # to build it backward in time from the last one.
+        self.hydrograph_scheme = 'forward'
+
         self.Sy = (0, 1)
         self.Cro = (0, 1)
         self.RASmax = (0, 150)
 
         self.glue_pardist_res = 'fine'
 
+        # The sampler used to produce the parameter combinations. It is
+        # either 'grid' for a full factorial grid at the resolution set
+        # by glue_pardist_res, 'lhs' or 'sobol' for batches of glue_nsamples
+        # Latin hypercube or Sobol samples, or 'adaptive' for a coarse Latin
+        # hypercube pass that is refined around the behavioural region.
+        # Batches are drawn until glue_target_count behavioural models are
+        # found or glue_max_nsamples combinations are evaluated.
+        self.glue_sampler = 'grid'
+        self.glue_nsamples = 1000
+        self.glue_target_count = None
+        self.glue_max_nsamples = None
+        self.glue_sampler_seed = None
+
+        # Models with a RMSE above glue_rmse_max (in mm) are rejected. If
+        # glue_pruning is True, the optimization of Sy is aborted for models
+        # that are not going to be behavioural, when Sy leaves its range by
+        # more than glue_prune_margin (as a fraction of the range) or when
+        # the RMSE stays above glue_rmse_max. See optimize_specific_yield.
+        self.glue_rmse_max = None
+        self.glue_pruning = False
+        self.glue_prune_margin = 0.5
+
+        # The optimization of Sy is done for one model at a time with
+        # optimize_specific_yield if glue_optimizer is 'scalar', or for all
+        # the models of a chunk at once with optimize_specific_yield_batch
+        # if it is 'batch'. In both cases, the Gauss-Newton iterations stop
+        # when Sy changes by less than glue_sy_tol, or after
+        # glue_sy_maxiter iterations.
+        self.glue_optimizer = 'scalar'
+        self.glue_sy_tol = 0.001
+        self.glue_sy_maxiter = 100
+        self.glue_report = dict.fromkeys(GLUE_REPORT_KEYS, 0)
+
+        # The results of the models are cached in glue_cache_dirname, so
+        # that they do not need to be evaluated again in a later run with
+        # the same input data. The cache is disabled if this is None.
+        self.glue_cache_dirname = None
+        self.glue_cache_maxsize = 1e9
+        self._glue_cache = None
+
+        # The number of workers that are used to evaluate the models.
+        # The models are evaluated in the current thread if this is 1.
+        # The workers are either processes ('process') or threads ('thread')
+        # depending on glue_executor. Threads avoid the cost of starting
+        # the processes and of pickling the data, while the models still run
+        # concurrently because the gwrecharge_calculs kernels release the GIL.
+        self.glue_nworkers = 1
+        self.glue_executor = 'process'
+
+        # The time series of the behavioural models are kept in memory in
+        # float32 arrays, or in memory-mapped files saved in a temporary
+        # folder in glue_store_dirname if glue_store_backend is 'memmap'.
+        self.glue_store_backend = 'memory'
+        self.glue_store_dirname = None
+
+        # If glue_streaming is True, the time series of the behavioural
+        # models are not kept. Instead, the GLUE limits are estimated from
+        # weighted quantile sketches of glue_sketch_size centroids per day
+        # that are updated as the models are evaluated.
+        self.glue_streaming = False
+        self.glue_sketch_size = 100
+        self._glue_canceled = False
+
+        # If glue_save_state is True, the state of the behavioural models
+        # at the end of the data is saved with the GLUE results, so that
+        # these can be extended with update_recharge when new data are
+        # appended to the datasets.
+        self.glue_save_state = True
+
+        # If glue_keep_sorted is True, the realizations of the behavioural
+        # models are kept in the GLUEDataFrame after being sorted for each
+        # day, so that GLUEDataFrame.glue_at computes the exact GLUE values
+        # for any probabilities instead of interpolating them in the daily
+        # quantiles saved with the results.
+        self.glue_keep_sorted = False
+
     @property
     def language(self):
         return self.__language
@@ -64,6 +171,11 @@ class RechgEvalWorker(QObject):
         else:
             raise NameError('Language must be either French or English.')
 
+    @property
+    def glue_canceled(self):
+        """Return whether the last GLUE calculation was canceled."""
+        return self._glue_canceled
+
     @property
     def CM(self):
         return self.__CM
@@ -152,6 +264,30 @@ class RechgEvalWorker(QObject):
 
         return U_RAS, U_Cro
 
+    def produce_params_sampler(self):
+        """
+        Produce the sampler that is used to draw the parameter combinations
+        (RASmax + Cro) from the ranges provided by the user.
+        """
+        if self.glue_sampler == 'grid':
+            U_RAS, U_Cro = self.produce_params_combinations()
+            return GridSampler(U_Cro, U_RAS)
+
+        bounds = [(min(self.Cro), max(self.Cro)),
+                  (min(self.RASmax), max(self.RASmax))]
+        if self.glue_sampler in ['lhs', 'sobol']:
+            return RandomSampler(
+                bounds, self.glue_nsamples, self.glue_sampler,
+                self.glue_target_count, self.glue_max_nsamples,
+                self.glue_sampler_seed)
+        elif self.glue_sampler == 'adaptive':
+            return AdaptiveSampler(
+                bounds, self.glue_nsamples, 'lhs',
+                self.glue_target_count, self.glue_max_nsamples,
+                self.glue_sampler_seed)
+        else:
+            raise ValueError("glue_sampler must be one of %s." % SAMPLERS)
+
     def eval_recharge(self):
         """
         Produce a set of behavioural models that all represent the observed
@@ -159,56 +295,105 @@ class RechgEvalWorker(QObject):
         GLUE uncertainty limits.
         """
 
-        U_RAS, U_Cro = self.produce_params_combinations()
-
-        # Find the indexes to align the water level with the weather data
-        # daily time series.
-
-        ts = np.where(self.twlvl[0] == self.tweatr)[0][0]
-        te = np.where(self.twlvl[-1] == self.tweatr)[0][0]
+        sampler = self.produce_params_sampler()
 
         # ---- Produce realizations
 
-        set_RMSE = []
+        time_start = time.time()
+        store = self._start_glue_calcul()
+        results = []
+        params = sampler.next_batch(None)
+        while params is not None and not self._glue_canceled:
+            progress = (sampler.nsampled - len(params), sampler.max_samples)
+            if self.glue_nworkers > 1:
+                results.extend(
+                    self._eval_params_parallel(params, store, progress))
+            else:
+                results.extend(
+                    self._eval_params_serial(params, store, progress))
+            params = sampler.next_batch(
+                [(r['Cru'], r['RASmax']) for r in results])
+        self.sig_glue_progress.emit(100)
+        return self._finish_glue_calcul(store, results, time_start)
+
+    def _start_glue_calcul(self):
+        """
+        Reset the state of the worker for a new GLUE calculation and return
+        the store where the realizations of the behavioural models are saved.
+        """
+        self._glue_canceled = False
+        self.sig_glue_progress.emit(0)
 
-        set_Sy = []
-        set_RASmax = []
-        set_Cru = []
+        self.glue_report = dict.fromkeys(GLUE_REPORT_KEYS, 0)
+        self._glue_cache = self._open_glue_cache()
 
-        sets_waterlevels = []
-        set_recharge = []
-        set_runoff = []
-        set_evapo = []
+        # The snow accumulation and melt do not depend on the values of
+        # Cru and RASmax, so they are computed only once for all models.
+        self.PAVL, _ = self.snow_melt()
+        if self.glue_streaming:
+            return GLUESketchStore(
+                ['hydrograph', 'recharge', 'etr', 'ru'],
+                size=self.glue_sketch_size)
+        else:
+            return RealizationStore(
+                ['hydrograph', 'recharge', 'etr', 'ru'],
+                backend=self.glue_store_backend,
+                dirname=self.glue_store_dirname)
 
-        Sy0 = np.mean(self.Sy)
-        time_start = time.clock()
-        N = sum(1 for p in product(U_Cro, U_RAS))
-        self.sig_glue_progress.emit(0)
-        for it, (cro, rasmax) in enumerate(product(U_Cro, U_RAS)):
-            rechg, ru, etr, ras, pacc = self.surf_water_budget(cro, rasmax)
-            SyOpt, RMSE, wlvlest = self.optimize_specific_yield(
-                    Sy0, self.wlobs*1000, rechg[ts:te])
-            Sy0 = SyOpt
+    def _finish_glue_calcul(self, store, results, time_start):
+        """
+        Calcul GLUE from the behavioural models saved in store and whose
+        parameters and RMSE are listed in results, and return the
+        resulting GLUEDataFrame.
+        """
+        if self._glue_cache is not None:
+            self._glue_cache.close()
+            self._glue_cache = None
+
+        if self._glue_canceled:
+            print("GLUE calculation canceled by the user.")
+            store.close()
+            self.sig_glue_finished.emit(None)
+            return None
 
-            if SyOpt >= min(self.Sy) and SyOpt <= max(self.Sy):
-                set_RMSE.append(RMSE)
-                set_recharge.append(rechg)
-                sets_waterlevels.append(wlvlest)
-                set_Sy.append(SyOpt)
-                set_RASmax.append(rasmax)
-                set_Cru.append(cro)
-                set_evapo.append(etr)
-                set_runoff.append(ru)
-
-            self.sig_glue_progress.emit((it+1)/N*100)
-            print(('Cru = %0.3f ; RASmax = %0.0f mm ; Sy = %0.4f ; ' +
-                   'RMSE = %0.1f') % (cro, rasmax, SyOpt, RMSE))
+        set_RMSE = [r['RMSE'] for r in results]
+
+        set_Sy = [r['Sy'] for r in results]
+        set_RASmax = [r['RASmax'] for r in results]
+        set_Cru = [r['Cru'] for r in results]
 
-        print("GLUE computed in : %0.1f s" % (time.clock()-time_start))
+        print("GLUE computed in : %0.1f s" % (time.time()-time_start))
+        self._print_glue_report()
         self._print_model_params_summary(set_Sy, set_Cru, set_RASmax)
 
-        # ---- Format results
+        glue_rawdata = self._make_glue_rawdata(
+            set_RMSE, set_Sy, set_Cru, set_RASmax, store)
+        if self.glue_save_state and glue_rawdata['count'] > 0:
+            glue_rawdata['state'] = self._calc_glue_state(
+                set_RMSE, set_Sy, set_Cru, set_RASmax, store)
+
+        # Calcul GLUE from the set of behavioural model and send the results
+        # with a signal so that it can be handled on the UI side.
+
+        if glue_rawdata['count'] > 0:
+            glue_dataf = GLUEDataFrame(glue_rawdata)
+            glue_dataf.release_data(keep_sorted=self.glue_keep_sorted)
+            # self._save_glue_to_npy(glue_rawdata)
+        else:
+            glue_dataf = None
+        store.close()
+        self.sig_glue_finished.emit(glue_dataf)
+
+        return glue_dataf
 
+    def _make_glue_rawdata(self, set_RMSE, set_Sy, set_Cru, set_RASmax,
+                           series):
+        """
+        Format the parameters and RMSE of the behavioural models, along with
+        the data of the wells and weather stations, in a dict from which
+        a GLUEDataFrame can be produced. series is a mapping with the
+        realizations of the hydrograph, recharge, etr and ru of the models.
+        """
         glue_rawdata = {}
         glue_rawdata['count'] = len(set_RMSE)
         glue_rawdata['RMSE'] = set_RMSE
@@ -242,10 +427,10 @@ class RechgEvalWorker(QObject):
 
         # Store the models output that will need to be processed with GLUE.
 
-        glue_rawdata['hydrograph'] = sets_waterlevels
-        glue_rawdata['recharge'] = set_recharge
-        glue_rawdata['etr'] = set_evapo
-        glue_rawdata['ru'] = set_runoff
+        glue_rawdata['hydrograph'] = series['hydrograph']
+        glue_rawdata['recharge'] = series['recharge']
+        glue_rawdata['etr'] = series['etr']
+        glue_rawdata['ru'] = series['ru']
         glue_rawdata['Time'] = self.wxdset['Time']
         glue_rawdata['Year'] = self.wxdset['Year']
         glue_rawdata['Month'] = self.wxdset['Month']
@@ -263,17 +448,499 @@ class RechgEvalWorker(QObject):
                 'Longitude', 'Elevation']
         glue_rawdata['wxinfo'] = {k: self.wxdset[k] for k in keys}
 
-        # Calcul GLUE from the set of behavioural model and send the results
-        # with a signal so that it can be handled on the UI side.
+        return glue_rawdata
 
-        if glue_rawdata['count'] > 0:
-            glue_dataf = GLUEDataFrame(glue_rawdata)
-            # self._save_glue_to_npy(glue_rawdata)
+    def _calc_glue_state(self, set_RMSE, set_Sy, set_Cru, set_RASmax,
+                         store):
+        """
+        Compute the state of the behavioural models at the end of the data,
+        from which their simulation can be extended over the data that are
+        appended to the datasets afterwards (see update_recharge).
+
+        The state is taken at the start of the last day of the water level
+        data. It includes the accumulated precipitation on the ground
+        surface, the readily available storage and the water level simulated
+        for each model, along with the sum of its squared residuals and the
+        number of observations that were used to compute its RMSE.
+
+        These are taken from the RMSE of the models and from their
+        hydrographs and budgets that are saved in store. The models are only
+        simulated again when store does not keep the realizations of each
+        model (see glue_streaming).
+        """
+        te = np.where(self.twlvl[-1] == self.tweatr)[0][0]
+        nonan = ~np.isnan(self.wlobs)
+
+        PAVL, PACC = self.snow_melt()
+        set_Sy = np.asarray(set_Sy, dtype=float)
+        set_Cru = np.asarray(set_Cru, dtype=float)
+        set_RASmax = np.asarray(set_RASmax, dtype=float)
+        N = len(set_Sy)
+        nobs = np.sum(nonan)
+        state = {'time': self.twlvl[-1], 'scheme': self.hydrograph_scheme,
+                 'PACC': PACC[te], 'nobs': nobs, 'RAS': np.zeros(N),
+                 'wlpre': np.zeros(N),
+                 'SSE': np.asarray(set_RMSE, dtype=float)**2 * nobs}
+        for indexes in np.array_split(
+                np.arange(N), int(np.ceil(N / GLUE_CHUNKSIZE))):
+            if isinstance(store, RealizationStore):
+                hydrographs = store['hydrograph'][indexes].astype(float)
+                rechgs, rus, etrs = [
+                    store[var][indexes].astype(float) for
+                    var in ('recharge', 'ru', 'etr')]
+            else:
+                rechgs, rus, etrs, hydrographs = self._simulate_models(
+                    set_Sy[indexes], set_Cru[indexes], set_RASmax[indexes],
+                    PAVL)
+            state['RAS'][indexes] = self._calc_ras_at(
+                te, set_RASmax[indexes], PAVL, rechgs, rus, etrs)
+            state['wlpre'][indexes] = hydrographs[:, -1]
+        return state
+
+    def _simulate_models(self, set_Sy, set_Cru, set_RASmax, PAVL):
+        """
+        Return the recharge, runoff, real evapotranspiration and hydrograph
+        of the models with the parameters Sy, Cru and RASmax.
+        """
+        ts = np.where(self.twlvl[0] == self.tweatr)[0][0]
+        te = np.where(self.twlvl[-1] == self.tweatr)[0][0]
+        rechgs, rus, etrs = self.surf_water_budget_batch(
+            set_Cru, set_RASmax, PAVL)
+        hydrographs = np.array([
+            self.calc_hydrograph(rechg[ts:te], Sy) for
+            rechg, Sy in zip(rechgs, set_Sy)])
+        return rechgs, rus, etrs, hydrographs
+
+    @staticmethod
+    def _calc_ras_at(i, RAS0, PAVL, rechgs, rus, etrs):
+        """
+        Return the readily available storage at the start of the i-th day
+        of the surface water budgets computed from the storages RAS0, which
+        follows from the budget of the previous days.
+        """
+        return RAS0 + np.sum(
+            PAVL[:i] - rus[:, :i] - rechgs[:, :i] - etrs[:, :i], axis=1)
+
+    def update_recharge(self, gluedf):
+        """
+        Update the GLUE results of gluedf with the water level and weather
+        data that were appended to the datasets since these results were
+        computed with eval_recharge, and return the updated GLUEDataFrame.
+
+        The behavioural models and their values of Sy are kept. Their
+        simulation is only extended over the new days, starting from the
+        state that was saved with the results (see glue_save_state), and
+        their RMSE is updated with the residuals of the new observations.
+        The GLUE limits of the days from the end of the previous water level
+        data are computed with the updated RMSE, while the ones of the days
+        before are kept.
+
+        The GLUE limits of the updated results are thus computed with
+        different weights (1/RMSE) before and after the end of the previous
+        water level data. This is recorded in the 'weights' item of the
+        updated results, where 'RMSE' holds one row of RMSE per period that
+        starts at the corresponding date of 'time'. The GLUE limits of the
+        budgets from that date, and of the water levels after that date,
+        were computed with the RMSE of the row. The rows of the previous
+        updates of gluedf are kept.
+
+        The data must be loaded with the same deltat as the one used to
+        produce gluedf.
+        """
+        try:
+            state = gluedf['state']
+        except KeyError:
+            raise ValueError("The state of the behavioural models was not "
+                             "saved with these GLUE results.")
+        params = gluedf['params']
+        scheme = state['scheme']
+        if isinstance(scheme, bytes):
+            scheme = scheme.decode('utf-8')
+        if scheme == 'backward':
+            raise ValueError("The hydrographs produced with the backward "
+                             "scheme cannot be extended in time.")
+        if self.deltat != params['deltat']:
+            raise ValueError("The data must be loaded with deltat = %s."
+                             % params['deltat'])
+        if not np.allclose((self.A, self.B), gluedf['mrc']['params']):
+            raise ValueError("The MRC of the well changed since these GLUE "
+                             "results were computed.")
+        k0 = np.where(self.tweatr == state['time'])[0]
+        j0 = np.where(self.twlvl == state['time'])[0]
+        if len(k0) == 0 or len(j0) == 0:
+            raise ValueError("The data do not cover the end of the period "
+                             "of these GLUE results.")
+        k0, j0 = k0[0], j0[0]
+        self.TMELT, self.CM = params['tmelt'], params['CM']
+        self.Sy = tuple(gluedf['ranges']['Sy'])
+        self.Cro = tuple(gluedf['ranges']['Cro'])
+        self.RASmax = tuple(gluedf['ranges']['RASmax'])
+        self.hydrograph_scheme = scheme
+        set_Sy = np.asarray(params['Sy'], dtype=float)
+        set_Cru = np.asarray(params['Cru'], dtype=float)
+        set_RASmax = np.asarray(params['RASmax'], dtype=float)
+
+        # ---- Extend the models over the new days
+
+        PAVL, PACC = calcul_snow_melt(
+            self.PTOT[k0:], self.TAVG[k0:], self.TMELT, self.CM,
+            state['PACC'])
+        rechgs, rus, etrs = calcul_runoff_storage_batch(
+            self.ETP[k0:], PAVL, set_Cru, set_RASmax,
+            np.asarray(state['RAS'], dtype=float))
+
+        # The hydrographs start from the water levels simulated at the last
+        # day of the previous water level data.
+        te = np.where(self.twlvl[-1] == self.tweatr)[0][0] - k0
+        wlobs = self.wlobs[j0:] * 1000
+        calc_hydrograph_func, _ = self._get_hydrograph_scheme()
+        hydrographs = np.zeros((len(set_Sy), len(wlobs)))
+        wlini = np.copy(wlobs)
+        for i in range(len(set_Sy)):
+            wlini[0] = state['wlpre'][i]
+            hydrographs[i] = calc_hydrograph_func(
+                rechgs[i, :te], wlini, set_Sy[i], self.A, self.B)
+
+        # ---- Update the RMSE with the residuals of the new observations
+
+        nonan = ~np.isnan(wlobs)
+        nonan[0] = False
+        SSE = state['SSE'] + np.sum(
+            (wlobs[nonan] - hydrographs[:, nonan])**2, axis=1)
+        nobs = state['nobs'] + np.sum(nonan)
+        set_RMSE = np.sqrt(SSE / nobs)
+
+        # ---- Update the GLUE limits
+
+        new = {'RMSE': set_RMSE, 'recharge': rechgs, 'etr': etrs, 'ru': rus,
+               'hydrograph': hydrographs}
+        # The daily quantiles of gluedf are updated when they were saved,
+        # so that the updated results can still be queried for any
+        # probabilities with glue_at.
+        if 'quantiles' in gluedf:
+            dly = gluedf['quantiles']['daily budget']
+            wl = gluedf['quantiles']['water levels']
         else:
-            glue_dataf = None
-        self.sig_glue_finished.emit(glue_dataf)
+            dly = gluedf['daily budget']
+            wl = gluedf['water levels']
+        deltat = int(params['deltat'])
+        old = {'recharge': dly['recharge'][deltat:deltat + k0],
+               'etr': dly['evapo'][:k0],
+               'ru': dly['runoff'][:k0]}
+        series = {var: GLUELimits(dly['GLUE limits'], np.vstack(
+                      [old[var], calcul_glue(new, dly['GLUE limits'], var)]))
+                  for var in old}
+        wl_limits = wl['GLUE limits']
+        series['hydrograph'] = GLUELimits(wl_limits, np.vstack(
+            [wl['predicted'][:j0 + 1],
+             calcul_glue(new, wl_limits, 'hydrograph')[1:]]))
+
+        glue_rawdata = self._make_glue_rawdata(
+            list(set_RMSE), list(set_Sy), list(set_Cru), list(set_RASmax),
+            series)
+        if 'weights' in gluedf:
+            times = list(gluedf['weights']['time'])
+            weights = list(gluedf['weights']['RMSE'])
+        else:
+            times = [self.tweatr[0]]
+            weights = [np.sqrt(np.asarray(state['SSE']) / state['nobs'])]
+        glue_rawdata['weights'] = {
+            'time': np.array(times + [state['time']]),
+            'RMSE': np.vstack(weights + [set_RMSE])}
+        glue_rawdata['state'] = {
+            'time': self.twlvl[-1], 'scheme': scheme, 'PACC': PACC[te],
+            'nobs': nobs, 'RAS': self._calc_ras_at(
+                te, np.asarray(state['RAS'], dtype=float),
+                PAVL, rechgs, rus, etrs),
+            'wlpre': hydrographs[:, -1], 'SSE': SSE}
+        return GLUEDataFrame(glue_rawdata)
+
+    def cancel_glue_calcul(self):
+        """
+        Request the cancellation of the GLUE calculation that is currently
+        running in eval_recharge.
+        """
+        self._glue_canceled = True
 
-        return glue_dataf
+    def _eval_params_serial(self, params, store, progress=(0, None)):
+        """
+        Evaluate the models for the (Cru, RASmax) parameter combinations
+        in the current process, by chunks of GLUE_CHUNKSIZE combinations.
+        The optimization of Sy of each chunk starts from the middle of its
+        range, so that the results are the same as the ones obtained when
+        the chunks are evaluated in parallel or in the shards of a job.
+
+        The time series of the behavioural models are saved in store and
+        a list with their parameters and RMSE is returned. progress is the
+        number of combinations evaluated before this batch and the total
+        number of combinations to evaluate.
+        """
+        N = len(params)
+        offset, total = progress[0], progress[1] or N
+        results = []
+        for indexes in np.array_split(
+                np.arange(N), int(np.ceil(N / GLUE_CHUNKSIZE))):
+            if self._glue_canceled:
+                break
+            cached, missing = self._get_cached_results(params[indexes])
+            chunk_results, _, report = self.eval_params_chunk(
+                params[indexes[missing], 0], params[indexes[missing], 1],
+                np.mean(self.Sy), lambda i: self.sig_glue_progress.emit(
+                    (offset + indexes[0] + i + 1) / total * 100))
+            self._update_glue_report(report)
+            results.extend(self._store_realizations(
+                cached, missing, chunk_results, store))
+        return results
+
+    def _eval_params_parallel(self, params, store, progress=(0, None)):
+        """
+        Evaluate the models for the (Cru, RASmax) parameter combinations
+        by chunks of GLUE_CHUNKSIZE combinations with a pool of processes
+        or threads (see glue_executor). The chunks are the same as the ones
+        of _eval_params_serial, so that the results are identical.
+
+        The time series of the behavioural models are saved in store and
+        a list with their parameters and RMSE is returned, in the same order
+        as the parameter combinations. progress is the number of combinations
+        evaluated before this batch and the total number of combinations
+        to evaluate.
+        """
+        N = len(params)
+        offset, total = progress[0], progress[1] or N
+        chunks = np.array_split(
+            np.arange(N), int(np.ceil(N / GLUE_CHUNKSIZE)))
+        if self.glue_executor == 'thread':
+            Executor = ThreadPoolExecutor
+            eval_params_chunk = partial(_eval_worker_params_chunk, self)
+        elif self.glue_executor == 'process':
+            Executor = ProcessPoolExecutor
+            eval_params_chunk = partial(
+                _eval_params_chunk, self._get_compute_state())
+        else:
+            raise ValueError(
+                "glue_executor must be either 'process' or 'thread'.")
+
+        # The results of the chunks that are completed before the ones
+        # that precede them are kept in pending until they can be stored.
+        results = []
+        pending = {}
+        next_chunk = 0
+        done = 0
+        cached = {}
+        with Executor(max_workers=self.glue_nworkers) as executor:
+            futures = {}
+            for i, indexes in enumerate(chunks):
+                cached[i] = self._get_cached_results(params[indexes])
+                missing = cached[i][1]
+                futures[executor.submit(
+                    eval_params_chunk,
+                    params[indexes[missing], 0],
+                    params[indexes[missing], 1])] = i
+            for future in as_completed(futures):
+                if self._glue_canceled:
+                    for f in futures:
+                        f.cancel()
+                    break
+                i = futures[future]
+                pending[i], report = future.result()
+                self._update_glue_report(report)
+                while next_chunk in pending:
+                    results.extend(self._store_realizations(
+                        *cached.pop(next_chunk), pending.pop(next_chunk),
+                        store))
+                    next_chunk += 1
+                done += len(chunks[i])
+                self.sig_glue_progress.emit((offset + done) / total * 100)
+
+        return results
+
+    def _update_glue_report(self, report):
+        """Add the counts of a chunk report to the run report."""
+        for key in GLUE_REPORT_KEYS:
+            self.glue_report[key] += report[key]
+
+    def _print_glue_report(self):
+        """
+        Print the number of models that were evaluated, found behavioural,
+        rejected or pruned during the last GLUE calculation.
+        """
+        print('-'*78)
+        for key in GLUE_REPORT_KEYS:
+            print('%d models %s' % (self.glue_report[key], key))
+        print('-'*78)
+
+    def _get_cached_results(self, params):
+        """
+        Return the cached results of the models for the (Cru, RASmax)
+        parameter combinations and the indexes of the combinations that are
+        not in the cache and need to be evaluated.
+
+        A model is considered to be in the cache only if its time series
+        were cached when it is behavioural with the current criteria.
+        """
+        cached = {}
+        if self._glue_cache is not None:
+            for i, (cru, rasmax) in enumerate(params):
+                result = self._glue_cache.get(cru, rasmax)
+                if result is None:
+                    continue
+                result['status'] = self._classify_fit(
+                    result['Sy'], result['RMSE'])
+                if (result['status'] != 'behavioural' or
+                        'recharge' in result):
+                    cached[i] = result
+        missing = np.array([i for i in range(len(params)) if i not in cached],
+                           dtype=int)
+        return cached, missing
+
+    def _store_realizations(self, cached, missing, chunk_results, store):
+        """
+        Merge the cached results of a chunk with the results of the models
+        that were evaluated, in the order of the parameter combinations.
+        The time series of the behavioural models are moved to the store and
+        the parameters and RMSE of the behavioural models are returned.
+        """
+        if self._glue_cache is not None:
+            for result in chunk_results:
+                if not result['status'].startswith('pruned'):
+                    self._glue_cache.put(result)
+            for result in cached.values():
+                self.glue_report['evaluated'] += 1
+                self.glue_report['cached'] += 1
+                self.glue_report[result['status']] += 1
+
+        merged = dict(cached)
+        merged.update(zip(missing, chunk_results))
+        behavioural = []
+        for i in sorted(merged.keys()):
+            result = merged[i]
+            if result.pop('status') == 'behavioural':
+                series = {var: result.pop(var) for var in store.varnames}
+                if self.glue_streaming:
+                    store.append(result['RMSE'], **series)
+                else:
+                    store.append(**series)
+                behavioural.append(result)
+        return behavioural
+
+    def _open_glue_cache(self):
+        """
+        Open the cache of the models evaluated with the current input data
+        and parameters, if a folder is set for the cache. The settings of
+        the optimization of Sy are part of the key of the cache, since the
+        cached values of Sy and RMSE depend on them.
+        """
+        if self.glue_cache_dirname is None:
+            return None
+        key = make_cache_key(
+            self.ETP, self.PTOT, self.TAVG, self.tweatr, self.twlvl,
+            self.wlobs, self.A, self.B, self.TMELT, self.CM, self.deltat,
+            list(HYDROGRAPH_SCHEMES).index(self.hydrograph_scheme),
+            GLUE_OPTIMIZERS.index(self.glue_optimizer), self.glue_sy_tol,
+            self.glue_sy_maxiter)
+        return RealizationCache(
+            self.glue_cache_dirname, key, self.glue_cache_maxsize)
+
+    def _get_compute_state(self):
+        """
+        Return a picklable dict with the data and parameters that are
+        required to evaluate the models in another process.
+        """
+        return {'ETP': self.ETP, 'PTOT': self.PTOT, 'TAVG': self.TAVG,
+                'PAVL': self.PAVL, 'tweatr': self.tweatr,
+                'TMELT': self.TMELT, 'CM': self.CM,
+                'A': self.A, 'B': self.B, 'twlvl': self.twlvl,
+                'wlobs': self.wlobs, 'Sy': self.Sy,
+                'hydrograph_scheme': self.hydrograph_scheme,
+                'glue_pruning': self.glue_pruning,
+                'glue_prune_margin': self.glue_prune_margin,
+                'glue_rmse_max': self.glue_rmse_max,
+                'glue_optimizer': self.glue_optimizer,
+                'glue_sy_tol': self.glue_sy_tol,
+                'glue_sy_maxiter': self.glue_sy_maxiter}
+
+    def _set_compute_state(self, state):
+        """Set the data and parameters from a dict of compute state."""
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def eval_params_chunk(self, cru, rasmax, Sy0, progress_callback=None,
+                          budget=None):
+        """
+        Evaluate the models for a chunk of (Cru, RASmax) parameter pairs.
+
+        Sy0 is the initial value of Sy that is used for the first model of
+        the chunk. The optimal value of Sy found for a model is then used as
+        the initial value for the next one, unless glue_optimizer is 'batch',
+        in which case Sy0 is used for every 16th model of the chunk and the
+        values found for these are interpolated for the others.
+
+        Return a list with the results of the models of the chunk, the last
+        optimal value of Sy, and a report with the number of models that
+        were evaluated, rejected, or pruned during the optimization of Sy.
+        The time series are only included in the results of the behavioural
+        models.
+
+        budget is a tuple with the recharge, runoff and real
+        evapotranspiration of the models, as returned by
+        surf_water_budget_batch, when these were already computed.
+        """
+        report = dict.fromkeys(GLUE_REPORT_KEYS, 0)
+        if len(cru) == 0:
+            # All the models of the chunk were found in the cache.
+            return [], Sy0, report
+
+        # Find the indexes to align the water level with the weather data
+        # daily time series.
+        ts = np.where(self.twlvl[0] == self.tweatr)[0][0]
+        te = np.where(self.twlvl[-1] == self.tweatr)[0][0]
+
+        if budget is None:
+            budget = self.surf_water_budget_batch(cru, rasmax, self.PAVL)
+        rechgs, rus, etrs = budget
+        if self.glue_optimizer == 'batch':
+            # The models that are next to each other in the chunk have
+            # similar optimal values of Sy, so the values found for every
+            # 16th model are interpolated to start the optimization of
+            # the others.
+            iseeds = np.arange(0, len(cru), 16)
+            Sy_seeds = self.optimize_specific_yield_batch(
+                Sy0, self.wlobs*1000, rechgs[iseeds, ts:te])[0]
+            set_SyOpt, set_RMSE, set_wlvlest, set_pruned = (
+                self.optimize_specific_yield_batch(
+                    np.interp(np.arange(len(cru)), iseeds, Sy_seeds),
+                    self.wlobs*1000, rechgs[:, ts:te],
+                    prune=self.glue_pruning))
+        results = []
+        for i in range(len(cru)):
+            if self._glue_canceled:
+                break
+            if self.glue_optimizer == 'batch':
+                SyOpt, RMSE = set_SyOpt[i], set_RMSE[i]
+                wlvlest = None if set_pruned[i] else set_wlvlest[i]
+            else:
+                SyOpt, RMSE, wlvlest = self.optimize_specific_yield(
+                    Sy0, self.wlobs*1000, rechgs[i, ts:te],
+                    prune=self.glue_pruning)
+            Sy0 = SyOpt
+            report['evaluated'] += 1
+
+            status = self._classify_fit(SyOpt, RMSE, wlvlest is None)
+            report[status] += 1
+            result = {'RMSE': RMSE, 'Sy': SyOpt,
+                      'RASmax': rasmax[i], 'Cru': cru[i], 'status': status}
+            if status == 'behavioural':
+                result.update({'hydrograph': wlvlest,
+                               'recharge': np.copy(rechgs[i]),
+                               'ru': np.copy(rus[i]),
+                               'etr': np.copy(etrs[i])})
+            results.append(result)
+
+            if progress_callback is not None:
+                progress_callback(i)
+            print(('Cru = %0.3f ; RASmax = %0.0f mm ; Sy = %0.4f ; ' +
+                   'RMSE = %0.1f') % (cru[i], rasmax[i], SyOpt, RMSE))
+        return results, Sy0, report
 
     def _print_model_params_summary(self, set_Sy, set_Cru, set_RASmax):
         """
@@ -301,53 +968,64 @@ class RechgEvalWorker(QObject):
         filename = osp.join(osp.dirname(__file__), 'glue_rawdata.npy')
         np.save(filename, glue_rawdata)
 
-    def optimize_specific_yield(self, Sy0, wlobs, rechg):
+    def optimize_specific_yield(self, Sy0, wlobs, rechg, prune=False):
         """
         Find the optimal value of Sy that minimizes the RMSE between the
         observed and predicted ground-water hydrographs. The observed water
         level (wlobs) and simulated recharge (rechg) time series must be
         in mm and be properly align in time.
+
+        The Jacobian of the Gauss-Newton method is the derivative of the
+        predicted water levels with respect to Sy, which is computed in the
+        same pass as the hydrograph with calc_hydrograph_sens.
+
+        If prune is True, the optimization is aborted as soon as Sy leaves
+        the admissible range of values by more than glue_prune_margin, or
+        when the RMSE is still above glue_rmse_max once the iterations are
+        close to convergence. The predicted water levels are returned as
+        None when the optimization is aborted.
         """
         nonan_indx = np.where(~np.isnan(wlobs))
 
         # ---- Gauss-Newton
 
-        tolmax = 0.001
+        tolmax = self.glue_sy_tol
         Sy = Sy0
-        dSy = 0.01
 
-        wlpre = self.calc_hydrograph(rechg, Sy)
+        wlpre, dwl = self.calc_hydrograph_sens(rechg, Sy)
         RMSE = calcul_rmse(wlobs[nonan_indx], wlpre[nonan_indx])
 
         it = 0
         while 1:
             it += 1
-            if it > 100:
+            if it > self.glue_sy_maxiter:
                 print('Not converging.')
-                break
-
-            # Calculating Jacobian (X) Numerically.
-            wlvl = self.calc_hydrograph(rechg, Sy * (1+dSy))
-            X = Xt = (wlvl[nonan_indx] - wlpre[nonan_indx])/(Sy*dSy)
+                return Sy, RMSE, wlpre
 
             # Solving Linear System.
+            X = dwl[nonan_indx]
             dh = wlobs[nonan_indx] - wlpre[nonan_indx]
-            XtX = np.dot(Xt, X)
-            Xtdh = np.dot(Xt, dh)
-
-            dr = np.linalg.tensorsolve(XtX, Xtdh, axes=None)
+            XtX = np.dot(X, X)
+            if XtX == 0:
+                # The hydrograph does not depend on Sy (no recharge).
+                return Sy, RMSE, wlpre
+            dr = np.dot(X, dh) / XtX
 
             # Storing old parameter values.
-            Syold = np.copy(Sy)
-            RMSEold = np.copy(RMSE)
+            Syold = Sy
+            RMSEold = RMSE
 
             # Loop for Damping (to prevent overshoot)
             while 1:
                 # Calculating new paramter values.
                 Sy = Syold + dr
+                if Sy <= 0:
+                    # Sy must stay strictly positive.
+                    dr = dr * 0.5
+                    continue
 
                 # Solving for new parameter values.
-                wlpre = self.calc_hydrograph(rechg, Sy)
+                wlpre, dwl = self.calc_hydrograph_sens(rechg, Sy)
                 RMSE = calcul_rmse(wlobs[nonan_indx], wlpre[nonan_indx])
 
                 # Checking overshoot.
@@ -361,6 +1039,139 @@ class RechgEvalWorker(QObject):
             if tol < tolmax:
                 return Sy, RMSE, wlpre
 
+            # Checking if the model is hopeless.
+            if prune and self._is_fit_hopeless(Sy, RMSE, tol/tolmax):
+                return Sy, RMSE, None
+
+    def optimize_specific_yield_batch(self, Sy0, wlobs, rechgs, prune=False):
+        """
+        Find the optimal values of Sy for a set of recharge time series, one
+        per row of rechgs, with the same Gauss-Newton method as
+        optimize_specific_yield, but for all of them at once.
+
+        The hydrographs of the models that are still iterating are computed
+        with a single call to calc_hydrograph_sens_batch, while the
+        convergence, damping and pruning of each model are tracked with
+        masks. Sy0 is either the initial value of Sy of all the models or
+        an array with the initial value of each model.
+
+        Return arrays with the optimal value of Sy and RMSE of each model,
+        a 2D array with their predicted water levels, and a boolean array
+        that is True for the models whose optimization was aborted.
+        """
+        rechgs = np.atleast_2d(np.asarray(rechgs, dtype=float))
+        M = len(rechgs)
+        # The sums over the days with an observation are computed as
+        # products with the mask of these days, which is faster than
+        # gathering their columns.
+        nonan = (~np.isnan(wlobs)).astype(float)
+        wlobs = np.where(nonan > 0, wlobs, 0)
+
+        def calc_rmse(wlpre):
+            return np.sqrt(((wlobs - wlpre)**2 @ nonan) / np.sum(nonan))
+
+        # ---- Gauss-Newton
+
+        tolmax = self.glue_sy_tol
+        Sy = np.broadcast_to(np.asarray(Sy0, dtype=float), (M,)).copy()
+
+        wlpre, dwl = self.calc_hydrograph_sens_batch(rechgs, Sy)
+        RMSE = calc_rmse(wlpre)
+
+        active = np.ones(M, dtype=bool)
+        pruned = np.zeros(M, dtype=bool)
+        it = 0
+        while np.any(active):
+            it += 1
+            if it > self.glue_sy_maxiter:
+                print('Not converging.')
+                break
+
+            # Solving Linear System.
+            rows = np.where(active)[0]
+            X = dwl[rows]
+            XtX = X**2 @ nonan
+            Xtdh = (X * (wlobs - wlpre[rows])) @ nonan
+
+            # The hydrographs of these models do not depend on Sy.
+            active[rows[XtX == 0]] = False
+            rows, XtX, Xtdh = rows[XtX != 0], XtX[XtX != 0], Xtdh[XtX != 0]
+            dr = Xtdh / XtX
+
+            # Storing old parameter values.
+            Syold = Sy[rows]
+            RMSEold = RMSE[rows]
+
+            # Loop for Damping (to prevent overshoot)
+            damping = np.ones(len(rows), dtype=bool)
+            while np.any(damping):
+                # Sy must stay strictly positive.
+                Sytrial = Syold + dr
+                negative = damping & (Sytrial <= 0)
+                dr[negative] = dr[negative] * 0.5
+
+                trial = np.where(damping & ~negative)[0]
+                if len(trial) == 0:
+                    continue
+                wlpre_t, dwl_t = self.calc_hydrograph_sens_batch(
+                    rechgs[rows[trial]], Sytrial[trial])
+                RMSE_t = calc_rmse(wlpre_t)
+
+                # Checking overshoot.
+                overshoot = (RMSE_t - RMSEold[trial]) > 0.1
+                dr[trial[overshoot]] = dr[trial[overshoot]] * 0.5
+
+                accepted = ~overshoot
+                Sy[rows[trial[accepted]]] = Sytrial[trial[accepted]]
+                RMSE[rows[trial[accepted]]] = RMSE_t[accepted]
+                wlpre[rows[trial[accepted]]] = wlpre_t[accepted]
+                dwl[rows[trial[accepted]]] = dwl_t[accepted]
+                damping[trial[accepted]] = False
+
+            # Checking tolerance.
+            tol = np.abs(Sy[rows] - Syold)
+            converged = tol < tolmax
+            active[rows[converged]] = False
+
+            # Checking if the models are hopeless.
+            if prune:
+                hopeless = ~converged & self._is_fit_hopeless(
+                    Sy[rows], RMSE[rows], tol/tolmax)
+                active[rows[hopeless]] = False
+                pruned[rows[hopeless]] = True
+
+        return Sy, RMSE, wlpre, pruned
+
+    def _classify_fit(self, Sy, RMSE, pruned=False):
+        """
+        Return whether a model is behavioural or the reason why it is
+        rejected, given its optimal value of Sy and RMSE.
+        """
+        is_Sy_valid = min(self.Sy) <= Sy <= max(self.Sy)
+        if pruned:
+            return 'pruned Sy' if not is_Sy_valid else 'pruned RMSE'
+        elif not is_Sy_valid:
+            return 'rejected Sy'
+        elif self.glue_rmse_max is not None and RMSE > self.glue_rmse_max:
+            return 'rejected RMSE'
+        else:
+            return 'behavioural'
+
+    def _is_fit_hopeless(self, Sy, RMSE, reltol):
+        """
+        Return whether the optimization of Sy can be aborted because the
+        model is not going to be behavioural, given the current values of
+        Sy and RMSE and the last change in Sy relative to the tolerance.
+        These can be either scalars or arrays.
+        """
+        margin = self.glue_prune_margin * (max(self.Sy) - min(self.Sy))
+        hopeless = ((np.asarray(Sy) < min(self.Sy) - margin) |
+                    (np.asarray(Sy) > max(self.Sy) + margin))
+        if self.glue_rmse_max is not None:
+            hopeless |= ((np.asarray(reltol) < 10) &
+                         (np.asarray(RMSE) > self.glue_rmse_max))
+        return hopeless
+
     def surf_water_budget(self, CRU, RASmax):
         """
         Compute recharge with a daily soil surface moisture balance model.
@@ -385,50 +1196,113 @@ class RechgEvalWorker(QObject):
 
         return rechg, ru, etr, ras, pacc
 
-    def calc_hydrograph(self, RECHG, Sy, nscheme='forward'):
+    def snow_melt(self):
+        """
+        Compute the daily available precipitation on the ground surface with
+        a degree-day snow accumulation and melt model.
+
+        pavl = Daily available precipitation in mm
+        pacc = Daily accumulated precipitation on the ground surface in mm
+        """
+        pavl, pacc = calcul_snow_melt(
+            self.PTOT, self.TAVG, self.TMELT, self.CM)
+
+        return pavl, pacc
+
+    def surf_water_budget_batch(self, CRU, RASmax, PAVL=None):
         """
-        This is a forward numerical explicit scheme for generating the
-        synthetic well hydrograph.
+        Compute recharge with a daily soil surface moisture balance model
+        for a set of (CRU, RASmax) parameter pairs at once.
 
-        This is a backward explicit scheme to produce a synthetic well
-        hydrograph. The water level starts at the last days in the observed
-        water level time series and generate the hydrograph by going backward
-        in time. This is very usefull when one which to produce water level
-        for the period of time before water level measurements are
-        available.
+        CRU = 1D array of surface runoff coefficients
+        RASmax = 1D array of maximum readily available storage in mm
+        PAVL = Daily available precipitation in mm as computed with
+               snow_melt. It is computed from the weather data if None.
+
+        Return the daily recharge, surface runoff and real evapotranspiration
+        in mm as 2D arrays of shape (len(CRU), len(ETP)), where each
+        row corresponds to one parameter pair.
+        """
+        if PAVL is None:
+            PAVL, _ = self.snow_melt()
+        rechg, ru, etr = calcul_runoff_storage_batch(
+                self.ETP, PAVL, np.asarray(CRU, dtype=float),
+                np.asarray(RASmax, dtype=float))
+
+        return rechg, ru, etr
+
+    def calc_hydrograph(self, RECHG, Sy, nscheme=None):
+        """
+        Produce a synthetic well hydrograph from the recharge and the
+        parameters of the master recession curve (MRC), with a numerical
+        scheme that is solved in gwrecharge_calculs.
+
+        The 'forward' scheme is explicit and starts at the first day of the
+        observed water level time series. The 'cranknicolson' scheme also
+        starts at the first day, but the recession of each day is the average
+        of the recessions at the start and at the end of the day. The
+        'backward' scheme starts at the last day of the observed water level
+        time series and generates the hydrograph by going backward in time.
+        This is very usefull when one which to produce water level for the
+        period of time before water level measurements are available.
+
+        The 'forward' and 'cranknicolson' hydrographs cover the days of the
+        observed water levels, while the 'backward' hydrograph has one more
+        day than RECHG, whose last day must be the one before the last
+        observed water level. Passing a RECHG that starts before twlvl[0]
+        thus produces the water levels before the first observed one.
 
         Parameters
         ----------
-        Wlpre: Predicted Water Level (mm)
-        Sy: Specific Yield
         RECHG: Groundwater Recharge (mm)
-        WLobs: Observed Water Level (mm)
+        Sy: Specific Yield
+        nscheme: Option are "forward", "cranknicolson" or "backward".
+                 Default is the scheme set in hydrograph_scheme.
 
-        A, B: MRC Parameters, where: Recess(m/d) = -A * h + B
-        nscheme: Option are "forward" or "downdward" depending if the
-                 hydrograph is being built forward in time or backward.
-                 Default is "forward".
+        Returns
+        -------
+        Wlpre: Predicted Water Level (mm), where the MRC parameters are
+               given by: Recess(m/d) = -A * h + B
         """
+        calc_hydrograph_func, _ = self._get_hydrograph_scheme(nscheme)
+        return calc_hydrograph_func(
+            np.asarray(RECHG, dtype=float), self.wlobs*1000,
+            Sy, self.A, self.B)
 
-        # TODO: It should also be possible to do a Crank-Nicholson on this.
-        # I should check this out.
-
-        A, B = self.A, self.B
-        wlobs = self.wlobs*1000
-        if nscheme == 'backward':
-            wlpre = np.zeros(len(RECHG)+1) * np.nan
-            wlpre[0] = wlobs[-1]
-            for i in reversed(range(len(RECHG))):
-                RECESS = (B - A * wlpre[i] / 1000.) * 1000
-                RECESS = max(RECESS, 0)
+    def calc_hydrograph_sens(self, RECHG, Sy, nscheme=None):
+        """
+        Compute the synthetic well hydrograph in mm and its derivative with
+        respect to Sy. See calc_hydrograph for more details.
+        """
+        _, calc_hydrograph_sens_func = self._get_hydrograph_scheme(nscheme)
+        return calc_hydrograph_sens_func(
+            np.asarray(RECHG, dtype=float), self.wlobs*1000,
+            Sy, self.A, self.B)
 
-                wlpre[i] = wlpre[i+1] + (RECHG[i] / Sy) - RECESS
-        elif nscheme == 'forward':
-            wlpre = calc_hydrograph_forward(RECHG, wlobs, Sy, self.A, self.B)
-        else:
-            wlpre = []
+    def calc_hydrograph_sens_batch(self, RECHG, Sy, nscheme=None):
+        """
+        Compute the synthetic well hydrographs in mm and their derivative
+        with respect to Sy for a set of recharge time series, one per row
+        of RECHG, and the corresponding values of Sy.
+        See calc_hydrograph for more details.
+        """
+        nscheme = self.hydrograph_scheme if nscheme is None else nscheme
+        self._get_hydrograph_scheme(nscheme)
+        return calc_hydrograph_sens_batch(
+            np.asarray(RECHG, dtype=float), self.wlobs*1000,
+            np.asarray(Sy, dtype=float), self.A, self.B, nscheme)
 
-        return wlpre
+    def _get_hydrograph_scheme(self, nscheme=None):
+        """
+        Return the functions that produce the synthetic hydrograph and its
+        derivative with the numerical scheme nscheme.
+        """
+        nscheme = self.hydrograph_scheme if nscheme is None else nscheme
+        try:
+            return HYDROGRAPH_SCHEMES[nscheme]
+        except KeyError:
+            raise ValueError("nscheme must be one of: %s" %
+                             ', '.join(HYDROGRAPH_SCHEMES))
 
     @staticmethod
     def mrc2rechg(t, hobs, A, B, z, Sy):
@@ -504,6 +1378,97 @@ class RechgEvalWorker(QObject):
         return RECHG
 
 
+def eval_recharge_multiwell(workers):
+    """
+    Evaluate the recharge with GLUE jointly for several wells that share the
+    same weather data, so that the surface water budget is computed only
+    once for each (Cru, RASmax) parameter combination.
+
+    workers is a list of RechgEvalWorker, one per well, whose data must be
+    loaded. They must share the same weather data and the same values of
+    Cro, RASmax, TMELT, CM and sampler settings, while the water levels,
+    the MRC parameters, the range of Sy and deltat can differ.
+
+    The parameter combinations are produced with the sampler of the first
+    worker, which is driven by the well with the fewest behavioural models.
+    The progress is emitted by the first worker, and the GLUE calculation is
+    canceled for all wells when it is canceled for the first worker.
+
+    Return a list with the GLUEDataFrame of each well, which is None if no
+    behavioural model was found for the well.
+    """
+    leader = workers[0]
+    for worker in workers[1:]:
+        if not (np.array_equal(worker.ETP, leader.ETP) and
+                np.array_equal(worker.PTOT, leader.PTOT) and
+                np.array_equal(worker.TAVG, leader.TAVG) and
+                worker.TMELT == leader.TMELT and worker.CM == leader.CM):
+            raise ValueError("The wells must share the same weather data "
+                             "and snow melt parameters.")
+        if not (np.array_equal(worker.Cro, leader.Cro) and
+                np.array_equal(worker.RASmax, leader.RASmax) and
+                all(getattr(worker, name) == getattr(leader, name) for
+                    name in SAMPLER_SETTINGS)):
+            raise ValueError("The wells must share the same ranges of Cro "
+                             "and RASmax and the same sampler settings.")
+
+    sampler = leader.produce_params_sampler()
+    time_start = time.time()
+    stores = [worker._start_glue_calcul() for worker in workers]
+    results = [[] for worker in workers]
+    params = sampler.next_batch(None)
+    while params is not None and not leader.glue_canceled:
+        N = len(params)
+        offset = sampler.nsampled - N
+        for indexes in np.array_split(
+                np.arange(N), int(np.ceil(N / GLUE_CHUNKSIZE))):
+            if leader.glue_canceled:
+                break
+            budget = leader.surf_water_budget_batch(
+                params[indexes, 0], params[indexes, 1], leader.PAVL)
+            for worker, store, wresults in zip(workers, stores, results):
+                cached, missing = worker._get_cached_results(params[indexes])
+                chunk_results, _, report = worker.eval_params_chunk(
+                    params[indexes[missing], 0], params[indexes[missing], 1],
+                    np.mean(worker.Sy), budget=[x[missing] for x in budget])
+                worker._update_glue_report(report)
+                wresults.extend(worker._store_realizations(
+                    cached, missing, chunk_results, store))
+            leader.sig_glue_progress.emit(
+                (offset + indexes[-1] + 1) / sampler.max_samples * 100)
+        params = sampler.next_batch(
+            [(r['Cru'], r['RASmax']) for r in min(results, key=len)])
+    leader.sig_glue_progress.emit(100)
+
+    gluedfs = []
+    for worker, store, wresults in zip(workers, stores, results):
+        worker._glue_canceled = leader.glue_canceled
+        gluedfs.append(
+            worker._finish_glue_calcul(store, wresults, time_start))
+    return gluedfs
+
+
+def _eval_params_chunk(state, cru, rasmax):
+    """
+    Evaluate the models for a chunk of (Cru, RASmax) parameter pairs in a
+    worker process of the pool used by RechgEvalWorker.
+    """
+    worker = RechgEvalWorker()
+    worker._set_compute_state(state)
+    return _eval_worker_params_chunk(worker, cru, rasmax)
+
+
+def _eval_worker_params_chunk(worker, cru, rasmax):
+    """
+    Evaluate the models for a chunk of (Cru, RASmax) parameter pairs with
+    worker, in a thread or a worker process of the pool used by
+    RechgEvalWorker.
+    """
+    results, _, report = worker.eval_params_chunk(
+        cru, rasmax, np.mean(worker.Sy))
+    return results, report
+
+
 def convert_date_to_strdate(years, months, days):
     """Produce a list of dates in bytes using the '%Y-%m-%d' format."""
     strdates = ['%d-%02d-%02d' % (yy, mm, dd) for
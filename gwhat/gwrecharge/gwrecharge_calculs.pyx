@@ -6,40 +6,36 @@
 # This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
 # Licensed under the terms of the GNU General Public License.
 
+# The computations of the models are done in typed functions that are
+# declared nogil and that work on memoryviews. They are called by the Python
+# functions of this module without holding the GIL, so that they can run
+# concurrently in several threads (see RechgEvalWorker.glue_executor).
+
 # ---- Third party imports
 
-from numpy cimport ndarray
 import numpy as np
 cimport numpy as np
 cimport cython
 ctypedef np.float64_t DTYPE_t
 DTYPE = np.float64
 
-def calcul_surf_water_budget(ndarray[np.float64_t, ndim=1] ETP, 
-                             ndarray[np.float64_t, ndim=1] PTOT, 
-                             ndarray[np.float64_t, ndim=1] TAVG,
-                             double TMELT, double CM, double CRU, 
-                             double RASmax):
-    
-    cdef int N = len(ETP)
-    cdef ndarray[np.float64_t, ndim=1] PAVL = np.zeros(N, dtype=DTYPE)   # Available  Precipitation
-    cdef ndarray[np.float64_t, ndim=1] PACC = np.zeros(N, dtype=DTYPE)   # Accumulated Precipitation
-    cdef ndarray[np.float64_t, ndim=1] RU = np.zeros(N, dtype=DTYPE)     # Runoff
-    cdef ndarray[np.float64_t, ndim=1] I = np.zeros(N, dtype=DTYPE)      # Infiltration
-    cdef ndarray[np.float64_t, ndim=1] ETR = np.zeros(N, dtype=DTYPE)    # Evapotranspiration Real
-    cdef ndarray[np.float64_t, ndim=1] dRAS = np.zeros(N, dtype=DTYPE)   # Variation of RAW
-    cdef ndarray[np.float64_t, ndim=1] RAS = np.zeros(N, dtype=DTYPE)    # Readily Available Storage
-    cdef ndarray[np.float64_t, ndim=1] RECHG = np.zeros(N, dtype=DTYPE)  # Recharge (mm)
-    cdef double MP = 0.0
-    
-    PACC[0] = 0
-    RAS[0] = RASmax
-    
+
+# ---- Surface water budget
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _snow_melt(const double[:] PTOT, const double[:] TAVG,
+                     double TMELT, double CM, double PACC0,
+                     double[:] PAVL, double[:] PACC) noexcept nogil:
+    cdef Py_ssize_t N = PTOT.shape[0]
+    cdef double MP
     cdef Py_ssize_t i
-    for i in range(N-1):
-        MP = max(CM * (TAVG[i] - TMELT), 0)  # Snow Melt Potential
 
-        # ----- Precipitation, Accumulation, and Melt -----
+    PACC[0] = PACC0
+    for i in range(N-1):
+        MP = CM * (TAVG[i] - TMELT)  # Snow Melt Potential
+        if MP < 0:
+            MP = 0
 
         if TAVG[i] > TMELT:
             # Precipitation is falling as rain.
@@ -56,10 +52,23 @@ def calcul_surf_water_budget(ndarray[np.float64_t, ndim=1] ETP,
             PAVL[i] = 0
             PACC[i+1] = PACC[i] + PTOT[i]
 
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _runoff_storage(const double[:] ETP, const double[:] PAVL,
+                          double CRU, double RASmax, double RAS0,
+                          double[:] RECHG, double[:] RU, double[:] ETR,
+                          double[:] RAS) noexcept nogil:
+    cdef Py_ssize_t N = ETP.shape[0]
+    cdef double I, dRAS
+    cdef Py_ssize_t i
+
+    RAS[0] = RAS0
+    for i in range(N-1):
         # ----- Infiltration and Runoff -----
 
         # runoff coefficient
-        RU[i] = CRU*PAVL[i]
+        RU[i] = CRU * PAVL[i]
 
         # curve number
         # CN = CRU
@@ -67,35 +76,396 @@ def calcul_surf_water_budget(ndarray[np.float64_t, ndim=1] ETP,
         # den = PAVL[i] + 0.8*(1000/CN-10)
         # RU[i] = max(num/den, 0)
 
-        I[i] = PAVL[i] - RU[i]
+        I = PAVL[i] - RU[i]
 
         # ----- ETR, Recharge and Storage change -----
 
         # Intermediate Step
-        dRAS[i] = min(I[i], RASmax - RAS[i])
-        RAS[i+1] = RAS[i] + dRAS[i]
+        dRAS = RASmax - RAS[i]
+        if I < dRAS:
+            dRAS = I
 
         # Final Step
-        RECHG[i] = I[i] - dRAS[i]
-        ETR[i] = min(ETP[i], RAS[i])
-        RAS[i+1] = RAS[i+1] - ETR[i]
+        RECHG[i] = I - dRAS
+        ETR[i] = RAS[i] if ETP[i] > RAS[i] else ETP[i]
+        RAS[i+1] = RAS[i] + dRAS - ETR[i]
 
         # Evaportransporation is calculated after recharge. It is assumed
         # that recharge occurs on a time scale that is faster than
         # evapotranspiration in permeable soil.
+
+
+def calcul_surf_water_budget(const double[:] ETP, const double[:] PTOT,
+                             const double[:] TAVG, double TMELT, double CM,
+                             double CRU, double RASmax):
+    """
+    Compute the daily recharge (RECHG), runoff (RU), real
+    evapotranspiration (ETR), readily available storage (RAS) and
+    accumulated precipitation on the ground surface (PACC) for the
+    parameters CRU and RASmax.
+    """
+    cdef Py_ssize_t N = ETP.shape[0]
+    if PTOT.shape[0] != N or TAVG.shape[0] != N:
+        raise ValueError("ETP, PTOT and TAVG must have the same length.")
+    PAVL = np.zeros(N, dtype=DTYPE)   # Available  Precipitation
+    PACC = np.zeros(N, dtype=DTYPE)   # Accumulated Precipitation
+    RU = np.zeros(N, dtype=DTYPE)     # Runoff
+    ETR = np.zeros(N, dtype=DTYPE)    # Evapotranspiration Real
+    RAS = np.zeros(N, dtype=DTYPE)    # Readily Available Storage
+    RECHG = np.zeros(N, dtype=DTYPE)  # Recharge (mm)
+    if N == 0:
+        return RECHG, RU, ETR, RAS, PACC
+
+    cdef double[:] PAVL_v = PAVL, PACC_v = PACC, RU_v = RU
+    cdef double[:] ETR_v = ETR, RAS_v = RAS, RECHG_v = RECHG
+    with nogil:
+        _snow_melt(PTOT, TAVG, TMELT, CM, 0, PAVL_v, PACC_v)
+        _runoff_storage(ETP, PAVL_v, CRU, RASmax, RASmax,
+                        RECHG_v, RU_v, ETR_v, RAS_v)
     return RECHG, RU, ETR, RAS, PACC
 
 
-def calc_hydrograph_forward(ndarray[np.float64_t, ndim=1] rechg, 
-                            ndarray[np.float64_t, ndim=1] wlobs,
-                            double Sy, double A, double B):
-    
-    cdef int N = len(wlobs)
-    cdef ndarray[np.float64_t, ndim=1] wlpre = np.zeros(N, dtype=DTYPE)
-    
-    wlpre[0] = wlobs[0]
+def calcul_snow_melt(const double[:] PTOT, const double[:] TAVG,
+                     double TMELT, double CM, double PACC0=0):
+    """
+    Compute the daily available precipitation (PAVL) and accumulated
+    precipitation on the ground surface (PACC) with a degree-day
+    snow accumulation and melt model, starting with PACC0 mm of
+    accumulated precipitation on the first day.
+
+    These do not depend on the runoff coefficient nor on the maximum readily
+    available storage, so they only need to be computed once for all the
+    parameter pairs of the surface water budget.
+    """
+    cdef Py_ssize_t N = PTOT.shape[0]
+    if TAVG.shape[0] != N:
+        raise ValueError("PTOT and TAVG must have the same length.")
+    PAVL = np.zeros(N, dtype=DTYPE)
+    PACC = np.zeros(N, dtype=DTYPE)
+    if N == 0:
+        return PAVL, PACC
+
+    cdef double[:] PAVL_v = PAVL, PACC_v = PACC
+    with nogil:
+        _snow_melt(PTOT, TAVG, TMELT, CM, PACC0, PAVL_v, PACC_v)
+    return PAVL, PACC
+
+
+def calcul_runoff_storage_batch(const double[:] ETP, const double[:] PAVL,
+                                const double[:] CRU, const double[:] RASmax,
+                                const double[:] RAS0=None):
+    """
+    Compute the daily runoff, recharge and real evapotranspiration from the
+    available precipitation (PAVL) for a set of (CRU, RASmax) parameter
+    pairs. The i-th row of the returned 2D arrays corresponds to the
+    parameters CRU[i] and RASmax[i].
+
+    The readily available storage of each pair on the first day is RAS0[i]
+    if RAS0 is provided, else RASmax[i].
+    """
+    cdef Py_ssize_t N = ETP.shape[0]
+    cdef Py_ssize_t M = CRU.shape[0]
+    if RASmax.shape[0] != M:
+        raise ValueError("CRU and RASmax must have the same length.")
+    if RAS0 is None:
+        RAS0 = RASmax
+    elif RAS0.shape[0] != M:
+        raise ValueError("CRU and RAS0 must have the same length.")
+    if PAVL.shape[0] != N:
+        raise ValueError("ETP and PAVL must have the same length.")
+
+    RU = np.zeros((M, N), dtype=DTYPE)
+    ETR = np.zeros((M, N), dtype=DTYPE)
+    RECHG = np.zeros((M, N), dtype=DTYPE)
+    if N == 0:
+        return RECHG, RU, ETR
+
+    cdef double[:, :] RU_v = RU, ETR_v = ETR, RECHG_v = RECHG
+    cdef double[:] RAS_v = np.zeros(N, dtype=DTYPE)
+    cdef Py_ssize_t j
+    with nogil:
+        for j in range(M):
+            _runoff_storage(ETP, PAVL, CRU[j], RASmax[j], RAS0[j],
+                            RECHG_v[j], RU_v[j], ETR_v[j], RAS_v)
+    return RECHG, RU, ETR
+
+
+def calcul_surf_water_budget_batch(const double[:] ETP, const double[:] PTOT,
+                                   const double[:] TAVG,
+                                   double TMELT, double CM,
+                                   const double[:] CRU,
+                                   const double[:] RASmax):
+    """
+    Compute the surface water budget for a whole set of (CRU, RASmax)
+    parameter pairs at once.
+
+    The i-th row of the returned 2D arrays (RECHG, RU and ETR) contains the
+    same values that would be returned by calcul_surf_water_budget for the
+    parameters CRU[i] and RASmax[i]. The accumulated precipitation (PACC)
+    does not depend on CRU and RASmax and is returned as a 1D array.
+    """
+    PAVL, PACC = calcul_snow_melt(PTOT, TAVG, TMELT, CM)
+    RECHG, RU, ETR = calcul_runoff_storage_batch(ETP, PAVL, CRU, RASmax)
+    return RECHG, RU, ETR, PACC
+
+
+# ---- Synthetic hydrographs
+#
+# The derivative of the water levels with respect to Sy (dwl) is computed
+# along with the water levels when sens is true, by differentiating each step
+# of the numerical scheme (sensitivity equation).
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_forward(const double[:] rechg, double Sy,
+                              double A, double B, double[:] wlpre,
+                              double[:] dwl, bint sens) noexcept nogil:
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double recess
+    cdef double Sy2 = Sy * Sy
+    cdef Py_ssize_t i
+
+    for i in range(N-1):
+        recess = (B - A*wlpre[i]/1000) * 1000
+        if recess > 0:
+            wlpre[i+1] = wlpre[i] - (rechg[i]/Sy) + recess
+            if sens:
+                dwl[i+1] = dwl[i] * (1 - A) + rechg[i]/Sy2
+        else:
+            wlpre[i+1] = wlpre[i] - (rechg[i]/Sy)
+            if sens:
+                dwl[i+1] = dwl[i] + rechg[i]/Sy2
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_backward(const double[:] rechg, double Sy,
+                               double A, double B, double[:] wlpre,
+                               double[:] dwl, bint sens) noexcept nogil:
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double wl
+    cdef double Sy2 = Sy * Sy
+    cdef Py_ssize_t i
+
+    for i in range(N-2, -1, -1):
+        # The step is inverted assuming that the recession is positive
+        # at the previous day, which is checked afterwards.
+        wl = (wlpre[i+1] + rechg[i]/Sy - B*1000) / (1 - A)
+        if (B - A*wl/1000) > 0:
+            wlpre[i] = wl
+            if sens:
+                dwl[i] = (dwl[i+1] - rechg[i]/Sy2) / (1 - A)
+        else:
+            wlpre[i] = wlpre[i+1] + rechg[i]/Sy
+            if sens:
+                dwl[i] = dwl[i+1] - rechg[i]/Sy2
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _hydrograph_cranknicolson(const double[:] rechg, double Sy,
+                                    double A, double B, double[:] wlpre,
+                                    double[:] dwl, bint sens) noexcept nogil:
+    cdef Py_ssize_t N = wlpre.shape[0]
+    cdef double recess, rhs, drhs, wl
+    cdef double Sy2 = Sy * Sy
     cdef Py_ssize_t i
+
+    drhs = 0
     for i in range(N-1):
-        recess = max((B - A*wlpre[i]/1000) * 1000, 0)
-        wlpre[i+1] = wlpre[i] - (rechg[i]/Sy) + recess
-    return wlpre
+        recess = (B - A*wlpre[i]/1000) * 1000
+        if recess > 0:
+            rhs = wlpre[i] - (rechg[i]/Sy) + recess/2
+            if sens:
+                drhs = dwl[i] * (1 - A/2) + rechg[i]/Sy2
+        else:
+            rhs = wlpre[i] - (rechg[i]/Sy)
+            if sens:
+                drhs = dwl[i] + rechg[i]/Sy2
+        wl = (rhs + B*500) / (1 + A/2)
+        if (B - A*wl/1000) > 0:
+            wlpre[i+1] = wl
+            if sens:
+                dwl[i+1] = drhs / (1 + A/2)
+        else:
+            wlpre[i+1] = rhs
+            if sens:
+                dwl[i+1] = drhs
+
+
+cdef Py_ssize_t _hydrograph_length(int scheme, Py_ssize_t nrechg,
+                                   Py_ssize_t nwl) except -1:
+    """
+    Return the number of days of the synthetic hydrograph produced with the
+    scheme from nrechg days of recharge and nwl days of observed water
+    levels, or raise a ValueError if they are not consistent.
+    """
+    if scheme == 1:
+        # The hydrograph is computed backward in time from the last
+        # observed water level, which is reached at the end of the last
+        # day of recharge. It extends before the first observed water level
+        # when the recharge starts earlier than the water levels.
+        if nwl == 0:
+            raise ValueError("wlobs must contain at least one water level "
+                             "with the backward scheme.")
+        return nrechg + 1
+    if nwl > 0 and nrechg < nwl - 1:
+        raise ValueError("rechg must be at least as long as wlobs minus one.")
+    return nwl
+
+
+cdef object _calc_hydrograph(int scheme, const double[:] rechg,
+                             const double[:] wlobs, double Sy, double A,
+                             double B, bint sens):
+    """
+    Allocate the arrays of the synthetic hydrograph and compute it without
+    holding the GIL with the scheme 0 (forward), 1 (backward) or
+    2 (Crank-Nicolson).
+
+    The forward and Crank-Nicolson hydrographs cover the days of wlobs,
+    while the backward hydrograph covers the days of rechg plus one and
+    ends at the last observed water level.
+    """
+    cdef Py_ssize_t nwl = wlobs.shape[0]
+    cdef Py_ssize_t N = _hydrograph_length(scheme, rechg.shape[0], nwl)
+    wlpre = np.zeros(N, dtype=DTYPE)
+    dwl = np.zeros(N, dtype=DTYPE)
+    if N == 0:
+        return (wlpre, dwl) if sens else wlpre
+
+    cdef double[:] wlpre_v = wlpre, dwl_v = dwl
+    with nogil:
+        if scheme == 1:
+            wlpre_v[N-1] = wlobs[nwl-1]
+            _hydrograph_backward(rechg, Sy, A, B, wlpre_v, dwl_v, sens)
+        elif scheme == 2:
+            wlpre_v[0] = wlobs[0]
+            _hydrograph_cranknicolson(rechg, Sy, A, B, wlpre_v, dwl_v, sens)
+        else:
+            wlpre_v[0] = wlobs[0]
+            _hydrograph_forward(rechg, Sy, A, B, wlpre_v, dwl_v, sens)
+    return (wlpre, dwl) if sens else wlpre
+
+
+def calc_hydrograph_forward(const double[:] rechg, const double[:] wlobs,
+                            double Sy, double A, double B):
+    """
+    Compute the synthetic hydrograph forward in time with an explicit
+    scheme, starting from the first observed water level.
+    """
+    return _calc_hydrograph(0, rechg, wlobs, Sy, A, B, False)
+
+
+def calc_hydrograph_forward_sens(const double[:] rechg,
+                                 const double[:] wlobs,
+                                 double Sy, double A, double B):
+    """
+    Compute the synthetic hydrograph with the same forward explicit scheme
+    as calc_hydrograph_forward, along with its derivative with respect to
+    the specific yield (d(wl)/d(Sy)), which is obtained in the same pass by
+    differentiating each step of the scheme (sensitivity equation).
+    """
+    return _calc_hydrograph(0, rechg, wlobs, Sy, A, B, True)
+
+
+def calc_hydrograph_backward(const double[:] rechg, const double[:] wlobs,
+                             double Sy, double A, double B):
+    """
+    Compute the synthetic hydrograph backward in time, starting from the
+    last observed water level, by inverting each step of the forward
+    explicit scheme of calc_hydrograph_forward.
+
+    The hydrograph has one more day than rechg, whose last day must be the
+    one before the last observed water level. It goes back before the first
+    observed water level when rechg starts earlier than wlobs.
+    """
+    return _calc_hydrograph(1, rechg, wlobs, Sy, A, B, False)
+
+
+def calc_hydrograph_backward_sens(const double[:] rechg,
+                                  const double[:] wlobs,
+                                  double Sy, double A, double B):
+    """
+    Compute the synthetic hydrograph with the same backward scheme as
+    calc_hydrograph_backward, along with its derivative with respect to
+    the specific yield.
+    """
+    return _calc_hydrograph(1, rechg, wlobs, Sy, A, B, True)
+
+
+def calc_hydrograph_cranknicolson(const double[:] rechg,
+                                  const double[:] wlobs,
+                                  double Sy, double A, double B):
+    """
+    Compute the synthetic hydrograph forward in time with a Crank-Nicolson
+    scheme, where the recession of each step is the average of the
+    recessions at the beginning and at the end of the day. Since the
+    recession is linear in the water level, each step is solved exactly.
+    """
+    return _calc_hydrograph(2, rechg, wlobs, Sy, A, B, False)
+
+
+def calc_hydrograph_cranknicolson_sens(const double[:] rechg,
+                                       const double[:] wlobs,
+                                       double Sy, double A, double B):
+    """
+    Compute the synthetic hydrograph with the same Crank-Nicolson scheme as
+    calc_hydrograph_cranknicolson, along with its derivative with respect
+    to the specific yield.
+    """
+    return _calc_hydrograph(2, rechg, wlobs, Sy, A, B, True)
+
+
+def calc_hydrograph_sens_batch(const double[:, :] rechg,
+                               const double[:] wlobs, const double[:] Sy,
+                               double A, double B, str nscheme='forward'):
+    """
+    Compute the synthetic hydrographs and their derivatives with respect to
+    the specific yield for a set of recharge time series, one per row of
+    rechg, and the corresponding values of Sy, with the numerical scheme
+    nscheme ('forward', 'backward' or 'cranknicolson').
+
+    Return two 2D arrays with one hydrograph per row, whose i-th row is the
+    same as the ones returned by the _sens kernel of the scheme for rechg[i]
+    and Sy[i].
+    """
+    cdef int scheme
+    if nscheme == 'forward':
+        scheme = 0
+    elif nscheme == 'backward':
+        scheme = 1
+    elif nscheme == 'cranknicolson':
+        scheme = 2
+    else:
+        raise ValueError("Unknown numerical scheme: %s" % nscheme)
+
+    cdef Py_ssize_t M = rechg.shape[0]
+    cdef Py_ssize_t nwl = wlobs.shape[0]
+    if Sy.shape[0] != M:
+        raise ValueError("rechg and Sy must have the same number of rows.")
+    cdef Py_ssize_t N = _hydrograph_length(scheme, rechg.shape[1], nwl)
+    wlpre = np.zeros((M, N), dtype=DTYPE)
+    dwl = np.zeros((M, N), dtype=DTYPE)
+    if N == 0 or M == 0:
+        return wlpre, dwl
+
+    cdef double[:, :] wlpre_v = wlpre, dwl_v = dwl
+    cdef Py_ssize_t j
+    with nogil:
+        for j in range(M):
+            if scheme == 1:
+                wlpre_v[j, N-1] = wlobs[nwl-1]
+                _hydrograph_backward(
+                    rechg[j], Sy[j], A, B, wlpre_v[j], dwl_v[j], True)
+            elif scheme == 2:
+                wlpre_v[j, 0] = wlobs[0]
+                _hydrograph_cranknicolson(
+                    rechg[j], Sy[j], A, B, wlpre_v[j], dwl_v[j], True)
+            else:
+                wlpre_v[j, 0] = wlobs[0]
+                _hydrograph_forward(
+                    rechg[j], Sy[j], A, B, wlpre_v[j], dwl_v[j], True)
+    return wlpre, dwl
@@ -16,7 +16,7 @@ from PyQt5.QtCore import pyqtSlot as QSlot
 from PyQt5.QtCore import pyqtSignal as QSignal
 from PyQt5.QtWidgets import (QWidget, QGridLayout, QPushButton, QProgressBar,
                              QLabel, QSizePolicy, QScrollArea, QApplication,
-                             QMessageBox)
+                             QMessageBox, QCheckBox)
 
 # ---- Imports: local
 
@@ -52,7 +52,8 @@ class RechgEvalWidget(QFrameLayout):
 
         self.rechg_worker = RechgEvalWorker()
         self.rechg_worker.sig_glue_finished.connect(self.receive_glue_calcul)
-        self.rechg_worker.sig_glue_progress.connect(self.progressbar.setValue)
+        self.rechg_worker.sig_glue_progress.connect(
+            lambda value: self.progressbar.setValue(int(value)))
 
         self.rechg_thread = QThread()
         self.rechg_worker.moveToThread(self.rechg_thread)
@@ -116,6 +117,22 @@ class RechgEvalWidget(QFrameLayout):
         self._deltaT = QDoubleSpinBox(0, 0, )
         self._deltaT.setRange(0, 999)
 
+        # Cache of the models :
+
+        self._cache_models = QCheckBox('Cache models in project folder')
+        self._cache_models.setChecked(False)
+        self._cache_models.setToolTip(
+            "<p>Save the models evaluated with the GLUE in a 'GLUE Cache' "
+            "folder next to the project file, so that only the new parameter "
+            "combinations are evaluated when the ranges are changed.</p>")
+
+        # units=' MB'
+
+        self._cache_maxsize = QDoubleSpinBox(1000, 0, 100)
+        self._cache_maxsize.setRange(10, 100000)
+        self._cache_maxsize.setEnabled(False)
+        self._cache_models.toggled.connect(self._cache_maxsize.setEnabled)
+
         class QLabelCentered(QLabel):
             def __init__(self, text):
                 super(QLabelCentered, self).__init__(text)
@@ -159,6 +176,14 @@ class RechgEvalWidget(QFrameLayout):
         params_group.addWidget(self._deltaT, row, 1)
         params_group.addWidget(QLabel('days'), row, 2, 1, 3)
         row += 1
+        params_group.setRowMinimumHeight(row, 10)
+        row += 1
+        params_group.addWidget(self._cache_models, row, 0, 1, 5)
+        row += 1
+        params_group.addWidget(QLabel('Max size :'), row, 0)
+        params_group.addWidget(self._cache_maxsize, row, 1)
+        params_group.addWidget(QLabel('MB'), row, 2, 1, 3)
+        row += 1
         params_group.setRowStretch(row, 100)
         params_group.setColumnStretch(5, 100)
 
@@ -192,8 +217,14 @@ class RechgEvalWidget(QFrameLayout):
         """Setup the toolbar of the widget. """
         toolbar = QWidget()
 
-        btn_calib = QPushButton('Compute Recharge')
-        btn_calib.clicked.connect(self.btn_calibrate_isClicked)
+        self.btn_calib = QPushButton('Compute Recharge')
+        self.btn_calib.clicked.connect(self.btn_calibrate_isClicked)
+
+        self.btn_cancel = QPushButton('Cancel')
+        self.btn_cancel.setToolTip(
+            "Cancel the evaluation of recharge that is in progress.")
+        self.btn_cancel.clicked.connect(self.cancel_glue_calcul)
+        self.btn_cancel.setEnabled(False)
 
         self.btn_show_result = QToolButtonSmall(icons.get_icon('search'))
         self.btn_show_result.clicked.connect(self.figstack.show)
@@ -202,9 +233,10 @@ class RechgEvalWidget(QFrameLayout):
         self.btn_save_glue = ExportGLUEButton(self.wxdset)
 
         layout = QGridLayout(toolbar)
-        layout.addWidget(btn_calib, 0, 0)
-        layout.addWidget(self.btn_show_result, 0, 1)
-        layout.addWidget(self.btn_save_glue, 0, 2)
+        layout.addWidget(self.btn_calib, 0, 0)
+        layout.addWidget(self.btn_cancel, 0, 1)
+        layout.addWidget(self.btn_show_result, 0, 2)
+        layout.addWidget(self.btn_save_glue, 0, 3)
         layout.setContentsMargins(10, 0, 10, 0)  # (L, T, R, B)
 
         return toolbar
@@ -264,6 +296,15 @@ class RechgEvalWidget(QFrameLayout):
     def deltaT(self):
         return self._deltaT.value()
 
+    @property
+    def cache_models(self):
+        return self._cache_models.isChecked()
+
+    @property
+    def cache_maxsize(self):
+        """Return the maximum size of the GLUE cache folder in bytes."""
+        return self._cache_maxsize.value() * 1e6
+
     def btn_calibrate_isClicked(self):
         """
         Handles when the button to compute recharge and its uncertainty is
@@ -286,6 +327,16 @@ class RechgEvalWidget(QFrameLayout):
         self.rechg_worker.CM = self.CM
         self.rechg_worker.deltat = self.deltaT
 
+        # Cache the models in the project folder if asked, so that only the
+        # new parameter combinations are evaluated when the ranges are
+        # changed.
+        if self.cache_models:
+            self.rechg_worker.glue_cache_dirname = osp.join(
+                osp.dirname(self.wldset.dset.file.filename), 'GLUE Cache')
+            self.rechg_worker.glue_cache_maxsize = self.cache_maxsize
+        else:
+            self.rechg_worker.glue_cache_dirname = None
+
         # Set the data and check for errors.
 
         error = self.rechg_worker.load_data(self.wxdset, self.wldset)
@@ -303,8 +354,19 @@ class RechgEvalWidget(QFrameLayout):
             if waittime > 15:
                 print('Impossible to quit the thread.')
                 return
+        self.btn_calib.setEnabled(False)
+        self.btn_cancel.setEnabled(True)
         self.rechg_thread.start()
 
+    def cancel_glue_calcul(self):
+        """
+        Request the cancellation of the evaluation of recharge that is
+        running in the worker thread, which then stops evaluating the models
+        and emits sig_glue_finished.
+        """
+        self.btn_cancel.setEnabled(False)
+        self.rechg_worker.cancel_glue_calcul()
+
     def receive_glue_calcul(self, glue_dataframe):
         """
         Handle the plotting of the results once ground-water recharge has
@@ -312,7 +374,11 @@ class RechgEvalWidget(QFrameLayout):
         """
         self.rechg_thread.quit()
         self.progressbar.hide()
-        if glue_dataframe is None:
+        self.btn_calib.setEnabled(True)
+        self.btn_cancel.setEnabled(False)
+        if self.rechg_worker.glue_canceled:
+            return
+        elif glue_dataframe is None:
             msg = ("Recharge evaluation was not possible because all"
                    " the models produced were deemed non-behavioural."
                    "\n\n"
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+"""
+Split the GLUE calculation of a well in shards that can be evaluated on
+several machines that share a filesystem, for example with:
+
+    python -m gwhat.gwrecharge.jobs create project.gwt well jobdir
+    python -m gwhat.gwrecharge.jobs run jobdir --shard 0 --nshards 4
+    ...
+    python -m gwhat.gwrecharge.jobs run jobdir --shard 3 --nshards 4
+    python -m gwhat.gwrecharge.jobs merge jobdir
+
+A job is a folder that contains the job spec, which holds the data of the
+water level and weather datasets, the settings of the RechgEvalWorker and
+the parameter combinations to evaluate, along with the outputs of
+the shards.
+
+The parameter combinations are evaluated by chunks of GLUE_CHUNKSIZE
+combinations, that each start the optimization of Sy from the middle of
+its range, and a shard evaluates a contiguous range of chunks. Since
+RechgEvalWorker.eval_recharge evaluates the same chunks the same way, the
+merged results do not depend on the number of shards and are identical
+to the ones of eval_recharge on a single machine.
+"""
+
+# ---- Standard library imports
+
+import argparse
+import glob
+import json
+import os
+import os.path as osp
+import re
+import sys
+import time
+
+# ---- Third party imports
+
+import h5py
+import numpy as np
+
+# ---- Local imports
+
+from gwhat.projet.reader_projet import ProjetReader
+from gwhat.gwrecharge.gwrecharge_calc2 import (
+    RechgEvalWorker, GLUE_CHUNKSIZE, _eval_worker_params_chunk)
+from gwhat.gwrecharge.realizations import RealizationStore
+from gwhat.gwrecharge.batch import (
+    WLDSET_KEYS, WXDSET_KEYS, get_glue_params, pair_wldsets_with_wxdsets)
+
+JOB_FILENAME = 'job.h5'
+SHARD_FILENAME = 'shard_{:04d}_of_{:04d}.h5'
+SERIES = ['hydrograph', 'recharge', 'etr', 'ru']
+
+
+def _make_worker(wxdset, wldset, settings):
+    """
+    Return a RechgEvalWorker with the provided settings and data, or raise
+    a ValueError if the data cannot be loaded.
+    """
+    worker = RechgEvalWorker()
+    for key, value in settings.items():
+        setattr(worker, key, value)
+    error = worker.load_data(wxdset, wldset)
+    if error is not None:
+        raise ValueError(error)
+    return worker
+
+
+def _write_atomically(filename, write_func):
+    """
+    Write a HDF5 file with write_func in a temporary file that is then
+    renamed to filename, so that the other machines never see a partially
+    written file.
+    """
+    tmpfile = '%s.%d.tmp' % (filename, os.getpid())
+    with h5py.File(tmpfile, mode='w') as h5file:
+        write_func(h5file)
+    os.replace(tmpfile, filename)
+
+
+def _read_dset(h5grp, keys):
+    """Read a water level or weather dataset saved in a job spec."""
+    dset = {}
+    for key in keys:
+        value = h5grp[key][()]
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        dset[key] = value
+    return dset
+
+
+def create_job(jobdir, wxdset, wldset, origin=None, **settings):
+    """
+    Create a job spec in jobdir to evaluate recharge with GLUE for a water
+    level and a weather dataset, that can be either dicts or datasets read
+    from a project, with the RechgEvalWorker settings provided as keyword
+    arguments.
+
+    origin is an optional (project filename, wldset name) tuple of the
+    project where the results are saved by the merge command.
+
+    Return the number of parameter combinations to evaluate.
+    """
+    worker = _make_worker(wxdset, wldset, settings)
+    if worker.glue_streaming:
+        raise ValueError("The GLUE calculations in streaming mode cannot "
+                         "be split in shards.")
+    if (worker.glue_sampler == 'adaptive' or
+            worker.glue_target_count is not None):
+        raise ValueError("The parameter combinations must not depend on the "
+                         "behavioural models to be split in shards.")
+    params = worker.produce_params_sampler().next_batch(None)
+
+    def write_job(h5file):
+        h5file.attrs['settings'] = json.dumps(
+            settings, default=lambda x: np.asarray(x).tolist())
+        h5file.attrs['chunksize'] = GLUE_CHUNKSIZE
+        if origin is not None:
+            h5file.attrs['projet'] = origin[0]
+            h5file.attrs['wldset'] = origin[1]
+        for name, dset, keys in [('wxdset', wxdset, WXDSET_KEYS),
+                                 ('wldset', wldset, WLDSET_KEYS)]:
+            grp = h5file.create_group(name)
+            for key in keys:
+                grp.create_dataset(key, data=dset[key])
+        h5file.create_dataset('params', data=params)
+
+    if not osp.exists(jobdir):
+        os.makedirs(jobdir)
+    _write_atomically(osp.join(jobdir, JOB_FILENAME), write_job)
+    return len(params)
+
+
+def load_job(jobdir):
+    """
+    Return a RechgEvalWorker set up with the data and settings of the job
+    spec saved in jobdir, the parameter combinations to evaluate, and the
+    chunks of indexes of these combinations.
+    """
+    with h5py.File(osp.join(jobdir, JOB_FILENAME), mode='r') as h5file:
+        settings = json.loads(h5file.attrs['settings'])
+        chunksize = int(h5file.attrs['chunksize'])
+        wxdset = _read_dset(h5file['wxdset'], WXDSET_KEYS)
+        wldset = _read_dset(h5file['wldset'], WLDSET_KEYS)
+        params = h5file['params'][()]
+    worker = _make_worker(wxdset, wldset, settings)
+    N = len(params)
+    chunks = np.array_split(np.arange(N), int(np.ceil(N / chunksize)))
+    return worker, params, chunks
+
+
+def run_shard(jobdir, index, count):
+    """
+    Evaluate the shard index of the job saved in jobdir when it is split
+    in count shards, and save the parameters, RMSE and time series of the
+    behavioural models that were found in the shard output file.
+
+    Return the name of the shard output file.
+    """
+    if not 0 <= index < count:
+        raise ValueError("The shard index must be between 0 and %d."
+                         % (count - 1))
+    worker, params, chunks = load_job(jobdir)
+
+    store = worker._start_glue_calcul()
+    results = []
+    for i in np.array_split(np.arange(len(chunks)), count)[index]:
+        indexes = chunks[i]
+        cached, missing = worker._get_cached_results(params[indexes])
+        chunk_results, report = _eval_worker_params_chunk(
+            worker, params[indexes[missing], 0], params[indexes[missing], 1])
+        worker._update_glue_report(report)
+        results.extend(worker._store_realizations(
+            cached, missing, chunk_results, store))
+    if worker._glue_cache is not None:
+        worker._glue_cache.close()
+        worker._glue_cache = None
+
+    def write_shard(h5file):
+        for key in ['Cru', 'RASmax', 'Sy', 'RMSE']:
+            h5file.create_dataset(
+                key, data=np.array([r[key] for r in results], dtype=float))
+        for var in SERIES:
+            h5file.create_dataset('series/' + var, data=store[var])
+        for key, value in worker.glue_report.items():
+            h5file.attrs[key] = value
+
+    filename = osp.join(jobdir, SHARD_FILENAME.format(index, count))
+    _write_atomically(filename, write_shard)
+    store.close()
+    return filename
+
+
+def merge_shards(jobdir):
+    """
+    Merge the outputs of all the shards of the job saved in jobdir and
+    return the resulting GLUEDataFrame, which is None if no behavioural
+    model was found.
+    """
+    time_start = time.time()
+    worker, params, chunks = load_job(jobdir)
+
+    counts = set()
+    for filename in glob.glob(osp.join(jobdir, 'shard_*_of_*.h5')):
+        counts.add(int(re.search(r'_of_(\d+)\.h5$', filename).group(1)))
+    if len(counts) != 1:
+        raise ValueError("The job outputs must be from a single split "
+                         "of the job in shards.")
+    count = counts.pop()
+    filenames = [osp.join(jobdir, SHARD_FILENAME.format(i, count))
+                 for i in range(count)]
+    missing = [i for i, f in enumerate(filenames) if not osp.exists(f)]
+    if missing:
+        raise ValueError("The outputs of these shards are missing: %s"
+                         % ', '.join(str(i) for i in missing))
+
+    worker.glue_report = {key: 0 for key in worker.glue_report}
+    store = RealizationStore(SERIES, backend=worker.glue_store_backend,
+                             dirname=worker.glue_store_dirname)
+    results = []
+    for filename in filenames:
+        with h5py.File(filename, mode='r') as h5file:
+            for key in worker.glue_report:
+                worker.glue_report[key] += int(h5file.attrs[key])
+            series = {var: h5file['series/' + var][()] for var in SERIES}
+            for i in range(len(h5file['RMSE'])):
+                store.append(**{var: series[var][i] for var in SERIES})
+                results.append({key: h5file[key][i] for key in
+                                ['Cru', 'RASmax', 'Sy', 'RMSE']})
+    return worker._finish_glue_calcul(store, results, time_start)
+
+
+def main(args=None):
+    """Create, run and merge the shards of GLUE jobs from the console."""
+    parser = argparse.ArgumentParser(
+        description=("Split the GLUE calculation of a well in shards that "
+                     "can be evaluated on several machines."))
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    create_parser = subparsers.add_parser(
+        'create', help="Create a job for a well of a GWHAT project.")
+    create_parser.add_argument('filename',
+                               help="The path of the .gwt project file.")
+    create_parser.add_argument('wldset',
+                               help="The name of the water level dataset.")
+    create_parser.add_argument('jobdir', help="The folder of the job.")
+    create_parser.add_argument('--wxdset', default=None,
+                               help="The name of the weather dataset (the "
+                                    "closest one by default).")
+    create_parser.add_argument('--sy', type=float, nargs=2, dest='Sy')
+    create_parser.add_argument('--rasmax', type=float, nargs=2,
+                               dest='RASmax')
+    create_parser.add_argument('--cro', type=float, nargs=2, dest='Cro')
+    create_parser.add_argument('--tmelt', type=float, dest='TMELT')
+    create_parser.add_argument('--cm', type=float, dest='CM')
+    create_parser.add_argument('--deltat', type=float, dest='deltat')
+    create_parser.add_argument('--resolution', choices=['rough', 'fine'],
+                               dest='glue_pardist_res')
+    create_parser.add_argument('--sampler', choices=['grid', 'lhs', 'sobol'],
+                               dest='glue_sampler')
+    create_parser.add_argument('--nsamples', type=int, dest='glue_nsamples')
+    create_parser.add_argument('--seed', type=int, dest='glue_sampler_seed')
+
+    run_parser = subparsers.add_parser('run', help="Evaluate a shard.")
+    run_parser.add_argument('jobdir', help="The folder of the job.")
+    run_parser.add_argument('--shard', type=int, required=True,
+                            help="The index of the shard to evaluate.")
+    run_parser.add_argument('--nshards', type=int, required=True,
+                            help="The number of shards of the job.")
+
+    merge_parser = subparsers.add_parser(
+        'merge', help=("Merge the outputs of the shards and save the "
+                       "results in the project of the job."))
+    merge_parser.add_argument('jobdir', help="The folder of the job.")
+    args = vars(parser.parse_args(args))
+
+    command = args.pop('command')
+    if command == 'create':
+        filename, wlname = args.pop('filename'), args.pop('wldset')
+        jobdir, wxname = args.pop('jobdir'), args.pop('wxdset')
+        projet = ProjetReader(filename)
+        wxname = pair_wldsets_with_wxdsets(projet, [wlname], wxname)[0][1]
+        wldset = projet.get_wldset(wlname)
+        wxdset = projet.get_wxdset(wxname)
+        settings = get_glue_params(wldset, **args)
+        count = create_job(
+            jobdir, {key: wxdset[key] for key in WXDSET_KEYS},
+            {key: wldset[key] for key in WLDSET_KEYS},
+            origin=(osp.abspath(filename), wlname), **settings)
+        projet.close_projet()
+        print("Job created with %d parameter combinations." % count)
+    elif command == 'run':
+        print("Shard output saved in %s" % run_shard(
+            args['jobdir'], args['shard'], args['nshards']))
+    elif command == 'merge':
+        gluedf = merge_shards(args['jobdir'])
+        if gluedf is None:
+            print("All the models produced were deemed non-behavioural.")
+            return 1
+        with h5py.File(osp.join(args['jobdir'], JOB_FILENAME), 'r') as f:
+            origin = (f.attrs.get('projet'), f.attrs.get('wldset'))
+        if origin[0] is not None:
+            projet = ProjetReader(origin[0])
+            wldset = projet.get_wldset(origin[1])
+            wldset.clear_glue()
+            wldset.save_glue(gluedf)
+            projet.close_projet()
+            print("GLUE results saved for %s in %s" % (origin[1], origin[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
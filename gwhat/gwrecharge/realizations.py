@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+# ---- Standard library imports
+
+import os
+import os.path as osp
+import shutil
+import tempfile
+from collections.abc import Mapping
+
+# ---- Third party imports
+
+import numpy as np
+
+
+class RealizationStore(Mapping):
+    """
+    A store for the daily time series produced by a set of behavioural
+    models, where each variable is saved in a 2D array of shape
+    (number of realizations, number of days).
+
+    The arrays are preallocated and grown by chunks of realizations, so that
+    it is not necessary to keep a list of arrays in memory. When backend is
+    'memmap', the arrays are saved in memory-mapped files in a temporary
+    folder that is created in dirname (or in the system temp folder if
+    dirname is None) and that is deleted when the store is closed.
+    """
+
+    def __init__(self, varnames, dtype=np.float32, chunksize=256,
+                 backend='memory', dirname=None):
+        super(RealizationStore, self).__init__()
+        if backend not in ['memory', 'memmap']:
+            raise ValueError("backend must be either 'memory' or 'memmap'.")
+        self.varnames = list(varnames)
+        self.dtype = np.dtype(dtype)
+        self.chunksize = int(chunksize)
+        self.backend = backend
+
+        self._count = 0
+        self._capacity = 0
+        self._arrays = {}
+        self._dirname = None
+        if backend == 'memmap':
+            if dirname is not None and not osp.exists(dirname):
+                os.makedirs(dirname)
+            self._dirname = tempfile.mkdtemp(prefix='glue_', dir=dirname)
+
+    def __getitem__(self, varname):
+        """
+        Return a 2D array view of the realizations of varname, with one
+        realization per row.
+        """
+        if varname not in self.varnames:
+            raise KeyError(varname)
+        if varname not in self._arrays:
+            return np.empty((0, 0), dtype=self.dtype)
+        return self._arrays[varname][:self._count]
+
+    def __iter__(self):
+        return iter(self.varnames)
+
+    def __len__(self):
+        return len(self.varnames)
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def count(self):
+        """Return the number of realizations saved in the store."""
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Return the number of bytes allocated by the store."""
+        return sum(arr.nbytes for arr in self._arrays.values())
+
+    def append(self, **realization):
+        """
+        Append the time series of one realization to the store. A keyword
+        argument must be provided for each variable of the store.
+        """
+        if set(realization.keys()) != set(self.varnames):
+            raise ValueError("A value must be provided for each of these "
+                             "variables: %s" % ', '.join(self.varnames))
+        if self._count == self._capacity:
+            self._grow({var: np.size(realization[var])
+                        for var in self.varnames})
+        for var in self.varnames:
+            self._arrays[var][self._count] = realization[var]
+        self._count += 1
+
+    def extend(self, realizations):
+        """Append a sequence of realizations to the store."""
+        for realization in realizations:
+            self.append(**realization)
+
+    def close(self):
+        """
+        Release the arrays of the store and delete the memory-mapped files
+        if any.
+        """
+        self._arrays = {}
+        self._count = self._capacity = 0
+        if self._dirname is not None:
+            shutil.rmtree(self._dirname, ignore_errors=True)
+            self._dirname = None
+
+    def _grow(self, ntimes):
+        """Increase the capacity of the store by one chunk of realizations."""
+        capacity = self._capacity + self.chunksize
+        for var in self.varnames:
+            shape = (capacity, ntimes[var])
+            if self.backend == 'memmap':
+                filename = osp.join(self._dirname, var + '.dat')
+                # The memory map must be released before the file can be
+                # resized. The existing realizations are kept in the file,
+                # since they are written in row-major order.
+                old_array = self._arrays.pop(var, None)
+                if old_array is not None:
+                    old_array.flush()
+                    del old_array
+                with open(filename, 'ab') as f:
+                    f.truncate(int(np.prod(shape)) * self.dtype.itemsize)
+                self._arrays[var] = np.memmap(
+                    filename, dtype=self.dtype, mode='r+', shape=shape)
+            else:
+                array = np.empty(shape, dtype=self.dtype)
+                if var in self._arrays:
+                    array[:self._count] = self._arrays[var][:self._count]
+                self._arrays[var] = array
+        self._capacity = capacity
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+"""
+Samplers used to produce the (Cru, RASmax) parameter combinations that are
+evaluated with GLUE.
+
+A sampler produces the parameter combinations by batches. The first batch
+is obtained with next_batch(None) and the next ones are obtained by passing
+the parameters of the behavioural models found so far, so that a sampler can
+stop once a target number of behavioural models is reached or refine
+its sampling around the behavioural region. A sampler returns None when
+it is done.
+"""
+
+# ---- Standard library imports
+
+import warnings
+
+# ---- Third party imports
+
+import numpy as np
+
+
+SAMPLERS = ['grid', 'lhs', 'sobol', 'adaptive']
+
+
+def latin_hypercube(n, bounds, rs):
+    """
+    Draw n samples with a Latin hypercube in the hyperrectangle defined by
+    bounds, a list of (min, max) tuples, using the RandomState rs.
+    """
+    ndim = len(bounds)
+    samples = np.empty((n, ndim))
+    for j in range(ndim):
+        samples[:, j] = (rs.permutation(n) + rs.rand(n)) / n
+    return scale_samples(samples, bounds)
+
+
+def scale_samples(samples, bounds):
+    """Scale samples from the unit hypercube to bounds."""
+    lower = np.array([b[0] for b in bounds], dtype=float)
+    upper = np.array([b[1] for b in bounds], dtype=float)
+    return lower + samples * (upper - lower)
+
+
+class GridSampler(object):
+    """
+    Produce a full factorial grid of parameter combinations in a single batch.
+    """
+
+    def __init__(self, U_Cro, U_RAS):
+        self.U_Cro = np.asarray(U_Cro, dtype=float)
+        self.U_RAS = np.asarray(U_RAS, dtype=float)
+        self.nsampled = 0
+
+    @property
+    def max_samples(self):
+        return len(self.U_Cro) * len(self.U_RAS)
+
+    def next_batch(self, behavioural):
+        if self.nsampled > 0:
+            return None
+        params = np.column_stack([np.repeat(self.U_Cro, len(self.U_RAS)),
+                                  np.tile(self.U_RAS, len(self.U_Cro))])
+        self.nsampled = len(params)
+        return params
+
+
+class RandomSampler(object):
+    """
+    Draw batches of nsamples parameter combinations in bounds, a list of
+    the (min, max) values of Cru and RASmax, with a Latin hypercube ('lhs')
+    or a scrambled Sobol sequence ('sobol').
+
+    When target_count is None, a single batch is produced. Otherwise,
+    batches are drawn until at least target_count behavioural models are
+    found or max_samples parameter combinations are produced.
+    """
+
+    def __init__(self, bounds, nsamples, method='lhs', target_count=None,
+                 max_samples=None, seed=None):
+        if method not in ['lhs', 'sobol']:
+            raise ValueError("method must be either 'lhs' or 'sobol'.")
+        self.bounds = bounds
+        self.nsamples = int(nsamples)
+        self.method = method
+        self.target_count = target_count
+        if max_samples is None:
+            max_samples = (self.nsamples if target_count is None else
+                           10 * self.nsamples)
+        self.max_samples = int(max_samples)
+        self.nsampled = 0
+
+        self._rs = np.random.RandomState(seed)
+        if method == 'sobol':
+            from scipy.stats import qmc
+            self._sobol = qmc.Sobol(len(bounds), seed=seed)
+
+    def is_done(self, behavioural):
+        """Return whether the sampler is done."""
+        if self.nsampled >= self.max_samples:
+            return True
+        if self.nsampled == 0:
+            return False
+        if self.target_count is None:
+            return True
+        return len(behavioural) >= self.target_count
+
+    def next_batch(self, behavioural):
+        behavioural = [] if behavioural is None else behavioural
+        if self.is_done(behavioural):
+            return None
+        n = min(self.nsamples, self.max_samples - self.nsampled)
+        params = self.draw(n, self.bounds)
+        self.nsampled += n
+        return params
+
+    def draw(self, n, bounds):
+        """Draw n parameter combinations in bounds."""
+        if self.method == 'sobol':
+            with warnings.catch_warnings():
+                # Scipy warns when n is not a power of 2.
+                warnings.simplefilter('ignore')
+                return scale_samples(self._sobol.random(n), bounds)
+        else:
+            return latin_hypercube(n, bounds, self._rs)
+
+
+class AdaptiveSampler(RandomSampler):
+    """
+    Draw a first batch of nsamples parameter combinations in bounds and
+    then refine the sampling in the region that is bounding the behavioural
+    models found so far, expanded by a margin that is expressed as a fraction
+    of the range of each parameter.
+
+    Batches are drawn until at least target_count behavioural models are
+    found or max_samples parameter combinations are produced. The sampling
+    stops after the first batch if no behavioural model was found.
+    """
+
+    def __init__(self, bounds, nsamples, method='lhs', target_count=None,
+                 max_samples=None, seed=None, margin=0.1):
+        if target_count is None:
+            target_count = nsamples
+        super(AdaptiveSampler, self).__init__(
+            bounds, nsamples, method, target_count, max_samples, seed)
+        self.margin = margin
+
+    def next_batch(self, behavioural):
+        behavioural = [] if behavioural is None else behavioural
+        if self.is_done(behavioural):
+            return None
+        if self.nsampled > 0 and len(behavioural) == 0:
+            return None
+        n = min(self.nsamples, self.max_samples - self.nsampled)
+        if self.nsampled == 0:
+            params = self.draw(n, self.bounds)
+        else:
+            params = self.draw(n, self.behavioural_bounds(behavioural))
+        self.nsampled += n
+        return params
+
+    def behavioural_bounds(self, behavioural):
+        """
+        Return the bounds of the region where the behavioural models
+        are found.
+        """
+        behavioural = np.atleast_2d(behavioural)
+        bounds = []
+        for j, (vmin, vmax) in enumerate(self.bounds):
+            margin = self.margin * (vmax - vmin)
+            bounds.append((max(np.min(behavioural[:, j]) - margin, vmin),
+                           min(np.max(behavioural[:, j]) + margin, vmax)))
+        return bounds
@@ -829,9 +829,10 @@ class Hydrograph(Figure):
         else:
             self.glue_plt.set_visible(True)
 
-        xlstime = self.gluedf['water levels']['time']
-        wl05 = self.gluedf['water levels']['predicted'][:, 0]/1000
-        wl95 = self.gluedf['water levels']['predicted'][:, 2]/1000
+        glue_wl = self.gluedf.get('water levels', self.TIMEmin, self.TIMEmax)
+        xlstime = glue_wl['time']
+        wl05 = glue_wl['predicted'][:, 0]/1000
+        wl95 = glue_wl['predicted'][:, 2]/1000
 
         self.glue_plt.remove()
         self.glue_plt = self.ax2.fill_between(
@@ -845,21 +846,23 @@ class Hydrograph(Figure):
         else:
             self._mrc_plt.set_visible(True)
             self._mrc_plt.set_data(
-                self.wldset['mrc/time'], self.wldset['mrc/recess'])
+                self.wldset.get('mrc/time', self.TIMEmin, self.TIMEmax),
+                self.wldset.get('mrc/recess', self.TIMEmin, self.TIMEmax))
 
     def draw_waterlvl(self):
         """
         This method is called the first time the graph is plotted and each
-        time water level datum is changed.
+        time water level datum or the time scale is changed.
         """
 
         # ---- Logger Measures
 
-        time = self.wldset['Time']
+        # Only the data that fit within the limits of the time scale are
+        # read from the project and plotted.
+        time = self.wldset.get('Time', self.TIMEmin, self.TIMEmax)
+        water_lvl = self.wldset.get('WL', self.TIMEmin, self.TIMEmax)
         if self.WLdatum == 1:  # masl
-            water_lvl = self.wldset['Elevation']-self.wldset['WL']
-        else:  # mbgs -> yaxis is inverted
-            water_lvl = self.wldset['WL']
+            water_lvl = self.wldset['Elevation'] - water_lvl
 
         if self.trend_line == 1:
             tfilt, wlfilt = filt_data(time, water_lvl, self.trend_MAW)
@@ -879,6 +882,17 @@ class Hydrograph(Figure):
                 wl_meas = self.wldset['Elevation'] - wl_meas
             self.h_WLmes.set_data(time_wl_meas, wl_meas)
 
+    def draw_time_series(self):
+        """
+        Draw again the water levels and weather data that fit within the
+        limits of the time scale. This method is called each time the
+        time scale is changed.
+        """
+        self.draw_waterlvl()
+        self.draw_glue_wl()
+        self.draw_mrc_wl()
+        self.draw_weather()
+
     def draw_weather(self):
         """
         This method is called the first time the graph is plotted and each
@@ -11,12 +11,13 @@ from __future__ import division, unicode_literals
 # ---- Standard library imports
 
 import csv
+import hashlib
 import os
 import os.path as osp
+from collections import OrderedDict
 from time import strftime
 from copy import copy
 from time import clock
-from itertools import product
 
 # ---- Third party imports
 
@@ -112,6 +113,12 @@ class GapFillWeather(QObject):
         self.fig_format = PostProcessErr.SUPPORTED_FIG_FORMATS[0]
         self.fig_language = PostProcessErr.SUPPORTED_LANGUAGES[0]
 
+        # Memory of the regression models that were built for a given
+        # target station, weather variable and combination of neighboring
+        # stations, which is shared by all the targets and variables and is
+        # cleared when the weather data are loaded.
+        self.model_cache = RegressionModelCache()
+
     # =========================================================================
 
     # Maximum number of neighboring stations that will be used to fill
@@ -179,6 +186,7 @@ class GapFillWeather(QObject):
         self.WEATHER.load_from_binary(self.inputDir)
         self.WEATHER.generate_summary(self.outputDir)
         self.TARGET.index = -1
+        self.model_cache.clear()
 
         return self.WEATHER.STANAME
 
@@ -202,6 +210,7 @@ class GapFillWeather(QObject):
         print('Data loaded sucessfully.')
         self.WEATHER.generate_summary(self.outputDir)
         self.TARGET.index = -1
+        self.model_cache.clear()
 
         return self.WEATHER.STANAME
 
@@ -214,11 +223,12 @@ class GapFillWeather(QObject):
         self.TARGET.index = index
         self.TARGET.name = self.WEATHER.STANAME[index]
 
-        # calculate correlation coefficient between data series of the
+        # Get the correlation coefficients between data series of the
         # target station and each neighboring station for every
-        # weather variable
-        self.TARGET.CORCOEF = compute_correlation_coeff(
-                self.WEATHER.DATA, index)
+        # weather variable from the station x station matrix, which is
+        # computed only once for all the stations.
+        corrcoef = self.WEATHER.get_correlation_matrix(self.inputDir)
+        self.TARGET.CORCOEF = np.copy(corrcoef[:, index, :])
 
         # Calculate horizontal distance and altitude difference between
         # the target station and each neighboring station.
@@ -391,6 +401,8 @@ class GapFillWeather(QObject):
 
         AVG_RMSE = np.zeros(nVAR).astype('float')
         AVG_NSTA = np.zeros(nVAR).astype('float')
+        cache_hits = self.model_cache.hits
+        cache_misses = self.model_cache.misses
 
         # -------------------------------------------------------- FILL LOOP --
 
@@ -402,13 +414,6 @@ class GapFillWeather(QObject):
             print('Data completion for variable %d/%d in progress...' %
                   (var+1, nVAR))
 
-            # ---- Memory Variables ---- #
-
-            colm_memory = []  # Column sequence memory matrix
-            RegCoeff_memory = []  # Regression coefficient memory matrix
-            RMSE_memory = []  # RMSE memory matrix
-            Ndat_memory = []  # Nbr. of data used for the regression
-
             # Sort station in descending correlation coefficient order.
             # The index of the *target station* is pulled at index 0.
 
@@ -510,34 +515,34 @@ class GapFillWeather(QObject):
                     else:
                         X_row = YX[row, colm[1:]]
 
-                    # Elements of the <colm> array are put back to back
-                    # in a single string. For example, a [2, 7, 11] array
-                    # would end up as '020711'. This allow to assign a
-                    # unique number ID to a column combination. Each
-                    # column correspond to a unique weather station.
+                    # The model is identified by the indexes of the target
+                    # and neighboring stations in WEATHER.DATA, so that
+                    # each combination of stations has a unique key
+                    # regardless of the cutoff criteria.
 
-                    colm_seq = ''
-                    for i in range(len(colm)):
-                        colm_seq += '%02d' % colm[i]
+                    model_key = (tuple(index_ALL[Sta_index[colm]]), var,
+                                 self.regression_mode,
+                                 self.full_error_analysis)
 
                     # A check is made to see if the current combination
                     # of neighboring stations has been encountered
                     # previously in the routine. Regression coefficients
                     # are calculated only once for a given neighboring
                     # station combination.
+                    #
+                    # The memory is activated only if the option
+                    # 'leave_one_out' is not active. Otherwise, a new MLR
+                    # model is built for each value of the data series.
 
-                    if colm_seq not in colm_memory:
+                    if self.leave_one_out is False:
+                        model = self.model_cache.get(model_key)
+                    else:
+                        model = None
+
+                    if model is None:
                         # First time this neighboring station combination
                         # is encountered in the routine, regression
                         # coefficients are then calculated.
-                        #
-                        # The memory is activated only if the option
-                        # 'full_error_analysis' is not active. Otherwise, the
-                        # memory remains empty and a new MLR model is built
-                        # for each value of the data series.
-
-                        if self.leave_one_out is False:
-                            colm_memory.append(colm_seq)
 
                         # Columns of DATA for the variable VAR are sorted
                         # in descending correlation coefficient and the
@@ -612,19 +617,14 @@ class GapFillWeather(QObject):
 
                         # ------------------------------------ Add to Memory --
 
-                        RegCoeff_memory.append(A)
-                        RMSE_memory.append(RMSE)
-                        Ndat_memory.append(Ndat)
+                        if self.leave_one_out is False:
+                            self.model_cache.put(model_key, (A, RMSE, Ndat))
 
                     else:
                         # Regression coefficients and RSME are recalled
-                        # from the memory matrices.
+                        # from the memory.
 
-                        index_memory = colm_memory.index(colm_seq)
-
-                        A = RegCoeff_memory[index_memory]
-                        RMSE = RMSE_memory[index_memory]
-                        Ndat = Ndat_memory[index_memory]
+                        A, RMSE, Ndat = model
 
                     # ----------------------------- MISSING VALUE ESTIMATION --
 
@@ -788,6 +788,10 @@ class GapFillWeather(QObject):
                          ['Cutoff altitude difference (m)', str(limitAlt)],
                          ['Date Start', record_date_start],
                          ['Date End', record_date_end],
+                         ['MLR model memory hits',
+                          str(self.model_cache.hits - cache_hits)],
+                         ['MLR model memory misses',
+                          str(self.model_cache.misses - cache_misses)],
                          [], [],
                          ['*** SUMMARY TABLE ***'],
                          [],
@@ -1163,38 +1167,167 @@ def compute_correlation_coeff(data, tarStaIndx):
     station and the neighboring stations for each meteorological variable.
     Results are stored in the 2D matrix where the rows are the
     meteorological variables and the columns the weather stations.
+
+    The coefficients of all the stations and variables are computed at once
+    from the pairs of data for which neither the target nor the
+    neighboring station is missing a value.
     """
     print('\nCorrelation coefficients computation in progress...')
     ndat, nsta, nvar = np.shape(data)
-    corrcoef = np.empty((nvar, nsta))
     Ndata_limit = 365//2
     # Ndata_limit is the minimum number of pair of data necessary
     # between the target and a neighboring station to compute a correlation
     # coefficient.
-    for i, j in product(range(nvar), range(nsta)):
-        # Remove rows with nan values.
-        DATA_nonan = data[:, (tarStaIndx, j), i]
-        DATA_nonan = DATA_nonan[~np.isnan(DATA_nonan).any(axis=1)]
-
-        # Compute how many pair of data are available for the correlation
-        # coefficient calculation. For the precipitation, entries with 0
-        # are not considered.
-        if i in (0, 1, 2):
-            Nnonan = len(DATA_nonan[:, 0])
-        else:
-            Nnonan = sum((DATA_nonan != 0).any(axis=1))
 
-        # A correlation coefficient is computed between the target station
-        # and the neighboring station <j> for the variable <i> if there is
-        # enough data.
-        if Nnonan >= Ndata_limit:
-            corrcoef[i, j] = np.corrcoef(DATA_nonan, rowvar=0)[0, 1:]
-        else:
-            corrcoef[i, j] = np.nan
+    # Mask the pairs of data where the target or the neighboring station
+    # is missing a value.
+    x = data[:, tarStaIndx, :]
+    valid = ~np.isnan(data) & ~np.isnan(x)[:, np.newaxis, :]
+    x = np.where(np.isnan(x), 0, x)
+    y = np.where(valid, data, 0)
+    w = valid.astype(float)
+
+    # Compute how many pair of data are available for the correlation
+    # coefficient calculation. For the precipitation, entries with 0
+    # are not considered.
+    Nnonan = np.sum(valid, axis=0)
+    Nnonan[:, 3:] = np.sum(
+        valid[:, :, 3:] & ((x[:, np.newaxis, 3:] != 0) | (y[:, :, 3:] != 0)),
+        axis=0)
+
+    # Compute the Pearson correlation coefficients from the sums of the
+    # pairs of data of each station and variable.
+    corrcoef = calcul_pearson_from_sums(
+        npairs=np.sum(w, axis=0),
+        sx=np.einsum('ti,tji->ji', x, w),
+        sxx=np.einsum('ti,tji->ji', x * x, w),
+        sy=np.sum(y, axis=0),
+        syy=np.einsum('tji,tji->ji', y, y),
+        sxy=np.einsum('ti,tji->ji', x, y))
+
+    # A correlation coefficient is computed between the target station
+    # and a neighboring station for a variable only if there is
+    # enough data.
+    corrcoef[Nnonan < Ndata_limit] = np.nan
+
     print('Correlation coefficients computation completed.\n')
+    return corrcoef.T
+
+
+def compute_correlation_matrix(data):
+    """
+    Compute the correlation coefficients between all the pairs of weather
+    stations for each meteorological variable. Results are stored in a 3D
+    matrix where the first axis is the meteorological variables and the
+    other two are the weather stations, so that corrmat[:, i, :] is equal
+    to compute_correlation_coeff(data, i).
+
+    For each variable, the sums over the pairs of data of all the stations
+    are computed at once with matrix products, with the missing values set
+    to 0 and masked out by the products with the matrix of valid values.
+    """
+    print('\nCorrelation matrix computation in progress...')
+    ndat, nsta, nvar = np.shape(data)
+    Ndata_limit = 365//2
+
+    corrmat = np.empty((nvar, nsta, nsta))
+    for var in range(nvar):
+        valid = ~np.isnan(data[:, :, var])
+        w = valid.astype(float)
+        x = np.where(valid, data[:, :, var], 0)
+
+        npairs = np.dot(w.T, w)
+        sx = np.dot(x.T, w)
+        sxx = np.dot((x * x).T, w)
+        sxy = np.dot(x.T, x)
+        corrmat[var] = calcul_pearson_from_sums(
+            npairs, sx, sxx, sx.T, sxx.T, sxy)
+
+        # For the precipitation, the pairs of data where both stations
+        # have 0 are not considered in the number of pairs of data.
+        if var >= 3:
+            z = (valid & (x == 0)).astype(float)
+            Nnonan = npairs - np.dot(z.T, z)
+        else:
+            Nnonan = npairs
+        corrmat[var][Nnonan < Ndata_limit] = np.nan
+
+    print('Correlation matrix computation completed.\n')
+    return corrmat
+
+
+def calcul_pearson_from_sums(npairs, sx, sxx, sy, syy, sxy):
+    """
+    Compute the Pearson correlation coefficients from the number of pairs
+    of data and the sums of the x and y values, of their squares, and of
+    their products.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / npairs
+        varx = sxx - sx * sx / npairs
+        vary = syy - sy * sy / npairs
+
+        # The coefficient is undefined if the data of either station are
+        # constant, which is assessed with a tolerance because of the
+        # rounding errors of the sums.
+        varx[varx <= 1e-12 * sxx] = 0
+        vary[vary <= 1e-12 * syy] = 0
+        corrcoef = np.clip(cov / np.sqrt(varx * vary), -1, 1)
+    corrcoef[(varx == 0) | (vary == 0)] = np.nan
     return corrcoef
 
 
+class RegressionModelCache(object):
+    """
+    Least recently used memory of the regression models of the gap-filling,
+    with the number of times a model was found (hits) or not (misses) in
+    the memory.
+    """
+
+    def __init__(self, maxsize=2**16):
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def get(self, key):
+        """
+        Return the model saved for key or None if there is no such model
+        in the memory.
+        """
+        try:
+            model = self._models.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        else:
+            self._models[key] = model
+            self.hits += 1
+            return model
+
+    def put(self, key, model):
+        """
+        Save the model for key and remove the least recently used models
+        from the memory if its size exceeds maxsize.
+        """
+        self._models.pop(key, None)
+        self._models[key] = model
+        while len(self._models) > self.maxsize:
+            self._models.popitem(last=False)
+
+    def clear(self):
+        """Remove all the models from the memory and reset the counts."""
+        self._models.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 class TargetStationInfo(object):
     """
     Class that contains all the information relative to the target station,
@@ -1308,6 +1441,10 @@ class WeatherData(object):
         self.NUMMISS = []     # Number of missing data
         self.fnames = []
 
+        # Correlation coefficients between all the pairs of stations for
+        # each variable. See get_correlation_matrix.
+        self.CORRCOEF = None
+
     # =========================================================================
 
     def save_to_binary(self, dirname):
@@ -1375,9 +1512,49 @@ class WeatherData(object):
         self.VARNAME = A['VARNAME']
         self.fnames = A['fnames']
 
+        self.CORRCOEF = None
+
         for name in self.STANAME:
             print(name)
 
+    # -------------------------------------------------------------------------
+
+    def get_correlation_matrix(self, dirname=None):
+        """
+        Return the matrix of the correlation coefficients between all the
+        pairs of stations for each meteorological variable.
+
+        The matrix is computed only once for the data currently loaded. If
+        a directory is provided, the matrix is also cached in a binary file
+        next to fdata.npy, which is reused as long as the hash of the data
+        saved with it matches the data currently loaded. The names of the
+        stations are part of the hash, so that they are compared whatever
+        their length.
+        """
+        if self.CORRCOEF is not None:
+            return self.CORRCOEF
+
+        sha = hashlib.sha1(np.ascontiguousarray(self.DATA, dtype='float32'))
+        names = '\n'.join(str(name) for name in self.STANAME)
+        sha.update(names.encode('utf8'))
+        datahash = sha.hexdigest()
+        fname = os.path.join(dirname, 'fcorrcoef.npy') if dirname else None
+        if fname and os.path.exists(fname):
+            A = np.load(fname)
+            if str(A['datahash']) == datahash:
+                self.CORRCOEF = A['CORRCOEF'].astype(float)
+                return self.CORRCOEF
+
+        self.CORRCOEF = compute_correlation_matrix(self.DATA)
+        if fname:
+            A = np.zeros((), dtype=[
+                ('CORRCOEF', 'float64', np.shape(self.CORRCOEF)),
+                ('datahash', '|U40')])
+            A['CORRCOEF'] = self.CORRCOEF
+            A['datahash'] = datahash
+            np.save(fname, A)
+        return self.CORRCOEF
+
     def load_and_format_data(self, paths):
         # paths = list of paths of weater data files
 
@@ -1388,6 +1565,7 @@ class WeatherData(object):
 
         # Reset the state of all class variables :
 
+        self.CORRCOEF = None
         self.STANAME = []
         self.ALT = []
         self.LAT = []
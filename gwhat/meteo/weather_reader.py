@@ -12,7 +12,6 @@
 import os
 import os.path as osp
 import csv
-from calendar import monthrange
 from time import strftime
 from collections.abc import Mapping
 from abc import abstractmethod
@@ -29,6 +28,7 @@ from xlrd import xldate_as_tuple
 from gwhat.meteo.evapotranspiration import calcul_Thornthwaite
 from gwhat.common.utils import save_content_to_csv, save_content_to_file
 from gwhat.utils.math import nan_as_text_tolist
+from gwhat.utils.aggregate import PeriodGroups
 from gwhat import __namever__
 
 
@@ -472,13 +472,17 @@ def add_PET_to_weather_datafile(filename):
 
 def open_weather_log(fname):
     """
-    Open the csv file and try to guess the delimiter.
-    Return None if this fails.
+    Open the csv file, try to guess the delimiter and return the rows of
+    the detailed report, which follow its header row starting with
+    'VARIABLE'. Return None if this fails.
     """
     for dlm in [',', '\t']:
         with open(fname, 'r') as f:
             reader = list(csv.reader(f, delimiter=dlm))
             if reader[0][0] == 'Station Name':
+                for i, row in enumerate(reader):
+                    if row and row[0] == 'VARIABLE':
+                        return reader[i+1:]
                 return reader[36:]
     else:
         return None
@@ -772,21 +776,14 @@ def calc_monthly_mean(yy_dly, mm_dly, x_dly):
 
 
 def calc_monthly(yy_dly, mm_dly, x_dly, func):
-    yy = np.unique(yy_dly)
-    mm = range(1, 13)
-
-    yy_mly = np.repeat(yy, len(mm))
-    mm_mly = np.tile(mm, len(yy))
-    x_mly = np.zeros(len(mm)*len(yy))
-
-    for i in range(len(mm)*len(yy)):
-        indx = np.where((yy_dly == yy_mly[i]) & (mm_dly == mm_mly[i]))[0]
-        if len(indx) < monthrange(yy_mly[i], mm_mly[i])[1]:
-            x_mly[i] = np.nan  # incomplete dataset for this month
-        else:
-            x_mly[i] = func(x_dly[indx])
-
-    return yy_mly, mm_mly, x_mly
+    """
+    Calcul monthly values from daily values with func, for the 12 months of
+    each year of yy_dly. The values of the months with an incomplete
+    dataset are set to nan.
+    """
+    groups = PeriodGroups(yy_dly, mm_dly, 'monthly')
+    x_mly = groups.aggregate(x_dly, func, complete=True)
+    return groups.years, groups.months, x_mly
 
 
 def calcul_monthly_normals(years, months, x_mly, yearmin=None, yearmax=None):
@@ -836,13 +833,12 @@ def calc_yearly_mean(yy_dly, x_dly):
 
 
 def calc_yearly(yy_dly, x_dly, func):
-    yy_yrly = np.unique(yy_dly)
-    x_yrly = np.zeros(len(yy_yrly))
-    for i in range(len(yy_yrly)):
-        indx = np.where(yy_dly == yy_yrly[i])[0]
-        x_yrly[i] = func(x_dly[indx])
-
-    return yy_yrly, x_yrly
+    """
+    Calcul yearly values from daily values with func, for each year
+    of yy_dly.
+    """
+    groups = PeriodGroups(yy_dly, period='yearly')
+    return groups.years, groups.aggregate(x_dly, func)
 
 
 # ----- Base functions: secondary variables
@@ -24,10 +24,18 @@ import numpy as np
 from gwhat.meteo.weather_reader import WXDataFrameBase
 from gwhat.gwrecharge.glue import GLUEDataFrameBase
 from gwhat.common.utils import save_content_to_file
-from gwhat.utils.math import nan_as_text_tolist, calcul_rmse
+from gwhat.utils.math import (
+    nan_as_text_tolist, calcul_rmse, find_time_slice)
 
 INVALID_CHARS = ['\\', '/', ':', '*', '?', '"', '<', '>', '|']
 
+# The version of the layout of the GLUE results saved in the project. In
+# version 2, the arrays are saved in chunked and compressed datasets and the
+# GLUE limits of the budgets and water levels are saved in float32.
+GLUE_LAYOUT = 2
+GLUE_FLOAT32_KEYS = ['recharge', 'evapo', 'runoff', 'predicted']
+GLUE_CHUNKSIZE = 1024
+
 
 class ProjetReader(object):
     def __init__(self, filename):
@@ -373,7 +381,18 @@ class WLDataFrameHDF5(dict):
         if key in list(self.dset.attrs.keys()):
             return self.dset.attrs[key]
         else:
-            return self.dset[key].value
+            return self.dset[key][()]
+
+    def get(self, key, tmin=None, tmax=None):
+        """
+        Return the values of key between the times tmin and tmax, which are
+        found in the 'Time' or 'time' dataset of the same group. Only the
+        part of the dataset that is needed is read from the file. The values
+        of key are returned whole if they are not a time series.
+        """
+        if key in list(self.dset.attrs.keys()):
+            return self.dset.attrs[key]
+        return get_h5dset_between(self.dset[key], tmin, tmax)
 
     @property
     def name(self):
@@ -398,7 +417,7 @@ class WLDataFrameHDF5(dict):
     def get_wlmeas(self):
         """Get the water level measurements for this dataset."""
         grp = self.dset.require_group('manual')
-        return grp['Time'].value, grp['WL'].value
+        return grp['Time'][()], grp['WL'][()]
 
     # ---- Master recession curve
 
@@ -483,10 +502,28 @@ class WLDataFrameHDF5(dict):
         idnum = str(idnum)
 
         grp = self.dset['glue'].create_group(idnum)
-        save_dict_to_h5grp(grp, gluedf)
+        save_glue_to_h5grp(grp, gluedf)
         self.dset.file.flush()
         print('GLUE results saved successfully')
 
+    def migrate_glue(self):
+        """
+        Save again in the current layout the GLUE results of this dataset
+        that were saved in an older layout. Return the number of GLUE
+        results that were migrated.
+        """
+        count = 0
+        for idnum in self.glue_idnums():
+            grp = self.dset['glue'][idnum]
+            if grp.attrs.get('layout', 1) == GLUE_LAYOUT:
+                continue
+            gluedf = load_dict_from_h5grp(grp)
+            del self.dset['glue'][idnum]
+            save_glue_to_h5grp(self.dset['glue'].create_group(idnum), gluedf)
+            count += 1
+        self.dset.file.flush()
+        return count
+
     def get_glue(self, idnum):
         """Get GLUE results at idnum."""
         if idnum in self.glue_idnums():
@@ -535,8 +572,8 @@ class WLDataFrameHDF5(dict):
 
     def get_brf(self, name):
         grp = self.dset['brf'][name]
-        return (grp['lag'].value, grp['A'].value, grp['err'].value,
-                grp['date start'].value, grp['date end'].value)
+        return (grp['lag'][()], grp['A'][()], grp['err'][()],
+                grp['date start'][()], grp['date end'][()])
 
     def save_brf(self, lag, A, err, date_start, date_end):
         if list(self.dset['brf'].keys()):
@@ -633,7 +670,7 @@ class WXDataFrameHDF5(WXDataFrameBase):
         elif key in ['normals', 'yearly', 'monthly']:
             x = {}
             for vrb in self.store[key].keys():
-                x[vrb] = self.store[key][vrb].value
+                x[vrb] = self.store[key][vrb][()]
             if key == 'normals' and 'Period' not in x.keys():
                 # This is needed for backward compatibility with
                 # gwhat < 0.2.3 (see PR#142).
@@ -645,10 +682,23 @@ class WXDataFrameHDF5(WXDataFrameBase):
                     'Rain', 'Snow', 'Ptot', 'PET']
             x = {}
             for vrb in vrbs:
-                x[vrb] = self.store[vrb].value
+                x[vrb] = self.store[vrb][()]
             return x
         else:
-            return self.store[key].value
+            return self.store[key][()]
+
+    def get(self, key, tmin=None, tmax=None):
+        """
+        Return the daily values of key between the times tmin and tmax,
+        reading only the part of the dataset that is needed from the file.
+        The values of key are returned whole if they are not a time series.
+        """
+        if key in list(self.store.attrs.keys()) or key not in self.store:
+            return self[key]
+        item = self.store[key]
+        if not isinstance(item, h5py._hl.dataset.Dataset):
+            return self[key]
+        return get_h5dset_between(item, tmin, tmax)
 
     def __setitem__(self, key, value):
         return NotImplementedError
@@ -672,22 +722,69 @@ class GLUEDataFrameHDF5(GLUEDataFrameBase):
     """
     This is a wrapper around the h5py group to read the GLUE results
     from the project.
+
+    Only the groups that are requested are read from the file and they are
+    memoised, so that they are read only once.
     """
     def __init__(self, data, *args, **kwargs):
         super(GLUEDataFrameHDF5, self).__init__(*args, **kwargs)
+        self._cache = {}
         self.__load_data__(data)
 
     def __getitem__(self, key):
         """Return the value saved in the store at key."""
-        if key not in self.store.keys():
-            raise KeyError(key)
+        if key not in self._cache:
+            if key not in self.store:
+                raise KeyError(key)
+            item = self.store[key]
+            if isinstance(item, h5py._hl.dataset.Dataset):
+                self._cache[key] = item[()]
+                if item.dtype == np.float32:
+                    self._cache[key] = self._cache[key].astype('float64')
+            elif isinstance(item, h5py._hl.group.Group):
+                self._cache[key] = load_dict_from_h5grp(item)
+            else:
+                self._cache[key] = None
+        return self._cache[key]
+
+    def __contains__(self, key):
+        return key in self.store
 
-        if isinstance(self.store[key], h5py._hl.dataset.Dataset):
-            return self.store[key].value
-        elif isinstance(self.store[key], h5py._hl.group.Group):
-            return load_dict_from_h5grp(self.store[key])
+    def get(self, key, tmin=None, tmax=None):
+        """
+        Return the values of the group at key for the times between tmin
+        and tmax, like GLUEDataFrameBase.get, reading only the part of the
+        datasets that is needed from the file.
+        """
+        if key in self._cache or key not in self.store:
+            return super(GLUEDataFrameHDF5, self).get(key, tmin, tmax)
+        item = self.store[key]
+        if not isinstance(item, h5py._hl.group.Group) or 'time' not in item:
+            return self[key]
+        values = {}
+        for name, dset in item.items():
+            if isinstance(dset, h5py._hl.group.Group):
+                values[name] = load_dict_from_h5grp(dset)
+                continue
+            values[name] = get_h5dset_between(dset, tmin, tmax, item['time'])
+            if dset.dtype == np.float32:
+                values[name] = values[name].astype('float64')
+        return values
+
+    @property
+    def layout(self):
+        """Return the version of the layout of the saved GLUE results."""
+        return self.store.attrs.get('layout', 1)
+
+    def invalidate(self, key=None):
+        """
+        Clear the memoised value at key, or all of them if key is None, so
+        that it is read again from the file on its next access.
+        """
+        if key is None:
+            self._cache.clear()
         else:
-            return None
+            self._cache.pop(key, None)
 
     def __setitem__(self, key, value):
         raise NotImplementedError
@@ -703,6 +800,21 @@ class GLUEDataFrameHDF5(GLUEDataFrameBase):
         self.store = data
 
 
+def get_h5dset_between(dset, tmin=None, tmax=None, time=None):
+    """
+    Return the values of the h5py dataset dset for the times between tmin
+    and tmax. If time is None, the times are read from the 'Time' or 'time'
+    dataset of the group of dset. The dataset is returned whole if its
+    first dimension does not match the times.
+    """
+    if time is None:
+        grp = dset.parent
+        time = grp['Time'] if 'Time' in grp else grp.get('time')
+    if time is None or dset.ndim == 0 or dset.shape[0] != time.shape[0]:
+        return dset[()]
+    return dset[find_time_slice(time, tmin, tmax)]
+
+
 def is_dsetname_valid(dsetname):
     """
     Check if the dataset name respect the established guidelines to avoid
@@ -725,21 +837,86 @@ def save_dict_to_h5grp(h5grp, dic):
             h5grp.create_dataset(key, data=item)
 
 
+def save_glue_to_h5grp(h5grp, gluedf):
+    """
+    Save the content of the GLUE results recursively in a hdf5 group, in
+    the GLUE_LAYOUT layout. The numerical arrays are saved in datasets
+    that are chunked along their first axis and compressed, and the GLUE
+    limits of the budgets and water levels are saved in float32.
+    """
+    h5grp.attrs['layout'] = GLUE_LAYOUT
+    _save_glue_items_to_h5grp(h5grp, gluedf)
+
+
+def _save_glue_items_to_h5grp(h5grp, dic):
+    for key, item in dic.items():
+        if isinstance(item, dict):
+            _save_glue_items_to_h5grp(h5grp.require_group(key), item)
+            continue
+        data = np.asarray(item)
+        if data.ndim == 0 or data.size == 0 or data.dtype.kind not in 'iuf':
+            h5grp.create_dataset(key, data=item)
+            continue
+        if key in GLUE_FLOAT32_KEYS and data.dtype.kind == 'f':
+            data = data.astype('float32')
+        chunks = (min(len(data), GLUE_CHUNKSIZE),) + data.shape[1:]
+        h5grp.create_dataset(key, data=data, chunks=chunks, shuffle=True,
+                             compression='gzip', compression_opts=4)
+
+
 def load_dict_from_h5grp(h5grp):
     """
     Retrieve the content of a hdf5 group and organize it in a dictionary.
     Based on answers provided at
     https://codereview.stackexchange.com/questions/120802
+
+    The float32 datasets are returned as float64 arrays, so that the GLUE
+    results are returned the same way for all layouts.
     """
     dic = {}
     for key, item in h5grp.items():
         if isinstance(item, h5py._hl.dataset.Dataset):
-            dic[key] = item.value
+            dic[key] = item[()]
+            if item.dtype == np.float32:
+                dic[key] = dic[key].astype('float64')
         elif isinstance(item, h5py._hl.group.Group):
             dic[key] = load_dict_from_h5grp(item)
     return dic
 
 
+def migrate_projet_glue(filename):
+    """
+    Save again in the current layout all the GLUE results of the project
+    saved in filename that were saved in an older layout, and repack the
+    file so that the space used by the old results is freed. Return the
+    number of GLUE results that were migrated.
+    """
+    projet = ProjetReader(filename)
+    try:
+        count = sum(projet.get_wldset(name).migrate_glue() for
+                    name in projet.wldsets)
+    finally:
+        projet.close_projet()
+    if count > 0:
+        repack_projet(filename)
+    return count
+
+
+def repack_projet(filename):
+    """
+    Copy the content of the project hdf5 file in a new file that replaces
+    it, since the space used by deleted datasets is not freed otherwise.
+    """
+    tmpname = filename + '.repack'
+    with h5py.File(filename, mode='r') as src:
+        with h5py.File(tmpname, mode='w') as dst:
+            for key, value in src.attrs.items():
+                dst.attrs[key] = value
+            for key in src.keys():
+                src.copy(src[key], dst, name=key)
+    os.replace(tmpname, filename)
+
+
 if __name__ == '__main__':
     FNAME = ("C:\\Users\\User\\gwhat\\Projects\\Example\\Example.gwt")
     PROJET = ProjetReader(FNAME)
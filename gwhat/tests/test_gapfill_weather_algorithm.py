@@ -19,7 +19,10 @@ from PyQt5.QtCore import Qt
 
 # Local imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-from gwhat.meteo.gapfill_weather_algorithm2 import GapFillWeather
+import gwhat.meteo.gapfill_weather_algorithm2 as gapfill_algorithm
+from gwhat.meteo.gapfill_weather_algorithm2 import (
+    GapFillWeather, WeatherData, RegressionModelCache,
+    compute_correlation_coeff)
 from gwhat.common.utils import delete_folder_recursively
 
 
@@ -111,6 +114,115 @@ def test_fill_data(gapfill_weather_bot):
         assert os.path.join(output_dir, dirname, figname)
 
 
+def test_compute_correlation_coeff():
+    """
+    Test that the correlation coefficients between the target station and
+    the neighboring stations are computed from the pairs of data without
+    missing values, and only when there are enough pairs of data.
+    """
+    rs = np.random.RandomState(0)
+    ndat, nsta, nvar = 1000, 6, 4
+    data = rs.normal(size=(ndat, 1, nvar)) + rs.normal(size=(ndat, nsta, nvar))
+    data[:, :, 3] = np.maximum(data[:, :, 3], 0) * 5
+    data[rs.rand(ndat, nsta, nvar) < 0.2] = nan
+
+    # Not enough data are available for the station 4, and there is not
+    # enough pairs of data with precipitation at the target or the station 5.
+    data[200:, 4, :] = nan
+    has_ptot = data[150:, 1, 3] != 0
+    data[150:, 5, 3] = np.where(has_ptot, nan, 0)
+
+    corrcoef = compute_correlation_coeff(data, 1)
+    assert corrcoef.shape == (nvar, nsta)
+    for i, j in product(range(nvar), range(nsta)):
+        pairs = data[:, (1, j), i]
+        pairs = pairs[~np.isnan(pairs).any(axis=1)]
+        if j == 4 or (j == 5 and i == 3):
+            if i == 3:
+                assert np.sum((pairs != 0).any(axis=1)) < 365 // 2
+            else:
+                assert len(pairs) < 365 // 2
+            assert np.isnan(corrcoef[i, j])
+        else:
+            expected = np.corrcoef(pairs, rowvar=0)[0, 1]
+            assert corrcoef[i, j] == pytest.approx(expected, abs=1e-12)
+    assert np.allclose(corrcoef[:, 1], 1)
+
+
+def test_correlation_matrix_cache(tmpdir, mocker):
+    """
+    Test that the station x station correlation matrix matches the
+    correlation coefficients computed for each target station, and that it
+    is cached in the input directory until the data change.
+    """
+    rs = np.random.RandomState(0)
+    ndat, nsta, nvar = 1000, 6, 4
+    data = rs.normal(size=(ndat, 1, nvar)) + rs.normal(size=(ndat, nsta, nvar))
+    data[:, :, 3] = np.maximum(data[:, :, 3], 0) * 5
+    data[rs.rand(ndat, nsta, nvar) < 0.2] = nan
+    data[200:, 4, :] = nan
+
+    weather = WeatherData()
+    weather.DATA = data
+    weather.STANAME = np.array(
+        ['Station with a name longer than 25 characters %d' % i for
+         i in range(nsta)])
+    corrmat = weather.get_correlation_matrix(str(tmpdir))
+    assert corrmat.shape == (nvar, nsta, nsta)
+    assert os.path.exists(os.path.join(str(tmpdir), 'fcorrcoef.npy'))
+    for i in range(nsta):
+        np.testing.assert_allclose(
+            corrmat[:, i, :], compute_correlation_coeff(data, i), atol=1e-12)
+
+    # The matrix is read from the cache by a new instance with the same data
+    # and is computed again when the data change.
+    spy = mocker.spy(gapfill_algorithm, 'compute_correlation_matrix')
+    weather = WeatherData()
+    weather.DATA = data
+    weather.STANAME = np.array(
+        ['Station with a name longer than 25 characters %d' % i for
+         i in range(nsta)])
+    np.testing.assert_array_equal(
+        weather.get_correlation_matrix(str(tmpdir)), corrmat)
+    assert spy.call_count == 0
+
+    weather.CORRCOEF = None
+    weather.DATA = data[::-1]
+    weather.get_correlation_matrix(str(tmpdir))
+    assert spy.call_count == 1
+
+    # The matrix is also computed again when the stations are renamed.
+    weather.CORRCOEF = None
+    weather.STANAME = weather.STANAME[::-1]
+    weather.get_correlation_matrix(str(tmpdir))
+    assert spy.call_count == 2
+
+
+def test_regression_model_cache():
+    """
+    Test that the memory of the regression models counts the hits and misses
+    and removes the least recently used models when it is full.
+    """
+    cache = RegressionModelCache(maxsize=2)
+    assert cache.get(((0, 1), 0)) is None
+    cache.put(((0, 1), 0), 'A01')
+    cache.put(((0, 2), 0), 'A02')
+    assert cache.get(((0, 1), 0)) == 'A01'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The model of the stations (0, 2) is the least recently used one.
+    cache.put(((0, 1, 2), 0), 'A012')
+    assert len(cache) == 2
+    assert ((0, 2), 0) not in cache
+    assert cache.get(((0, 2), 0)) is None
+    assert cache.get(((0, 1, 2), 0)) == 'A012'
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
 if __name__ == "__main__":
     pytest.main(['-x', os.path.basename(__file__), '-v', '-rw'])
     # pytest.main()
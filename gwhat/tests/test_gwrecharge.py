@@ -0,0 +1,1165 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+# Standard library imports
+import sys
+import os
+
+# Third party imports
+import numpy as np
+import pytest
+
+# Local imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gwhat.gwrecharge.gwrecharge_calc2 import (
+    RechgEvalWorker, eval_recharge_multiwell)
+from gwhat.gwrecharge.realizations import RealizationStore
+from gwhat.gwrecharge.samplers import AdaptiveSampler
+from gwhat.gwrecharge.glue_cache import RealizationCache
+from gwhat.gwrecharge.glue_sketch import WeightedQuantileSketch
+from gwhat.gwrecharge.glue import (
+    calcul_glue, calcul_mly_budget, calcul_hydro_yrly_budget)
+from gwhat.gwrecharge.batch import eval_recharge_for_projet, main
+from gwhat.gwrecharge.gwrecharge_gui import RechgEvalWidget
+from gwhat.gwrecharge import jobs, glue
+from gwhat.projet.reader_projet import (
+    ProjetReader, save_dict_to_h5grp, migrate_projet_glue)
+from gwhat.gwrecharge.gwrecharge_calculs import (
+    calcul_surf_water_budget, calcul_surf_water_budget_batch,
+    calcul_snow_melt)
+
+
+# Test Fixtures
+# --------------------------------
+
+
+def make_synthetic_datasets(nyear=3, seed=3, Sy=0.1, A=0.02, B=0.05):
+    """
+    Produce a synthetic weather dataset and a synthetic water level dataset
+    that mimick the structure of the WXDataFrameHDF5 and WLDataFrameHDF5
+    that are used by the RechgEvalWorker.
+    """
+    rs = np.random.RandomState(seed)
+    time = np.arange(36526, 36526 + 365 * nyear).astype(float)
+    ndays = len(time)
+    doy = np.arange(ndays) % 365
+
+    tavg = -12 * np.cos(2 * np.pi * doy / 365) + 6 + rs.normal(0, 3, ndays)
+    ptot = rs.gamma(0.4, 7, ndays)
+    pet = np.maximum(tavg, 0) * 0.15
+
+    dates = [np.datetime64('1900-01-01') + np.timedelta64(int(t) - 2, 'D')
+             for t in time]
+    years = np.array([d.astype(object).year for d in dates])
+    months = np.array([d.astype(object).month for d in dates])
+    days = np.array([d.astype(object).day for d in dates])
+
+    wxdset = {'Time': time, 'Year': years, 'Month': months, 'Day': days,
+              'Tmax': tavg + 5, 'Tmin': tavg - 5, 'Tavg': tavg,
+              'Ptot': ptot, 'Rain': ptot, 'PET': pet,
+              'Station Name': 'Synthetic', 'Climate Identifier': '0000000',
+              'Province': 'QC', 'Latitude': 45, 'Longitude': -73,
+              'Elevation': 100}
+
+    # Produce the water levels with known model parameters.
+    rechg, _, _, _, _ = calcul_surf_water_budget(
+        pet, ptot, tavg, 0, 4, 0.2, 20)
+    wl = np.zeros(ndays)
+    wl[0] = 3000
+    for i in range(ndays - 1):
+        recess = max((B - A * wl[i] / 1000) * 1000, 0)
+        wl[i + 1] = wl[i] - rechg[i] / Sy + recess
+    wl = wl / 1000
+
+    wldset = {'Time': time, 'WL': wl, 'mrc/params': (A, B),
+              'mrc/time': time, 'mrc/recess': wl,
+              'Well': 'Synthetic', 'Well ID': '0000000', 'Province': 'QC',
+              'Latitude': 45, 'Longitude': -73, 'Elevation': 100,
+              'Municipality': 'Synthetic'}
+
+    return wxdset, wldset
+
+
+@pytest.fixture
+def rechg_worker():
+    wxdset, wldset = make_synthetic_datasets()
+    worker = RechgEvalWorker()
+    worker.Sy = (0.05, 0.2)
+    worker.Cro = (0.1, 0.3)
+    worker.RASmax = (10, 30)
+    worker.glue_pardist_res = 'rough'
+    worker.load_data(wxdset, wldset)
+    return worker
+
+
+# Tests
+# -------------------------------
+
+
+def test_surf_water_budget_batch(rechg_worker):
+    """
+    Test that the batched surface water budget kernel returns the same
+    results as the one that is computed for a single pair of parameters.
+    """
+    worker = rechg_worker
+    U_CRU = np.array([0, 0.1, 0.25, 0.3, 1])
+    U_RAS = np.array([0, 5, 20, 75, 150])
+    rechgs, rus, etrs = worker.surf_water_budget_batch(U_CRU, U_RAS)
+    assert rechgs.shape == (len(U_CRU), len(worker.ETP))
+
+    for i, (cru, rasmax) in enumerate(zip(U_CRU, U_RAS)):
+        rechg, ru, etr, ras, pacc = worker.surf_water_budget(cru, rasmax)
+        assert np.allclose(rechgs[i], rechg)
+        assert np.allclose(rus[i], ru)
+        assert np.allclose(etrs[i], etr)
+
+    # Assert that the snow accumulation and melt computed separately is the
+    # same as the one computed in the surface water budget.
+    pavl, pacc = worker.snow_melt()
+    assert np.allclose(pacc, worker.surf_water_budget(0.2, 20)[-1])
+    rechgs2, rus2, etrs2 = worker.surf_water_budget_batch(U_CRU, U_RAS, pavl)
+    assert np.array_equal(rechgs2, rechgs)
+
+    # Assert that an error is raised when the parameter vectors do not match.
+    with pytest.raises(ValueError):
+        calcul_surf_water_budget_batch(
+            worker.ETP, worker.PTOT, worker.TAVG, worker.TMELT, worker.CM,
+            U_CRU, U_RAS[:-1])
+
+    # Assert that an error is raised when the weather time series do not
+    # have the same length.
+    with pytest.raises(ValueError):
+        calcul_surf_water_budget(
+            worker.ETP, worker.PTOT[:-1], worker.TAVG, worker.TMELT,
+            worker.CM, 0.2, 20)
+    with pytest.raises(ValueError):
+        calcul_surf_water_budget(
+            worker.ETP, worker.PTOT, worker.TAVG[:-1], worker.TMELT,
+            worker.CM, 0.2, 20)
+    with pytest.raises(ValueError):
+        calcul_snow_melt(worker.PTOT, worker.TAVG[:-1], worker.TMELT,
+                         worker.CM)
+
+
+def test_optimize_specific_yield(rechg_worker):
+    """
+    Test that the derivative of the hydrograph with respect to Sy is
+    computed correctly and that the optimal value of Sy is found.
+    """
+    worker = rechg_worker
+    ts = np.where(worker.twlvl[0] == worker.tweatr)[0][0]
+    te = np.where(worker.twlvl[-1] == worker.tweatr)[0][0]
+    rechg = worker.surf_water_budget(0.2, 20)[0][ts:te]
+
+    wlpre, dwl = worker.calc_hydrograph_sens(rechg, 0.1)
+    assert np.allclose(wlpre, worker.calc_hydrograph(rechg, 0.1))
+    dwl_num = (worker.calc_hydrograph(rechg, 0.1 + 1e-6) -
+               worker.calc_hydrograph(rechg, 0.1 - 1e-6)) / 2e-6
+    assert np.allclose(dwl, dwl_num, rtol=1e-4)
+
+    Sy, RMSE, wlpre = worker.optimize_specific_yield(
+        0.05, worker.wlobs*1000, rechg)
+    assert Sy == pytest.approx(0.1, abs=0.001)
+    assert RMSE < 1
+
+
+def test_optimize_specific_yield_batch(rechg_worker):
+    """
+    Test that the optimal values of Sy found for a set of recharge time
+    series at once are the same as those found for each one separately.
+    """
+    worker = rechg_worker
+    ts = np.where(worker.twlvl[0] == worker.tweatr)[0][0]
+    te = np.where(worker.twlvl[-1] == worker.tweatr)[0][0]
+    cru, rasmax = np.meshgrid([0.1, 0.2, 0.3], [10, 20, 30])
+    rechgs = worker.surf_water_budget_batch(
+        cru.ravel(), rasmax.ravel())[0][:, ts:te]
+
+    wlpre, dwl = worker.calc_hydrograph_sens_batch(
+        rechgs, np.full(len(rechgs), 0.1))
+    for i in range(len(rechgs)):
+        expected = worker.calc_hydrograph_sens(rechgs[i], 0.1)
+        assert np.allclose(wlpre[i], expected[0])
+        assert np.allclose(dwl[i], expected[1])
+
+    Sys, RMSEs, wlpres, pruned = worker.optimize_specific_yield_batch(
+        0.05, worker.wlobs*1000, rechgs)
+    assert not np.any(pruned)
+    for i in range(len(rechgs)):
+        Sy, RMSE, wlpre = worker.optimize_specific_yield(
+            0.05, worker.wlobs*1000, rechgs[i])
+        assert Sys[i] == pytest.approx(Sy, abs=0.001)
+        assert RMSEs[i] == pytest.approx(RMSE, rel=0.01)
+        assert np.allclose(wlpres[i], wlpre, atol=10)
+
+    with pytest.raises(ValueError):
+        worker.calc_hydrograph_sens_batch(rechgs, [0.1])
+
+
+def test_eval_recharge_batch_optimizer(rechg_worker):
+    """
+    Test that the same behavioural models are found when the values of Sy
+    are optimized for all the models of a chunk at once.
+    """
+    gluedf = rechg_worker.eval_recharge()
+    rechg_worker.glue_optimizer = 'batch'
+    gluedf_batch = rechg_worker.eval_recharge()
+    assert gluedf_batch['count'] == gluedf['count']
+    assert np.array_equal(gluedf_batch['params']['Cru'],
+                          gluedf['params']['Cru'])
+    assert np.allclose(gluedf_batch['params']['Sy'],
+                       gluedf['params']['Sy'], atol=0.001)
+
+
+def test_eval_recharge_batch_optimizer_cached(rechg_worker, tmpdir):
+    """
+    Test that GLUE can be computed again with the batch optimizer when all
+    the models of the chunks are found in the cache.
+    """
+    rechg_worker.glue_optimizer = 'batch'
+    rechg_worker.glue_cache_dirname = str(tmpdir)
+    gluedf = rechg_worker.eval_recharge()
+    report = rechg_worker.glue_report.copy()
+    gluedf_cached = rechg_worker.eval_recharge()
+    assert rechg_worker.glue_report['cached'] == report['evaluated']
+    assert gluedf_cached['count'] == gluedf['count']
+    for key in ['Cru', 'RASmax']:
+        assert np.array_equal(gluedf_cached['params'][key],
+                              gluedf['params'][key])
+
+    results, Sy0, report = rechg_worker.eval_params_chunk([], [], 0.1)
+    assert results == [] and Sy0 == 0.1
+    assert report['evaluated'] == 0
+
+
+@pytest.mark.parametrize('nscheme', ['forward', 'backward', 'cranknicolson'])
+def test_calc_hydrograph_schemes(rechg_worker, nscheme):
+    """
+    Test that the synthetic hydrographs produced with each numerical scheme
+    and their derivatives with respect to Sy are computed correctly.
+    """
+    worker = rechg_worker
+    worker.hydrograph_scheme = nscheme
+    ts = np.where(worker.twlvl[0] == worker.tweatr)[0][0]
+    te = np.where(worker.twlvl[-1] == worker.tweatr)[0][0]
+    rechg = worker.surf_water_budget(0.2, 20)[0][ts:te]
+
+    # The backward scheme amplifies the errors by a factor 1/(1-A) per day,
+    # so the hydrographs are only compared over the last year of data.
+    rechg = rechg[-364:]
+    worker.wlobs = worker.wlobs[-365:]
+    wlobs = worker.wlobs * 1000
+    A, B = worker.A, worker.B
+
+    wlpre, dwl = worker.calc_hydrograph_sens(rechg, 0.1)
+    assert np.allclose(wlpre, worker.calc_hydrograph(rechg, 0.1))
+    dwl_num = (worker.calc_hydrograph(rechg, 0.1 + 1e-6) -
+               worker.calc_hydrograph(rechg, 0.1 - 1e-6)) / 2e-6
+    assert np.allclose(dwl, dwl_num, rtol=1e-4, atol=1e-3)
+
+    recess = np.maximum((B - A * wlpre / 1000) * 1000, 0)
+    if nscheme == 'forward':
+        assert wlpre[0] == wlobs[0]
+        assert np.allclose(wlpre[1:], wlpre[:-1] - rechg / 0.1 + recess[:-1])
+    elif nscheme == 'cranknicolson':
+        assert wlpre[0] == wlobs[0]
+        assert np.allclose(wlpre[1:], wlpre[:-1] - rechg / 0.1 +
+                           (recess[:-1] + recess[1:]) / 2)
+    elif nscheme == 'backward':
+        # The backward scheme must be the exact inverse of the forward one.
+        assert wlpre[-1] == wlobs[-1]
+        assert np.allclose(wlpre[1:], wlpre[:-1] - rechg / 0.1 + recess[:-1])
+
+        # Assert that the water levels before the first observed one are
+        # hindcasted when the recharge starts earlier than the water levels.
+        rechg_long = worker.surf_water_budget(0.2, 20)[0][ts:te][-464:]
+        wlpre_long = worker.calc_hydrograph(rechg_long, 0.1)
+        assert len(wlpre_long) == len(wlobs) + 100
+        assert wlpre_long[-1] == wlobs[-1]
+        assert np.allclose(wlpre_long[100:], wlpre)
+        wltrue = np.asarray(worker.wldset['WL'])[-465:] * 1000
+        assert np.allclose(wlpre_long, wltrue, atol=1)
+
+        wlpre_long2, _ = worker.calc_hydrograph_sens_batch(
+            rechg_long[np.newaxis], [0.1])
+        assert np.allclose(wlpre_long2[0], wlpre_long)
+
+    Sy, RMSE, wlpre = worker.optimize_specific_yield(0.05, wlobs, rechg)
+    assert Sy == pytest.approx(0.1, abs=0.005)
+
+    with pytest.raises(ValueError):
+        worker.calc_hydrograph(rechg, 0.1, nscheme='implicit')
+
+
+def test_eval_recharge(rechg_worker):
+    """
+    Test that the recharge is evaluated correctly with GLUE from a
+    synthetic dataset produced with known model parameters.
+    """
+    gluedf = rechg_worker.eval_recharge()
+    assert gluedf is not None
+    assert gluedf['count'] > 0
+    assert 0.2 in np.round(gluedf['params']['Cru'], 3)
+    assert 20 in gluedf['params']['RASmax']
+    assert np.min(gluedf['RMSE']) < 1
+
+
+def test_gluedf_lazy_products(rechg_worker, mocker):
+    """
+    Test that the GLUE budgets are computed only on their first access and
+    that they are memoised until they are invalidated.
+    """
+    calcul_mly_budget = mocker.spy(glue, 'calcul_mly_budget')
+    gluedf = rechg_worker.eval_recharge()
+    assert calcul_mly_budget.call_count == 0
+    assert 'monthly budget' in gluedf
+    assert 'monthly budget' in list(gluedf.keys())
+
+    glue_mly = gluedf['monthly budget']
+    assert gluedf['yearly budget'] is gluedf['yearly budget']
+    assert gluedf['monthly budget'] is glue_mly
+    assert calcul_mly_budget.call_count == 1
+
+    # The daily quantiles are kept when the products are invalidated,
+    # because the realizations of the behavioural models were released.
+    quantiles = gluedf['quantiles']
+    glue_dly = gluedf['daily budget']
+    gluedf.invalidate()
+    assert gluedf['quantiles'] is quantiles
+    assert np.array_equal(gluedf['daily budget']['recharge'],
+                          glue_dly['recharge'])
+    assert np.array_equal(gluedf['monthly budget']['recharge'],
+                          glue_mly['recharge'], equal_nan=True)
+    assert calcul_mly_budget.call_count == 2
+
+
+def test_gluedf_glue_at(rechg_worker):
+    """
+    Test that the GLUE values can be computed for any probabilities when
+    the sorted realizations are kept, and that they are interpolated in the
+    daily quantiles otherwise.
+    """
+    rechg_worker.glue_keep_sorted = True
+    gluedf = rechg_worker.eval_recharge()
+
+    glue_limits = [0.05, 0.25, 0.5, 0.75, 0.95]
+    assert np.array_equal(gluedf.glue_at(glue_limits),
+                          gluedf['daily budget']['recharge'])
+    assert np.array_equal(gluedf.glue_at(glue_limits, 'runoff', 'monthly'),
+                          gluedf['monthly budget']['runoff'], equal_nan=True)
+    assert np.array_equal(
+        gluedf.glue_at(glue_limits, 'evapo', 'hydro yearly'),
+        gluedf['hydrol yearly budget']['evapo'])
+    assert np.array_equal(gluedf.glue_at([0.05, 0.5, 0.95], 'water levels'),
+                          gluedf['water levels']['predicted'])
+
+    rechg = gluedf.glue_at([0.05, 0.1, 0.9, 0.95], 'recharge', 'yearly')
+    assert rechg.shape == (len(gluedf['yearly budget']['years']), 4)
+    assert np.all(np.diff(rechg, axis=1)[~np.isnan(rechg[:, 0])] >= 0)
+
+    with pytest.raises(ValueError):
+        gluedf.glue_at([0.5], 'water levels', 'monthly')
+
+    # Assert that the GLUE values are taken from the daily quantiles once
+    # the sorted realizations are released, exactly for the probabilities
+    # that are on the grid and interpolated for the others.
+    p = [0.025, 0.1, 0.9, 0.975]
+    expected = {variable: gluedf.glue_at(p, variable) for
+                variable in ['recharge', 'evapo', 'water levels']}
+    expected_mid = gluedf.glue_at([0.33, 0.66])
+    gluedf.release_data()
+    assert np.array_equal(gluedf.glue_at(0.95, 'recharge', 'daily'),
+                          gluedf['daily budget']['recharge'][:, [4]])
+    for variable in ['recharge', 'evapo', 'water levels']:
+        assert np.array_equal(gluedf.glue_at(p, variable), expected[variable])
+    assert np.allclose(gluedf.glue_at([0.33, 0.66]), expected_mid,
+                       atol=0.05 * np.max(expected_mid))
+    with pytest.raises(ValueError):
+        gluedf.glue_at([1.5])
+
+
+@pytest.mark.parametrize("executor", ['process', 'thread'])
+def test_eval_recharge_parallel(rechg_worker, executor):
+    """
+    Test that the results of GLUE are the same and in the same order
+    when the models are evaluated with a pool of processes or threads.
+    """
+    # Several chunks of GLUE_CHUNKSIZE parameter combinations are evaluated
+    # with the fine resolution.
+    rechg_worker.glue_pardist_res = 'fine'
+    gluedf_serial = rechg_worker.eval_recharge()
+
+    rechg_worker.glue_nworkers = 2
+    rechg_worker.glue_executor = executor
+    progress = []
+    rechg_worker.sig_glue_progress.connect(progress.append)
+    gluedf_parallel = rechg_worker.eval_recharge()
+
+    assert gluedf_parallel['count'] == gluedf_serial['count']
+    for key in ['Cru', 'RASmax', 'Sy']:
+        assert np.array_equal(gluedf_parallel['params'][key],
+                              gluedf_serial['params'][key])
+    assert np.array_equal(gluedf_parallel['RMSE'], gluedf_serial['RMSE'])
+    assert progress[0] == 0
+    assert progress[-1] == pytest.approx(100)
+
+
+def test_eval_recharge_multiwell(rechg_worker):
+    """
+    Test that the results of GLUE evaluated jointly for several wells
+    sharing the same weather data are the same as the ones evaluated
+    separately for each well.
+    """
+    workers = [rechg_worker]
+    for Sy, A, B in [(0.15, 0.01, 0.03), (0.08, 0.03, 0.07)]:
+        wxdset, wldset = make_synthetic_datasets(Sy=Sy, A=A, B=B)
+        worker = RechgEvalWorker()
+        worker.Sy = (0.05, 0.2)
+        worker.Cro = (0.1, 0.3)
+        worker.RASmax = (10, 30)
+        worker.glue_pardist_res = 'rough'
+        worker.load_data(wxdset, wldset)
+        workers.append(worker)
+
+    progress = []
+    workers[0].sig_glue_progress.connect(progress.append)
+    gluedfs = eval_recharge_multiwell(workers)
+    assert len(gluedfs) == 3
+    assert progress[-1] == pytest.approx(100)
+    for worker, gluedf in zip(workers, gluedfs):
+        expected = worker.eval_recharge()
+        assert gluedf['count'] == expected['count']
+        for key in ['Cru', 'RASmax', 'Sy']:
+            assert np.array_equal(gluedf['params'][key],
+                                  expected['params'][key])
+        assert np.array_equal(gluedf['daily budget']['recharge'],
+                              expected['daily budget']['recharge'])
+        assert np.array_equal(gluedf['water levels']['predicted'],
+                              expected['water levels']['predicted'])
+
+    # The wells must share the same weather data, the same ranges of Cro
+    # and RASmax and the same sampler settings.
+    for name, value in [('CM', 3), ('Cro', (0.1, 0.4)), ('RASmax', (5, 30)),
+                        ('glue_pardist_res', 'fine'),
+                        ('glue_sampler', 'lhs'), ('glue_sampler_seed', 1)]:
+        default = getattr(workers[1], name)
+        setattr(workers[1], name, value)
+        with pytest.raises(ValueError):
+            eval_recharge_multiwell(workers)
+        setattr(workers[1], name, default)
+
+
+@pytest.mark.parametrize("nworkers,executor",
+                         [(1, 'process'), (2, 'process'), (2, 'thread')])
+def test_cancel_eval_recharge(rechg_worker, nworkers, executor):
+    """Test that the GLUE calculation can be canceled."""
+    rechg_worker.glue_nworkers = nworkers
+    rechg_worker.glue_executor = executor
+    rechg_worker.sig_glue_progress.connect(
+        lambda value: value > 0 and rechg_worker.cancel_glue_calcul())
+    finished = []
+    rechg_worker.sig_glue_finished.connect(finished.append)
+
+    assert rechg_worker.eval_recharge() is None
+    assert rechg_worker.glue_canceled
+    assert finished == [None]
+
+
+def test_cancel_glue_calcul_from_widget(qtbot, mocker, tmpdir):
+    """
+    Test that the GLUE calculation that is running in the thread of the
+    RechgEvalWidget can be canceled with its cancel button.
+    """
+    widget = RechgEvalWidget(None)
+    qtbot.addWidget(widget)
+    assert widget.btn_calib.isEnabled()
+    assert not widget.btn_cancel.isEnabled()
+    assert not widget.cache_models
+
+    wxdset, wldset = make_synthetic_datasets()
+    worker = widget.rechg_worker
+    worker.glue_pardist_res = 'fine'
+    worker.load_data(wxdset, wldset)
+    mocker.patch.object(worker, 'load_data', return_value=None)
+    widget.wldset = mocker.Mock()
+    widget.wldset.dset.file.filename = str(tmpdir.join('projet.gwt'))
+    worker.sig_glue_progress.connect(
+        lambda value: value > 0 and widget.btn_cancel.click())
+
+    with qtbot.waitSignal(worker.sig_glue_finished, timeout=60000) as blocker:
+        widget.start_glue_calcul()
+        assert not widget.btn_calib.isEnabled()
+        assert widget.btn_cancel.isEnabled()
+    assert blocker.args == [None]
+    assert worker.glue_canceled
+    assert widget.btn_calib.isEnabled()
+    assert not widget.btn_cancel.isEnabled()
+    widget.wldset.save_glue.assert_not_called()
+    widget.rechg_thread.wait()
+
+    # The models must not be cached in the project folder by default.
+    assert worker.glue_cache_dirname is None
+    assert not tmpdir.join('GLUE Cache').exists()
+
+
+def test_eval_recharge_pruning(rechg_worker):
+    """
+    Test that pruning the hopeless models during the optimization of Sy
+    produces the same set of behavioural models and that the rejected
+    models are counted in the run report.
+    """
+    rechg_worker.Cro = (0, 0.6)
+    rechg_worker.RASmax = (0, 100)
+    rechg_worker.Sy = (0.08, 0.12)
+    rechg_worker.glue_rmse_max = 50
+    gluedf = rechg_worker.eval_recharge()
+    report = rechg_worker.glue_report.copy()
+    assert report['pruned Sy'] == report['pruned RMSE'] == 0
+    assert report['rejected Sy'] > 0
+    assert report['rejected RMSE'] > 0
+    assert np.max(gluedf['RMSE']) <= 50
+
+    rechg_worker.glue_pruning = True
+    gluedf_pruned = rechg_worker.eval_recharge()
+    report_pruned = rechg_worker.glue_report
+    assert report_pruned['pruned Sy'] > 0
+    assert report_pruned['pruned RMSE'] > 0
+    assert report_pruned['evaluated'] == report['evaluated']
+    assert report_pruned['behavioural'] == report['behavioural']
+    assert (report_pruned['evaluated'] ==
+            sum(report_pruned[key] for key in report_pruned
+                if key not in ['evaluated', 'cached']))
+    assert np.array_equal(gluedf_pruned['params']['Cru'],
+                          gluedf['params']['Cru'])
+
+
+@pytest.mark.parametrize("nworkers", [1, 2])
+def test_eval_recharge_cache(rechg_worker, tmpdir, nworkers):
+    """
+    Test that only the new parameter combinations are evaluated when GLUE
+    is computed again after widening the parameter ranges.
+    """
+    rechg_worker.glue_nworkers = nworkers
+    rechg_worker.glue_cache_dirname = str(tmpdir)
+    rechg_worker.eval_recharge()
+    report = rechg_worker.glue_report.copy()
+    assert report['cached'] == 0
+    assert len(tmpdir.listdir()) == 1
+
+    rechg_worker.RASmax = (10, 40)
+    gluedf = rechg_worker.eval_recharge()
+    assert rechg_worker.glue_report['cached'] == report['evaluated']
+    assert rechg_worker.glue_report['evaluated'] == 21 * 7
+
+    # Compare with the results obtained without the cache.
+    rechg_worker.glue_cache_dirname = None
+    gluedf_nocache = rechg_worker.eval_recharge()
+    assert gluedf['count'] == gluedf_nocache['count']
+    for key in ['Cru', 'RASmax']:
+        assert np.array_equal(gluedf['params'][key],
+                              gluedf_nocache['params'][key])
+    assert np.allclose(gluedf['params']['Sy'],
+                       gluedf_nocache['params']['Sy'], atol=0.001)
+    assert np.allclose(gluedf['daily budget']['recharge'],
+                       gluedf_nocache['daily budget']['recharge'])
+
+    # The cache must not be reused when the inputs change.
+    rechg_worker.glue_cache_dirname = str(tmpdir)
+    rechg_worker.CM = 3
+    rechg_worker.eval_recharge()
+    assert rechg_worker.glue_report['cached'] == 0
+    assert len(tmpdir.listdir()) == 2
+
+    # Nor when the settings of the optimization of Sy change.
+    for name, value in [('glue_optimizer', 'batch'), ('glue_sy_tol', 1e-4),
+                        ('glue_sy_maxiter', 50)]:
+        setattr(rechg_worker, name, value)
+        rechg_worker.eval_recharge()
+        assert rechg_worker.glue_report['cached'] == 0
+    assert len(tmpdir.listdir()) == 5
+
+
+def test_realization_cache_eviction(tmpdir):
+    """
+    Test that the least recently used cache files are deleted when the
+    size of the cache exceeds its maximum size.
+    """
+    series = {name: np.ones(1000) for name in
+              ['hydrograph', 'recharge', 'etr', 'ru']}
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache = RealizationCache(str(tmpdir), key, max_size=1e9)
+        cache.put(dict(Cru=0.1, RASmax=10, Sy=0.1, RMSE=1, **series))
+        cache.put(dict(Cru=0.2, RASmax=10, Sy=0.3, RMSE=2))
+        cache.close()
+        os.utime(str(tmpdir.join(key + '.h5')), (i, i))
+    size = tmpdir.join('a.h5').size()
+
+    cache = RealizationCache(str(tmpdir), 'a', max_size=2.5 * size)
+    assert len(cache) == 2
+    assert (0.1, 10) in cache
+    assert 'recharge' in cache.get(0.1, 10)
+    assert 'recharge' not in cache.get(0.2, 10)
+    assert cache.get(0.3, 10) is None
+    cache.close()
+    assert sorted(f.basename for f in tmpdir.listdir()) == ['a.h5', 'c.h5']
+
+    # The file of the cache that was just written must never be evicted,
+    # even when it is larger than the maximum size by itself.
+    cache = RealizationCache(str(tmpdir), 'b', max_size=1)
+    cache.put(dict(Cru=0.1, RASmax=10, Sy=0.1, RMSE=1, **series))
+    cache.close()
+    assert [f.basename for f in tmpdir.listdir()] == ['b.h5']
+    assert len(RealizationCache(str(tmpdir), 'b', max_size=1)) == 1
+
+
+@pytest.mark.parametrize("sampler", ['lhs', 'sobol'])
+def test_eval_recharge_random_sampler(rechg_worker, sampler):
+    """
+    Test that the parameter combinations are drawn within the parameter
+    ranges and that batches are drawn until the target number of
+    behavioural models is reached.
+    """
+    rechg_worker.glue_sampler = sampler
+    rechg_worker.glue_nsamples = 50
+    rechg_worker.glue_sampler_seed = 0
+    gluedf = rechg_worker.eval_recharge()
+    assert 0 < gluedf['count'] <= 50
+    assert np.min(gluedf['params']['Cru']) >= 0.1
+    assert np.max(gluedf['params']['Cru']) <= 0.3
+    assert np.min(gluedf['params']['RASmax']) >= 10
+    assert np.max(gluedf['params']['RASmax']) <= 30
+
+    rechg_worker.glue_target_count = gluedf['count'] + 10
+    gluedf = rechg_worker.eval_recharge()
+    assert gluedf['count'] >= rechg_worker.glue_target_count
+
+
+def test_adaptive_sampler():
+    """
+    Test that the adaptive sampler refines its sampling in the region of
+    the behavioural models.
+    """
+    sampler = AdaptiveSampler([(0, 1), (0, 100)], 20, target_count=30,
+                              seed=0, margin=0.1)
+    params = sampler.next_batch(None)
+    assert len(params) == 20
+
+    behavioural = [(0.5, 50), (0.6, 60)]
+    params = sampler.next_batch(behavioural)
+    assert len(params) == 20
+    assert np.all((params[:, 0] >= 0.4) & (params[:, 0] <= 0.7))
+    assert np.all((params[:, 1] >= 40) & (params[:, 1] <= 70))
+
+    assert sampler.next_batch(behavioural * 15) is None
+
+
+def test_eval_recharge_adaptive(rechg_worker):
+    """Test that GLUE can be computed with the adaptive sampler."""
+    rechg_worker.glue_sampler = 'adaptive'
+    rechg_worker.glue_nsamples = 30
+    rechg_worker.glue_target_count = 40
+    rechg_worker.glue_sampler_seed = 0
+    gluedf = rechg_worker.eval_recharge()
+    assert gluedf['count'] >= 40
+
+
+@pytest.mark.parametrize("backend", ['memory', 'memmap'])
+def test_realization_store(tmpdir, backend):
+    """
+    Test that the realizations are stored correctly when the store is
+    grown by chunks.
+    """
+    store = RealizationStore(['recharge', 'hydrograph'], chunksize=3,
+                             backend=backend, dirname=str(tmpdir))
+    rs = np.random.RandomState(0)
+    expected = {'recharge': rs.rand(8, 10), 'hydrograph': rs.rand(8, 5)}
+    for i in range(8):
+        store.append(recharge=expected['recharge'][i],
+                     hydrograph=expected['hydrograph'][i])
+    assert store.count == 8
+    for var in ['recharge', 'hydrograph']:
+        assert store[var].dtype == np.float32
+        assert np.allclose(store[var], expected[var])
+
+    with pytest.raises(ValueError):
+        store.append(recharge=expected['recharge'][0])
+
+    store.close()
+    assert store.count == 0
+    assert len(tmpdir.listdir()) == 0
+
+
+def test_eval_recharge_memmap(rechg_worker, tmpdir):
+    """
+    Test that the results of GLUE are the same when the realizations are
+    saved in memory-mapped files.
+    """
+    gluedf = rechg_worker.eval_recharge()
+
+    rechg_worker.glue_store_backend = 'memmap'
+    rechg_worker.glue_store_dirname = str(tmpdir)
+    gluedf_memmap = rechg_worker.eval_recharge()
+
+    assert np.array_equal(gluedf_memmap['daily budget']['recharge'],
+                          gluedf['daily budget']['recharge'])
+    assert np.array_equal(gluedf_memmap['water levels']['predicted'],
+                          gluedf['water levels']['predicted'])
+    assert len(tmpdir.listdir()) == 0
+
+
+def test_calcul_glue(mocker):
+    """
+    Test that calcul_glue returns the same weighted quantiles as the
+    interpolation of the cumulative density function of each day, when the
+    days are processed by blocks.
+    """
+    rs = np.random.RandomState(0)
+    x = rs.gamma(0.5, 2, (50, 40)).astype(np.float32)
+    x[:, ::3] = 0
+    x[:, 1] = x[:, 2]
+    x[:, 5] = 1.5
+    rmse = rs.uniform(1, 10, 50)
+    p = [0, 0.05, 0.25, 0.5, 0.75, 0.95, 1]
+
+    weights = (1 / rmse) / np.sum(1 / rmse)
+    expected = np.zeros((40, len(p)))
+    for i in range(40):
+        isort = np.argsort(x[:, i])
+        expected[i] = np.interp(p, np.cumsum(weights[isort]), x[isort, i])
+
+    mocker.patch('gwhat.gwrecharge.glue.GLUE_BLOCKSIZE', 50 * 7)
+    glue_values = calcul_glue({'recharge': x, 'RMSE': rmse}, p)
+    assert np.array_equal(glue_values, expected)
+
+    # Assert that the same values are computed from the sorted
+    # realizations.
+    sorted_x = glue.SortedRealizations(x, weights)
+    assert np.array_equal(sorted_x.quantiles(p), expected)
+
+
+def test_calcul_budgets():
+    """
+    Test that the monthly and hydrological yearly budgets are computed
+    correctly from the daily budget, and that the incomplete months are set
+    to nan.
+    """
+    # The daily budget starts on November 15, 2000 and ends on
+    # March 10, 2003.
+    dates = np.arange('2000-11-15', '2003-03-11', dtype='datetime64[D]')
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+    months = dates.astype('datetime64[M]').astype(int) % 12 + 1
+    ndays = len(dates)
+    glue_dly = {'years': years, 'months': months,
+                'GLUE limits': [0.05, 0.5, 0.95],
+                'precip': np.ones(ndays)}
+    for var in ['recharge', 'evapo', 'runoff']:
+        glue_dly[var] = np.ones((ndays, 3)) * [1, 2, 3]
+
+    glue_mly = calcul_mly_budget(glue_dly)
+    assert np.array_equal(glue_mly['years'], [2000, 2001, 2002, 2003])
+    assert glue_mly['recharge'].shape == (4, 12, 3)
+    assert np.all(np.isnan(glue_mly['precip'][0, :11]))
+    assert glue_mly['precip'][0, 11] == 31
+    assert np.array_equal(glue_mly['precip'][1], [
+        31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    assert np.array_equal(glue_mly['recharge'][1, 1], [28, 56, 84])
+    assert np.array_equal(glue_mly['precip'][3, :2], [31, 28])
+    assert np.all(np.isnan(glue_mly['precip'][3, 2:]))
+
+    glue_yrly = calcul_hydro_yrly_budget(glue_dly)
+    assert np.array_equal(glue_yrly['years'], [2000, 2001, 2002])
+    assert np.array_equal(glue_yrly['precip'], [320, 365, 161])
+    assert np.array_equal(glue_yrly['runoff'][1], [365, 730, 1095])
+
+
+def test_weighted_quantile_sketch():
+    """
+    Test that the quantiles estimated with the sketch are the same as the
+    ones computed by calcul_glue when the sketch is not full, and that the
+    error on their probability is bounded otherwise.
+    """
+    rs = np.random.RandomState(0)
+    x = rs.lognormal(0, 1, (2000, 30)) * np.arange(30)
+    rmse = rs.uniform(1, 10, 2000)
+    p = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+    sketch = WeightedQuantileSketch(size=100)
+    for i in range(100):
+        sketch.update(x[i], 1 / rmse[i])
+    expected = calcul_glue({'recharge': x[:100], 'RMSE': rmse[:100]}, p)
+    assert np.allclose(sketch.quantiles(p), expected)
+
+    for i in range(100, 2000):
+        sketch.update(x[i], 1 / rmse[i])
+    assert sketch.count == 2000
+    assert sketch.nbytes <= 4 * 100 * 30 * 8
+    q = sketch.quantiles(p)
+    weights = (1 / rmse) / np.sum(1 / rmse)
+    for j in range(1, 30):
+        cdf = [np.sum(weights[x[:, j] <= qk]) for qk in q[j]]
+        assert np.allclose(cdf, p, atol=2 / 100)
+
+
+def test_eval_recharge_streaming(rechg_worker):
+    """
+    Test that the GLUE limits computed with the streaming quantile sketches
+    are close to the ones computed from the realizations.
+    """
+    # Noise is added to the observed water levels, so that the weights of
+    # the models are not all carried by the one used to produce them.
+    rechg_worker.wlobs = rechg_worker.wlobs + np.random.RandomState(0).normal(
+        0, 0.02, len(rechg_worker.wlobs))
+    gluedf = rechg_worker.eval_recharge()
+
+    rechg_worker.glue_streaming = True
+    for size, rtol, atol in [(gluedf['count'], 0.001, 1), (20, 0.05, 15)]:
+        rechg_worker.glue_sketch_size = size
+        gluedf_stream = rechg_worker.eval_recharge()
+        assert gluedf_stream['count'] == gluedf['count']
+        for key in ['recharge', 'evapo', 'runoff']:
+            assert np.allclose(
+                gluedf_stream['hydrol yearly budget'][key],
+                gluedf['hydrol yearly budget'][key], rtol=rtol)
+        assert np.allclose(gluedf_stream['water levels']['predicted'],
+                           gluedf['water levels']['predicted'], atol=atol)
+
+
+def test_update_recharge(rechg_worker):
+    """
+    Test that GLUE results are updated with the data appended to the
+    datasets by extending the behavioural models over the new days only.
+    """
+    wxdset, wldset = make_synthetic_datasets()
+    ndays = len(wxdset['Time'])
+    old_wxdset = {key: value[:730] if np.size(value) == ndays else value
+                  for key, value in wxdset.items()}
+    old_wldset = {key: value[:600] if np.size(value) == ndays else value
+                  for key, value in wldset.items()}
+    rechg_worker.load_data(old_wxdset, old_wldset)
+    gluedf = rechg_worker.eval_recharge()
+
+    worker = RechgEvalWorker()
+    worker.load_data(wxdset, wldset)
+    new_gluedf = worker.update_recharge(gluedf)
+    assert new_gluedf['count'] == gluedf['count']
+    assert np.array_equal(new_gluedf['params']['Sy'], gluedf['params']['Sy'])
+
+    # Simulate the behavioural models over the whole period with the same
+    # values of Sy to get the expected results.
+    ts = np.where(worker.twlvl[0] == worker.tweatr)[0][0]
+    te = np.where(worker.twlvl[-1] == worker.tweatr)[0][0]
+    rechgs = worker.surf_water_budget_batch(
+        gluedf['params']['Cru'], gluedf['params']['RASmax'])[0]
+    hydrographs = np.array([worker.calc_hydrograph(rechg[ts:te], Sy) for
+                            rechg, Sy in zip(rechgs, gluedf['params']['Sy'])])
+    expected = {'RMSE': np.sqrt(np.nanmean(
+                    (worker.wlobs * 1000 - hydrographs)**2, axis=1)),
+                'recharge': rechgs, 'hydrograph': hydrographs}
+    # The water levels at the end of the previous data are taken from the
+    # hydrographs that are stored in float32, so the RMSE of the models
+    # that fit the synthetic data almost perfectly can differ by much less
+    # than a micrometer.
+    assert np.allclose(new_gluedf['RMSE'], expected['RMSE'], atol=1e-3)
+
+    # The GLUE limits of the days before the end of the previous water level
+    # data are kept, while the ones of the following days are computed with
+    # the updated RMSE.
+    limits = new_gluedf['daily budget']['GLUE limits']
+    new_rechg = new_gluedf['daily budget']['recharge']
+    assert len(new_rechg) == ndays
+    assert np.array_equal(new_rechg[:599],
+                          gluedf['daily budget']['recharge'][:599])
+    assert np.allclose(new_rechg[599:],
+                       calcul_glue(expected, limits, 'recharge')[599:])
+    new_wl = new_gluedf['water levels']['predicted']
+    assert len(new_wl) == ndays
+    assert np.array_equal(new_wl[:600],
+                          gluedf['water levels']['predicted'])
+    assert np.allclose(new_wl[600:], calcul_glue(
+        expected, [0.05, 0.5, 0.95], 'hydrograph')[600:])
+
+    # Assert that the daily quantiles are updated the same way, so that
+    # the updated results can be queried for any probabilities.
+    assert np.array_equal(new_gluedf.glue_at([0.1, 0.9])[:599],
+                          gluedf.glue_at([0.1, 0.9])[:599])
+    assert np.allclose(new_gluedf.glue_at([0.1, 0.9])[599:], calcul_glue(
+        expected, [0.1, 0.9], 'recharge')[599:])
+
+    # Assert that the RMSE used to weight the models before and after the
+    # end of the previous water level data are recorded in the results.
+    assert np.array_equal(new_gluedf['weights']['time'],
+                          [wxdset['Time'][0], wldset['Time'][599]])
+    assert np.allclose(new_gluedf['weights']['RMSE'],
+                       [gluedf['RMSE'], new_gluedf['RMSE']])
+
+    # Assert that the updated results can be updated again.
+    newer_gluedf = worker.update_recharge(new_gluedf)
+    assert np.allclose(newer_gluedf['RMSE'], new_gluedf['RMSE'])
+    assert len(newer_gluedf['weights']['RMSE']) == 3
+
+    # The hydrographs produced with the backward scheme cannot be extended.
+    rechg_worker.hydrograph_scheme = 'backward'
+    with pytest.raises(ValueError):
+        worker.update_recharge(rechg_worker.eval_recharge())
+
+
+def make_synthetic_projet(filename):
+    """
+    Produce a project with two wells and two weather stations, where the
+    first well is located closer to the second weather station.
+    """
+    wxdset, wldset = make_synthetic_datasets()
+    projet = ProjetReader(filename)
+    for name, lat in [('Station1', 48), ('Station2', 45)]:
+        df = dict(wxdset, filename='', Latitude=lat, Snow=wxdset['Ptot'] * 0,
+                  yearly={}, monthly={}, normals={})
+        for var in ['Tmax', 'Tmin', 'Tavg', 'Ptot']:
+            df['Missing ' + var] = []
+        if name == 'Station1':
+            # Make the weather data of the first station unusable.
+            df['Time'] = df['Time'] + 10 * 365
+        projet.add_wxdset(name, df)
+    for name in ['Well1', 'Well2']:
+        df = dict(wldset, filename='', BP=[], ET=[],
+                  Latitude=45.1 if name == 'Well1' else 47.9)
+        projet.add_wldset(name, df).set_mrc(
+            *wldset['mrc/params'], [], wldset['mrc/time'],
+            wldset['mrc/recess'])
+    projet.close_projet()
+
+
+def test_glue_layout_migration(rechg_worker, tmpdir):
+    """
+    Test that GLUE results saved in the old and new layouts can be read,
+    and that the old ones can be migrated to the new layout.
+    """
+    filename = str(tmpdir.join('projet.gwt'))
+    make_synthetic_projet(filename)
+    gluedf = rechg_worker.eval_recharge()
+
+    # Save the GLUE results once in the old layout and once in the
+    # new layout.
+    projet = ProjetReader(filename)
+    wldset = projet.get_wldset('Well1')
+    save_dict_to_h5grp(wldset.dset['glue'].create_group('1'), gluedf)
+    wldset.save_glue(gluedf)
+    old_gluedf = wldset.get_glue('1')
+    new_gluedf = wldset.get_glue('2')
+    assert old_gluedf.layout == 1
+    assert new_gluedf.layout == 2
+
+    dset = new_gluedf.store['daily budget/recharge']
+    assert dset.dtype == np.float32
+    assert dset.compression == 'gzip'
+    assert dset.chunks is not None
+    assert new_gluedf.store['RMSE'].dtype == np.float64
+    for gluedf_hdf5 in [old_gluedf, new_gluedf]:
+        rechg = gluedf_hdf5['daily budget']['recharge']
+        assert rechg.dtype == np.float64
+        assert np.allclose(rechg, gluedf['daily budget']['recharge'],
+                           rtol=1e-6)
+        assert np.array_equal(gluedf_hdf5['RMSE'], gluedf['RMSE'])
+        assert gluedf_hdf5['params']['tmelt'] == gluedf['params']['tmelt']
+
+    # Assert that the GLUE values of the saved results can be queried for
+    # any probabilities.
+    for variable, period in [('recharge', 'daily'), ('runoff', 'monthly'),
+                             ('water levels', 'daily')]:
+        assert np.allclose(
+            new_gluedf.glue_at([0.025, 0.1, 0.9, 0.975], variable, period),
+            gluedf.glue_at([0.025, 0.1, 0.9, 0.975], variable, period),
+            rtol=1e-6, equal_nan=True)
+    projet.close_projet()
+    size = os.path.getsize(filename)
+
+    # Migrate the GLUE results saved in the old layout.
+    assert migrate_projet_glue(filename) == 1
+    assert migrate_projet_glue(filename) == 0
+    assert os.path.getsize(filename) < size
+
+    projet = ProjetReader(filename)
+    wldset = projet.get_wldset('Well1')
+    assert wldset.glue_idnums() == ['1', '2']
+    assert wldset.get_glue('1').layout == 2
+    assert np.array_equal(wldset.get_glue('1')['monthly budget']['recharge'],
+                          wldset.get_glue('2')['monthly budget']['recharge'],
+                          equal_nan=True)
+    projet.close_projet()
+
+
+def test_get_between_times(rechg_worker, tmpdir):
+    """
+    Test that the time series of the water level, weather and GLUE datasets
+    can be read for a window of time.
+    """
+    filename = str(tmpdir.join('projet.gwt'))
+    make_synthetic_projet(filename)
+    gluedf = rechg_worker.eval_recharge()
+    projet = ProjetReader(filename)
+    wldset = projet.get_wldset('Well1')
+    wxdset = projet.get_wxdset('Station2')
+    wldset.save_glue(gluedf)
+    gluedf_hdf5 = wldset.get_glue_at(-1)
+
+    time = wldset['Time']
+    tmin, tmax = time[100] - 0.5, time[200]
+    assert np.array_equal(wldset.get('Time', tmin, tmax), time[100:201])
+    assert np.array_equal(wldset.get('WL', tmin, tmax), wldset['WL'][100:201])
+    assert np.array_equal(wldset.get('WL', tmax=tmax), wldset['WL'][:201])
+    assert np.array_equal(wldset.get('mrc/recess', tmin),
+                          wldset['mrc/recess'][100:])
+    assert len(wldset.get('WL', time[-1] + 1)) == 0
+    assert wldset.get('Well') == 'Synthetic'
+    assert np.array_equal(wxdset.get('Ptot', tmin, tmax),
+                          wxdset['Ptot'][100:201])
+    assert np.array_equal(wxdset.get('Year'), wxdset['Year'])
+
+    for df in [gluedf, gluedf_hdf5]:
+        glue_wl = df.get('water levels', tmin, tmax)
+        assert np.array_equal(glue_wl['time'], time[100:201])
+        assert np.allclose(glue_wl['predicted'],
+                           gluedf['water levels']['predicted'][100:201])
+        assert glue_wl['GLUE limits'] == pytest.approx([0.05, 0.5, 0.95])
+        glue_dly = df.get('daily budget', tmin, tmax)
+        assert np.allclose(glue_dly['recharge'],
+                           gluedf['daily budget']['recharge'][100:201])
+        assert np.array_equal(df.get('RMSE'), gluedf['RMSE'])
+    projet.close_projet()
+
+
+def test_eval_recharge_for_projet(tmpdir):
+    """
+    Test that recharge is evaluated with GLUE for all the wells of a project
+    with the closest weather station and that the results are saved in the
+    project.
+    """
+    filename = str(tmpdir.join('projet.gwt'))
+    make_synthetic_projet(filename)
+    params = {'Sy': (0.05, 0.2), 'Cro': (0.1, 0.3), 'RASmax': (10, 30),
+              'glue_pardist_res': 'rough'}
+
+    errors = eval_recharge_for_projet(filename, nworkers=2, **params)
+    assert errors['Well1'] is None
+    assert errors['Well2'] is not None
+
+    projet = ProjetReader(filename)
+    gluedf = projet.get_wldset('Well1').get_glue_at(-1)
+    assert gluedf['count'] > 0
+    assert tuple(gluedf['ranges']['RASmax']) == (10, 30)
+    rasmax = gluedf['params']['RASmax']
+    assert gluedf['params'] is gluedf['params']
+    assert 'daily budget' in gluedf and 'foo' not in gluedf
+    with pytest.raises(KeyError):
+        gluedf['foo']
+    assert projet.get_wldset('Well2').glue_count() == 0
+    projet.close_projet()
+
+    # Assert that the GLUE results are replaced when recharge is evaluated
+    # again from the console, with the parameters of the last results.
+    assert main([filename, '--wldsets', 'Well1', '--wxdset', 'Station2',
+                 '--nworkers', '1', '--resolution', 'rough']) == 0
+    projet = ProjetReader(filename)
+    assert projet.get_wldset('Well1').glue_count() == 1
+    gluedf = projet.get_wldset('Well1').get_glue_at(-1)
+    assert np.array_equal(gluedf['params']['RASmax'], rasmax)
+    projet.close_projet()
+
+    # Assert that the wells paired with the same weather station can be
+    # evaluated jointly.
+    errors = eval_recharge_for_projet(
+        filename, wxdset_name='Station2', nworkers=1, joint=True, **params)
+    assert errors == {'Well1': None, 'Well2': None}
+    projet = ProjetReader(filename)
+    for name in ['Well1', 'Well2']:
+        gluedf = projet.get_wldset(name).get_glue_at(-1)
+        assert np.array_equal(gluedf['params']['RASmax'], rasmax)
+    rmse = gluedf['RMSE']
+    dly_rechg = gluedf['daily budget']['recharge']
+    projet.close_projet()
+
+    # Assert that the saved GLUE results can be updated from the console.
+    # Since no data were appended, they must stay the same.
+    assert main([filename, '--wxdset', 'Station2', '--nworkers', '1',
+                 '--update']) == 0
+    projet = ProjetReader(filename)
+    gluedf = projet.get_wldset('Well2').get_glue_at(-1)
+    assert np.allclose(gluedf['RMSE'], rmse)
+    assert np.allclose(gluedf['daily budget']['recharge'], dly_rechg)
+    projet.close_projet()
+
+
+def test_glue_job_shards(tmpdir):
+    """
+    Test that the results of a GLUE job that is split in shards do not
+    depend on the number of shards and are the same as the ones of
+    eval_recharge.
+    """
+    wxdset, wldset = make_synthetic_datasets()
+    settings = {'Sy': (0.05, 0.2), 'Cro': (0.1, 0.4), 'RASmax': (10, 60),
+                'glue_pardist_res': 'fine'}
+    gluedfs = []
+    for count in [1, 3]:
+        jobdir = str(tmpdir.join('job%d' % count))
+        assert jobs.create_job(jobdir, wxdset, wldset, **settings) > 250
+        for index in range(count):
+            jobs.run_shard(jobdir, index, count)
+        gluedfs.append(jobs.merge_shards(jobdir))
+
+    worker = RechgEvalWorker()
+    for key, value in settings.items():
+        setattr(worker, key, value)
+    worker.load_data(wxdset, wldset)
+    gluedf = worker.eval_recharge()
+    assert gluedf['count'] > 0
+    for gluedf_shards in gluedfs:
+        assert gluedf_shards['count'] == gluedf['count']
+        assert np.array_equal(gluedf_shards['RMSE'], gluedf['RMSE'])
+        for key in ['Sy', 'Cru', 'RASmax']:
+            assert np.array_equal(gluedf_shards['params'][key],
+                                  gluedf['params'][key])
+        assert np.array_equal(gluedf_shards['daily budget']['recharge'],
+                              gluedf['daily budget']['recharge'])
+        assert np.array_equal(gluedf_shards['water levels']['predicted'],
+                              gluedf['water levels']['predicted'])
+
+    # Assert that the outputs of all the shards are required.
+    os.remove(os.path.join(jobdir, jobs.SHARD_FILENAME.format(1, 3)))
+    with pytest.raises(ValueError):
+        jobs.merge_shards(jobdir)
+
+    # Assert that the samplers whose batches depend on the behavioural
+    # models are refused.
+    with pytest.raises(ValueError):
+        jobs.create_job(str(tmpdir.join('job')), wxdset, wldset,
+                        glue_sampler='adaptive', **settings)
+
+
+def test_glue_job_console(tmpdir):
+    """
+    Test that a GLUE job can be created for a well of a project, evaluated
+    in shards and merged from the console.
+    """
+    filename = str(tmpdir.join('projet.gwt'))
+    jobdir = str(tmpdir.join('job'))
+    make_synthetic_projet(filename)
+    assert jobs.main(['create', filename, 'Well1', jobdir,
+                      '--resolution', 'rough']) == 0
+    for index in range(2):
+        assert jobs.main(['run', jobdir, '--shard', str(index),
+                          '--nshards', '2']) == 0
+    assert jobs.main(['merge', jobdir]) == 0
+
+    projet = ProjetReader(filename)
+    gluedf = projet.get_wldset('Well1').get_glue_at(-1)
+    assert gluedf['count'] > 0
+    assert tuple(gluedf['ranges']['Sy']) == (0.05, 0.2)
+    projet.close_projet()
+
+
+if __name__ == "__main__":
+    pytest.main(['-x', os.path.basename(__file__), '-v', '-rw'])
@@ -19,7 +19,8 @@ import pytest
 # ---- Local library imports
 
 from gwhat.meteo.weather_reader import (WXDataFrame, read_cweeds_file,
-                                        join_daily_cweeds_wy2_and_wy3)
+                                        join_daily_cweeds_wy2_and_wy3,
+                                        calc_monthly_sum, calc_yearly_mean)
 
 
 def test_read_weather_data():
@@ -62,6 +63,39 @@ def test_read_weather_data():
                           expected_results)
 
 
+def test_calc_monthly_and_yearly():
+    """
+    Test that monthly and yearly values are computed correctly from daily
+    values, and that the months with missing days are set to nan.
+    """
+    fmeteo = osp.join(osp.dirname(__file__), "sample_weather_datafile.csv")
+    wxdset = WXDataFrame(fmeteo)
+    years, months = wxdset['Year'], wxdset['Month']
+    ptot, tavg = wxdset['Ptot'], wxdset['Tavg']
+
+    # Remove the last 5 days of March 2012.
+    indx = np.where((years == 2012) & (months == 3))[0][-5:]
+    keep = np.ones(len(years), dtype=bool)
+    keep[indx] = False
+
+    yy_mly, mm_mly, ptot_mly = calc_monthly_sum(
+        years[keep], months[keep], ptot[keep])
+    assert np.array_equal(yy_mly, np.repeat(np.arange(2010, 2016), 12))
+    assert np.array_equal(mm_mly, np.tile(np.arange(1, 13), 6))
+    for i in range(len(yy_mly)):
+        if yy_mly[i] == 2012 and mm_mly[i] == 3:
+            assert np.isnan(ptot_mly[i])
+        else:
+            expected = np.sum(ptot[(years == yy_mly[i]) &
+                                   (months == mm_mly[i])])
+            assert np.isclose(ptot_mly[i], expected)
+
+    yy_yrly, tavg_yrly = calc_yearly_mean(years, tavg)
+    assert np.array_equal(yy_yrly, np.arange(2010, 2016))
+    assert np.allclose(tavg_yrly, [np.mean(tavg[years == year]) for
+                                   year in range(2010, 2016)])
+
+
 # ---- Test read_cweeds_file
 
 def test_read_cweeds_wy2_file():
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Copyright © 2014-2018 GWHAT Project Contributors
+# https://github.com/jnsebgosselin/gwhat
+#
+# This file is part of GWHAT (Ground-Water Hydrograph Analysis Toolbox).
+# Licensed under the terms of the GNU General Public License.
+
+"""
+Aggregation of daily time series over calendar years, months and
+hydrological years.
+
+The period of each day is computed once as an integer key, so that the
+daily values of any number of variables can then be summed or averaged
+over all the periods at once with np.add.reduceat.
+"""
+
+# ---- Third party imports
+
+import numpy as np
+
+
+PERIODS = ['yearly', 'monthly', 'hydro yearly']
+
+# The first month of an hydrological year, which is defined from
+# October 1 to September 30 of the next year.
+HYDRO_YEAR_START = 10
+
+
+class PeriodGroups(object):
+    """
+    Group the days defined by years and months (1 to 12) by calendar year
+    ('yearly'), by month ('monthly') or by hydrological year
+    ('hydro yearly').
+
+    The periods are :
+        yearly: each of the years found in years,
+        monthly: the 12 months of each of the years found in years,
+        hydro yearly: the hydrological years starting on October 1 of each
+                      year from the first to the second to last of years.
+
+    The counts attribute holds the number of days found for each period and
+    the ndays attribute holds the number of days of each period in the
+    calendar, so that incomplete periods can be flagged.
+    """
+
+    def __init__(self, years, months=None, period='monthly'):
+        if period not in PERIODS:
+            raise ValueError("period must be one of %s" % ', '.join(PERIODS))
+        if period != 'yearly' and months is None:
+            raise ValueError("months must be provided for %s periods" % period)
+        self.period = period
+
+        years = np.asarray(years)
+        iyears = years.astype('int64')
+        year_range = np.unique(years)
+        iyear_range = year_range.astype('int64')
+        if period == 'yearly':
+            self.years = year_range
+            self.months = None
+            keys = iyears
+            pkeys = iyear_range
+        elif period == 'monthly':
+            self.years = np.repeat(year_range, 12)
+            self.months = np.tile(np.arange(1, 13), len(year_range))
+            keys = iyears * 12 + (np.asarray(months).astype('int64') - 1)
+            pkeys = (np.repeat(iyear_range, 12) * 12 +
+                     np.tile(np.arange(12), len(year_range)))
+        else:
+            self.years = np.arange(np.min(years), np.max(years)).astype('int')
+            self.months = None
+            keys = iyears - (np.asarray(months) < HYDRO_YEAR_START)
+            pkeys = self.years.astype('int64')
+
+        # Find the period of each day. The days that are outside of all
+        # periods are given the index len(pkeys) and are discarded.
+        index = np.searchsorted(pkeys, keys)
+        inside = index < len(pkeys)
+        inside[inside] = pkeys[index[inside]] == keys[inside]
+        index[~inside] = len(pkeys)
+
+        # The days are sorted by period, which is required by reduceat, only
+        # when they are not already in chronological order.
+        if np.all(np.diff(index) >= 0):
+            self._order = None
+        else:
+            self._order = np.argsort(index, kind='stable')
+            index = index[self._order]
+        self.counts = np.bincount(index, minlength=len(pkeys) + 1)[:-1]
+        self._starts = np.searchsorted(index, np.arange(len(pkeys)))
+        self._nvalid = np.sum(index < len(pkeys))
+
+        self.ndays = self._calcul_ndays()
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def complete(self):
+        """
+        Return a boolean array that is True for the periods for which a
+        value is available for all days.
+        """
+        return self.counts >= self.ndays
+
+    def sum(self, x, complete=False):
+        """
+        Return the sum of the daily values x over each period, where x is an
+        array whose first axis matches the days. The periods without any day,
+        or the incomplete periods when complete is True, are set to nan.
+        """
+        x = np.asarray(x, dtype=float)
+        if self._order is not None:
+            x = x[self._order]
+        x = x[:self._nvalid]
+
+        shape = (len(self),) + x.shape[1:]
+        sums = np.full(shape, np.nan)
+        nonempty = self.counts > 0
+        if len(x):
+            sums[nonempty] = np.add.reduceat(
+                x, self._starts[nonempty], axis=0)
+        if complete:
+            sums[~self.complete] = np.nan
+        return sums
+
+    def mean(self, x, complete=False):
+        """
+        Return the mean of the daily values x over each period. See sum.
+        """
+        counts = self.counts.reshape((-1,) + (1,) * (np.ndim(x) - 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(x, complete) / counts
+
+    def aggregate(self, x, func, complete=False):
+        """
+        Return the values of func applied to the daily values x of each
+        period. The sum and mean are computed with reduceat, while any other
+        func is applied to the values of each period one at a time.
+        """
+        if func is np.sum:
+            return self.sum(x, complete)
+        if func is np.mean:
+            return self.mean(x, complete)
+
+        x = np.asarray(x)
+        if self._order is not None:
+            x = x[self._order]
+        values = np.full((len(self),) + x.shape[1:], np.nan)
+        for i in np.where(self.counts > 0)[0]:
+            start = self._starts[i]
+            values[i] = func(x[start:start + self.counts[i]], axis=0)
+        if complete:
+            values[~self.complete] = np.nan
+        return values
+
+    def _calcul_ndays(self):
+        """Return the number of days of each period in the calendar."""
+        years = self.years.astype('int64') - 1970
+        if self.period == 'yearly':
+            start = years.astype('datetime64[Y]')
+            end = start + 1
+        elif self.period == 'monthly':
+            start = (years * 12 + self.months - 1).astype('datetime64[M]')
+            end = start + 1
+        else:
+            start = (years * 12 + HYDRO_YEAR_START - 1).astype('datetime64[M]')
+            end = start + 12
+        return (end.astype('datetime64[D]') -
+                start.astype('datetime64[D]')).astype(int)
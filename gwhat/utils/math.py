@@ -61,3 +61,31 @@ def nan_as_text_tolist(arr):
     else:
         list_ = arr.tolist()
     return list_
+
+
+def find_time_slice(time, tmin=None, tmax=None):
+    """
+    Return the slice of the sorted time series time that holds the times
+    between tmin and tmax inclusively. time can be a numpy array or a
+    h5py dataset, in which case the slice is found by bisection, so that
+    only a few values of the dataset are read.
+    """
+    if isinstance(time, np.ndarray):
+        start = 0 if tmin is None else np.searchsorted(time, tmin, 'left')
+        stop = (len(time) if tmax is None else
+                np.searchsorted(time, tmax, 'right'))
+        return slice(int(start), int(max(start, stop)))
+
+    def bisect(value, right):
+        lo, hi = 0, len(time)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if time[mid] < value or (right and time[mid] == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    start = 0 if tmin is None else bisect(tmin, right=False)
+    stop = len(time) if tmax is None else bisect(tmax, right=True)
+    return slice(start, max(start, stop))